@@ -0,0 +1,7 @@
+"""
+Benchmarks de main.py con catálogos sintéticos.
+
+    python -m bench.catalog --size 10k --out /tmp/catalogo   # solo generar
+    python -m bench.run --sizes 1k,10k --out bench_results.json
+    python -m bench.compare antes.json despues.json
+"""
@@ -0,0 +1,132 @@
+"""
+Generador de catálogos sintéticos (topics.json + users.json) con el mismo
+formato en disco que usa main.py: mensajes como rangos compactos, un tema
+de películas y nombres con acentos, Ñ, números y símbolos.
+
+    python -m bench.catalog --size 50k --out /tmp/catalogo
+"""
+import argparse
+import json
+import random
+from pathlib import Path
+
+# temas, IDs de mensaje en total, películas y usuarios por tamaño
+SIZES = {
+    "1k": {"topics": 1_000, "messages": 50_000, "movies": 2_000, "users": 1_000},
+    "10k": {"topics": 10_000, "messages": 500_000, "movies": 20_000, "users": 10_000},
+    "50k": {"topics": 50_000, "messages": 3_000_000, "movies": 100_000, "users": 50_000},
+}
+
+PALABRAS = [
+    "Ángel", "Ñandú", "Niño", "Corazón", "Pasión", "Camión", "Último", "Épico",
+    "Órbita", "Sueño", "Mañana", "Canción", "Ébano", "Ídolo", "Úrsula", "Ñoño",
+    "amor", "guerra", "noche", "sombra", "ciudad", "perdido", "regreso", "rey",
+    "reina", "dragón", "mar", "sol", "luna", "fuego", "hielo", "tronos", "juego",
+    "casa", "papel", "médico", "policía", "secreto", "isla", "tiempo", "historia",
+    "la", "el", "de", "los", "las", "del", "y", "en",
+]
+PREFIJOS_RAROS = ["1923", "24", "#", "¡Ay", "¿Quién", "3%", "@", "007", "¡Ñam"]
+NOMBRES = ["María", "José", "Íñigo", "Begoña", "Óscar", "Ana", "Luis", "Núria", "Raúl", "Sofía"]
+
+
+def nombre_aleatorio(rnd: random.Random) -> str:
+    palabras = [rnd.choice(PALABRAS) for _ in range(rnd.randint(1, 4))]
+    if rnd.random() < 0.05:
+        palabras.insert(0, rnd.choice(PREFIJOS_RAROS))
+    palabras[0] = palabras[0][:1].upper() + palabras[0][1:]
+    return " ".join(palabras)
+
+
+def rangos_aleatorios(rnd: random.Random, siguiente: int, total: int):
+    """
+    Genera `total` IDs crecientes en rangos consecutivos con huecos.
+    Devuelve (texto_compacto, último_id_usado).
+    """
+    partes = []
+    quedan = total
+    while quedan > 0:
+        largo = min(quedan, rnd.randint(1, 60))
+        inicio = siguiente + rnd.randint(1, 5)
+        fin = inicio + largo - 1
+        partes.append(str(inicio) if inicio == fin else f"{inicio}-{fin}")
+        quedan -= largo
+        siguiente = fin
+    return ",".join(partes), siguiente
+
+
+def generar(size: str, seed: int = 2021):
+    """Devuelve (topics_raw, users_raw) listos para json.dump."""
+    cfg = SIZES[size]
+    rnd = random.Random(seed)
+    topics = {}
+    siguiente = 1000
+
+    # Reparto de mensajes: la mayoría de temas pequeños, unos pocos enormes
+    pesos = [rnd.paretovariate(1.2) for _ in range(cfg["topics"])]
+    escala = cfg["messages"] / sum(pesos)
+    base_time = 1_650_000_000.0
+
+    for n, peso in enumerate(pesos):
+        tid = str(2 + n * 3)
+        mensajes, siguiente = rangos_aleatorios(rnd, siguiente, max(1, int(peso * escala)))
+        topics[tid] = {
+            "name": nombre_aleatorio(rnd),
+            "messages": mensajes,
+            "created_at": base_time + n * 60,
+        }
+
+    # Tema de películas: un mensaje por película, título en la descripción
+    movies = []
+    ids = []
+    for n in range(cfg["movies"]):
+        siguiente += rnd.randint(1, 3)
+        ids.append(siguiente)
+        movies.append(
+            {
+                "id": siguiente,
+                "title": f"{nombre_aleatorio(rnd)} ({rnd.randint(1950, 2024)})",
+                "unique_id": f"AgAD{n:08d}",
+            }
+        )
+    topics["1"] = {
+        "name": "Películas",
+        "messages": ",".join(str(i) for i in ids),
+        "created_at": base_time,
+        "is_pelis": True,
+        "movies": movies,
+    }
+
+    users = {}
+    for n in range(cfg["users"]):
+        uid = 100_000_000 + n * 7
+        users[str(uid)] = {
+            "id": uid,
+            "name": f"{rnd.choice(NOMBRES)} {rnd.choice(PALABRAS)}",
+            "username": f"@user{n}" if rnd.random() < 0.6 else "",
+            "first_seen": base_time + n,
+        }
+    return topics, users
+
+
+def escribir(destino: Path, size: str, seed: int = 2021):
+    destino.mkdir(parents=True, exist_ok=True)
+    topics, users = generar(size, seed)
+    with open(destino / "topics.json", "w", encoding="utf-8") as f:
+        json.dump(topics, f, indent=4, ensure_ascii=False)
+    with open(destino / "users.json", "w", encoding="utf-8") as f:
+        json.dump(users, f, indent=4, ensure_ascii=False)
+    return topics, users
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--size", choices=sorted(SIZES), default="1k")
+    parser.add_argument("--out", type=Path, required=True)
+    parser.add_argument("--seed", type=int, default=2021)
+    args = parser.parse_args()
+    topics, users = escribir(args.out, args.size, args.seed)
+    print(f"{len(topics)} temas y {len(users)} usuarios en {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+"""
+Compara dos ficheros de bench.run por la mediana de cada (tamaño, operación).
+
+    python -m bench.compare antes.json despues.json --threshold 1.2
+
+Sale con código 1 si alguna operación es más lenta que threshold × antes.
+"""
+import argparse
+import json
+import sys
+from pathlib import Path
+
+
+def cargar(path: Path) -> dict:
+    doc = json.loads(path.read_text(encoding="utf-8"))
+    return {(r["size"], r["op"]): r for r in doc["results"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compara resultados de bench.run")
+    parser.add_argument("antes", type=Path)
+    parser.add_argument("despues", type=Path)
+    parser.add_argument("--threshold", type=float, default=1.2)
+    args = parser.parse_args()
+
+    antes = cargar(args.antes)
+    despues = cargar(args.despues)
+    regresiones = 0
+
+    for clave in sorted(antes.keys() & despues.keys()):
+        a = antes[clave]["median_ms"]
+        d = despues[clave]["median_ms"]
+        ratio = d / a if a else float("inf")
+        marca = ""
+        if ratio > args.threshold:
+            marca = "  <-- REGRESIÓN"
+            regresiones += 1
+        print(f"{clave[0]:>4} {clave[1]:<44} {a:>10.3f} -> {d:>10.3f} ms  x{ratio:5.2f}{marca}")
+
+    for clave in sorted(antes.keys() ^ despues.keys()):
+        print(f"{clave[0]:>4} {clave[1]:<44} solo en {'antes' if clave in antes else 'después'}")
+
+    sys.exit(1 if regresiones else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+"""
+Mide las partes calientes de main.py sobre catálogos sintéticos y escribe
+los resultados en JSON para poder comparar versiones (bench.compare).
+
+    python -m bench.run --sizes 1k,10k,50k --out bench_results.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+from types import SimpleNamespace
+
+from bench.catalog import SIZES, escribir
+
+# main.py lee la configuración al importarse: se prepara antes el entorno
+_DATA_DIR = Path(tempfile.mkdtemp(prefix="bench_data_"))
+os.environ["DATA_DIR"] = str(_DATA_DIR)
+os.environ.setdefault("BOT_TOKEN", "0:bench")
+os.environ.setdefault("GROUP_ID", "-1001000000000")
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+import main  # noqa: E402
+
+BENCH_USER = 42
+
+
+class _Chat:
+    type = "private"
+    id = BENCH_USER
+
+    async def send_message(self, *args, **kwargs):
+        return None
+
+
+def _update_texto(texto: str):
+    msg = SimpleNamespace(
+        chat=_Chat(),
+        text=texto,
+        from_user=SimpleNamespace(id=BENCH_USER),
+    )
+    return SimpleNamespace(message=msg, effective_message=msg)
+
+
+def _update_start(uid: int):
+    user = SimpleNamespace(id=uid, full_name=f"Usuario {uid}", username=f"u{uid}")
+    msg = SimpleNamespace(date=datetime.now(timezone.utc))
+    return SimpleNamespace(effective_user=user, effective_message=msg)
+
+
+def medir(fn, repeticiones: int, preparar=None) -> dict:
+    tiempos = []
+    for _ in range(repeticiones):
+        if preparar is not None:
+            preparar()
+        t0 = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - t0) * 1000)
+    tiempos.sort()
+    return {
+        "n": len(tiempos),
+        "min_ms": round(tiempos[0], 3),
+        "median_ms": round(statistics.median(tiempos), 3),
+        "p95_ms": round(tiempos[min(len(tiempos) - 1, int(len(tiempos) * 0.95))], 3),
+        "max_ms": round(tiempos[-1], 3),
+    }
+
+
+def _reset_catalogo():
+    main._SHARDS[main.GROUP_ID].topics = None
+    main._INDICES.clear()
+
+
+def _vaciar_cache():
+    main.SEARCH_CACHE.data.clear()
+
+
+def bench_size(size: str, repeticiones: int) -> list:
+    escribir(_DATA_DIR, size)
+    main._SHARDS[main.GROUP_ID].topics = None
+    main.load_topics()  # el generador escribe el esquema 1: se migra antes de medir
+    loop = asyncio.new_event_loop()
+    resultados = []
+
+    def anotar(op, stats, **extra):
+        fila = {"size": size, "op": op, **stats, **extra}
+        resultados.append(fila)
+        print(f"  {size:>4} {op:<34} mediana {stats['median_ms']:>10.3f} ms")
+
+    def run(coro_fn):
+        return lambda: loop.run_until_complete(coro_fn())
+
+    async def esperar_fuzzy():
+        # Los índices aproximados se rehacen en segundo plano: que no caigan dentro de una medida
+        while main._FUZZY_OBRAS:
+            await asyncio.gather(*(o["tarea"] for o in list(main._FUZZY_OBRAS.values())))
+
+    # --- almacenamiento ---
+    anotar(
+        "load_topics[json]",
+        medir(
+            main.load_topics,
+            repeticiones,
+            lambda: (_reset_catalogo(), main.SNAPSHOT_FILE.unlink(missing_ok=True)),
+        ),
+    )
+    anotar("load_topics[snapshot]", medir(main.load_topics, repeticiones, _reset_catalogo))
+    topics = main.load_topics()
+    anotar("save_topics", medir(lambda: main.save_topics(topics), repeticiones))
+    topics = main.load_topics()
+
+    # --- letras / orden ---
+    copia = dict(topics)  # un dict que no es el catálogo vivo: recorre todo
+    anotar("filtrar_por_letra[scan]", medir(lambda: main.filtrar_por_letra(copia, "C"), repeticiones))
+    anotar(
+        "filtrar_por_letra[index_rebuild]",
+        medir(
+            lambda: main.filtrar_por_letra(topics, "C"),
+            repeticiones,
+            main._INDICES.clear,
+        ),
+    )
+    anotar("filtrar_por_letra[index]", medir(lambda: main.filtrar_por_letra(topics, "C"), repeticiones))
+    items = list(topics.items())
+    anotar("ordenar_temas", medir(lambda: main.ordenar_temas(items), repeticiones))
+    anotar("build_letter_page[A,1]", medir(lambda: main.build_letter_page("A", 1, topics), repeticiones))
+    anotar("build_letter_page[#,1]", medir(lambda: main.build_letter_page("#", 1, topics), repeticiones))
+
+    # --- búsqueda por texto ---
+    casos = [
+        ("series", "amor"),
+        ("series", "juego de tronos"),
+        ("series", "corazn perdid"),  # sin coincidencia exacta: aproximada
+        ("pelis", "dragón"),
+        ("pelis", "la casa de papel"),
+        ("pelis", "casa papell"),
+    ]
+    for modo, texto in casos:
+        main.SESSIONS.set(BENCH_USER, "search_mode", modo)
+        fn = run(lambda t=texto: main.search_text(_update_texto(t), None))
+        fn()  # calienta índices (incluido el aproximado)
+        loop.run_until_complete(esperar_fuzzy())
+        _vaciar_cache()
+        fn()
+        anotar(f"search_text[{modo}:{texto}]", medir(fn, repeticiones, _vaciar_cache))
+        anotar(f"search_text[{modo}:{texto}][cached]", medir(fn, repeticiones))
+
+    # --- registro de usuarios ---
+    contador = iter(range(10**9, 10**10))
+    anotar(
+        "register_user_from_update",
+        medir(lambda: main.register_user_from_update(_update_start(next(contador))), repeticiones),
+    )
+
+    loop.close()
+    return resultados
+
+
+def _git_rev() -> str:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=Path(__file__).resolve().parent,
+            stderr=subprocess.DEVNULL,
+            text=True,
+        ).strip()
+    except Exception:
+        return ""
+
+
+def main_cli():
+    parser = argparse.ArgumentParser(description="Benchmarks de main.py")
+    parser.add_argument("--sizes", default="1k,10k", help="lista separada por comas: " + ",".join(SIZES))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--out", type=Path, default=Path("bench_results.json"))
+    args = parser.parse_args()
+
+    sizes = [s.strip() for s in args.sizes.split(",") if s.strip()]
+    for s in sizes:
+        if s not in SIZES:
+            parser.error(f"tamaño desconocido: {s}")
+
+    resultados = []
+    for s in sizes:
+        print(f"== {s}: {SIZES[s]}")
+        resultados.extend(bench_size(s, args.repeat))
+
+    doc = {
+        "meta": {
+            "git_rev": _git_rev(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "repeat": args.repeat,
+        },
+        "results": resultados,
+    }
+    args.out.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"Resultados en {args.out}")
+
+
+if __name__ == "__main__":
+    main_cli()
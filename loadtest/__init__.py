@@ -0,0 +1,7 @@
+"""
+Pruebas de carga sin tocar Telegram.
+
+    python -m loadtest.fake_api --port 8081              # solo el servidor falso
+    python -m loadtest.replay --users 200 --out load.json  # escenario sintético
+    python -m loadtest.replay --replay updates.jsonl       # updates grabados
+"""
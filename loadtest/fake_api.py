@@ -0,0 +1,285 @@
+"""
+Servidor falso de la Bot API para pruebas locales.
+
+Entiende getUpdates (long polling), forwardMessage, copyMessage,
+sendMessage, editMessageText, answerCallbackQuery, answerInlineQuery y
+deleteMessage; el resto de métodos responden {"ok": true}. Puede inyectar
+errores RetryAfter (429) y "message to forward not found" (400), y contesta
+"message is not modified" cuando una edición no cambia nada, igual que
+Telegram.
+
+    python -m loadtest.fake_api --port 8081 --retry-after-rate 0.01
+    BOT_API_BASE_URL=http://127.0.0.1:8081/bot python main.py
+"""
+import argparse
+import asyncio
+import json
+import random
+import time
+from urllib.parse import parse_qsl
+
+BOT_USER = {
+    "id": 1,
+    "is_bot": True,
+    "first_name": "FakeBot",
+    "username": "fake_bot",
+    "can_join_groups": True,
+    "can_read_all_group_messages": True,
+    "supports_inline_queries": True,
+}
+
+# Métodos que cuentan como envío (sujetos a RetryAfter inyectado)
+SEND_METHODS = {"sendMessage", "forwardMessage", "copyMessage", "editMessageText"}
+# Campos que Telegram recibe como texto tal cual (no JSON)
+RAW_FIELDS = {"text", "caption", "parse_mode", "callback_query_id", "inline_query_id",
+              "inline_message_id", "next_offset", "secret_token", "url"}
+
+
+class FakeBotAPI:
+    def __init__(
+        self,
+        host: str = "127.0.0.1",
+        port: int = 0,
+        retry_after_rate: float = 0.0,
+        retry_after: int = 1,
+        not_found_rate: float = 0.0,
+        missing_ids=(),
+        latency_ms: float = 0.0,
+        seed: int = 0,
+    ):
+        self.host = host
+        self.port = port
+        self.retry_after_rate = retry_after_rate
+        self.retry_after = retry_after
+        self.not_found_rate = not_found_rate
+        self.missing_ids = set(missing_ids)
+        self.latency_ms = latency_ms
+        self.rnd = random.Random(seed)
+
+        self.pending = []  # [(update_id, update_dict)] aún no confirmados
+        self.served = {}  # update_id -> perf_counter de la primera entrega
+        self.new_updates = asyncio.Event()
+        self.update_id = 0
+
+        self.calls = []  # [(perf_counter, método, params)]
+        self.injected = {"retry_after": 0, "not_found": 0, "not_modified": 0}
+        self.messages = {}  # (chat_id, message_id) -> (texto, markup)
+        self.last_message = {}  # chat_id -> último message_id enviado por el bot
+        self.next_message_id = 1_000_000
+        self.server = None
+
+    # ---------------- ciclo de vida ----------------
+    async def start(self):
+        self.server = await asyncio.start_server(self._handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        return self
+
+    async def close(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/bot"
+
+    def push_update(self, update: dict) -> int:
+        """Encola un update (dict con el formato de la Bot API) y devuelve su update_id."""
+        self.update_id += 1
+        update = dict(update, update_id=self.update_id)
+        self.pending.append((self.update_id, update))
+        self.new_updates.set()
+        return self.update_id
+
+    # ---------------- HTTP ----------------
+    async def _handle(self, reader, writer):
+        try:
+            while True:
+                linea = await reader.readline()
+                if not linea:
+                    break
+                _metodo_http, path, _ = linea.decode("latin-1").split(" ", 2)
+                headers = {}
+                while True:
+                    h = await reader.readline()
+                    if h in (b"\r\n", b"\n", b""):
+                        break
+                    k, _, v = h.decode("latin-1").partition(":")
+                    headers[k.strip().lower()] = v.strip()
+                body = await reader.readexactly(int(headers.get("content-length", "0") or 0))
+
+                status, payload = await self._dispatch(path, headers, body)
+                data = json.dumps(payload).encode("utf-8")
+                writer.write(
+                    f"HTTP/1.1 {status} OK\r\n"
+                    "Content-Type: application/json\r\n"
+                    f"Content-Length: {len(data)}\r\n"
+                    "Connection: keep-alive\r\n\r\n".encode("latin-1") + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, ValueError, asyncio.CancelledError):
+            # CancelledError: long poll pendiente al cerrar el bucle
+            pass
+        finally:
+            writer.close()
+
+    def _parse_params(self, headers, body) -> dict:
+        ctype = headers.get("content-type", "")
+        if ctype.startswith("application/json"):
+            return json.loads(body or b"{}")
+        if ctype.startswith("multipart/form-data"):
+            # Subidas de archivos: solo se guarda que hubo llamada
+            return {}
+        params = {}
+        for k, v in parse_qsl(body.decode("utf-8"), keep_blank_values=True):
+            if k in RAW_FIELDS:
+                params[k] = v
+                continue
+            try:
+                params[k] = json.loads(v)
+            except ValueError:
+                params[k] = v
+        return params
+
+    async def _dispatch(self, path: str, headers, body):
+        metodo = path.rstrip("/").rsplit("/", 1)[-1]
+        params = self._parse_params(headers, body)
+        if metodo != "getUpdates":
+            self.calls.append((time.perf_counter(), metodo, params))
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000)
+
+        if metodo in SEND_METHODS and self.rnd.random() < self.retry_after_rate:
+            self.injected["retry_after"] += 1
+            return 429, {
+                "ok": False,
+                "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }
+
+        handler = getattr(self, "_m_" + metodo, None)
+        if handler is None:
+            return 200, {"ok": True, "result": True}
+        return await handler(params)
+
+    # ---------------- métodos ----------------
+    def _message(self, chat_id, text=None, message_id=None):
+        if message_id is None:
+            self.next_message_id += 1
+            message_id = self.next_message_id
+        self.last_message[chat_id] = message_id
+        msg = {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private" if int(chat_id) > 0 else "supergroup"},
+            "from": BOT_USER,
+        }
+        if text is not None:
+            msg["text"] = text
+        return msg
+
+    @staticmethod
+    def _error(description: str, code: int = 400):
+        return code, {"ok": False, "error_code": code, "description": description}
+
+    async def _m_getMe(self, params):
+        return 200, {"ok": True, "result": BOT_USER}
+
+    async def _m_getUpdates(self, params):
+        offset = int(params.get("offset") or 0)
+        if offset:
+            self.pending = [(uid, u) for uid, u in self.pending if uid >= offset]
+        if not self.pending:
+            self.new_updates.clear()
+            try:
+                await asyncio.wait_for(self.new_updates.wait(), float(params.get("timeout") or 0))
+            except asyncio.TimeoutError:
+                pass
+        lote = self.pending[: int(params.get("limit") or 100)]
+        ahora = time.perf_counter()
+        for uid, _u in lote:
+            self.served.setdefault(uid, ahora)
+        return 200, {"ok": True, "result": [u for _uid, u in lote]}
+
+    async def _m_sendMessage(self, params):
+        chat_id = params["chat_id"]
+        msg = self._message(chat_id, params.get("text", ""))
+        self.messages[(chat_id, msg["message_id"])] = (params.get("text"), params.get("reply_markup"))
+        return 200, {"ok": True, "result": msg}
+
+    def _source_missing(self, params) -> bool:
+        if params.get("message_id") in self.missing_ids or self.rnd.random() < self.not_found_rate:
+            self.injected["not_found"] += 1
+            return True
+        return False
+
+    async def _m_forwardMessage(self, params):
+        if self._source_missing(params):
+            return self._error("Bad Request: message to forward not found")
+        msg = self._message(params["chat_id"], "↪")
+        msg["forward_date"] = int(time.time())
+        return 200, {"ok": True, "result": msg}
+
+    async def _m_copyMessage(self, params):
+        if self._source_missing(params):
+            return self._error("Bad Request: message to copy not found")
+        msg = self._message(params["chat_id"])
+        return 200, {"ok": True, "result": {"message_id": msg["message_id"]}}
+
+    async def _m_editMessageText(self, params):
+        if params.get("inline_message_id"):
+            return 200, {"ok": True, "result": True}
+        clave = (params.get("chat_id"), params.get("message_id"))
+        nuevo = (params.get("text"), params.get("reply_markup"))
+        if self.messages.get(clave) == nuevo:
+            self.injected["not_modified"] += 1
+            return self._error(
+                "Bad Request: message is not modified: specified new message content and "
+                "reply markup are exactly the same as a current content and reply markup "
+                "of the message"
+            )
+        self.messages[clave] = nuevo
+        return 200, {
+            "ok": True,
+            "result": self._message(clave[0], nuevo[0], message_id=clave[1]),
+        }
+
+    async def _m_deleteMessage(self, params):
+        self.messages.pop((params.get("chat_id"), params.get("message_id")), None)
+        return 200, {"ok": True, "result": True}
+
+
+async def _serve(args):
+    api = await FakeBotAPI(
+        host=args.host,
+        port=args.port,
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+        not_found_rate=args.not_found_rate,
+        latency_ms=args.latency_ms,
+    ).start()
+    print(f"Bot API falsa en {api.base_url}  (BOT_API_BASE_URL={api.base_url})")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await api.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Servidor falso de la Bot API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(_serve(args))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
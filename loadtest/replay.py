@@ -0,0 +1,419 @@
+"""
+Arnés de carga: arranca loadtest.fake_api, apunta la Application de
+main.build_app() hacia él y reproduce un flujo de updates (sintético o
+grabado). Mide la latencia extremo a extremo de cada update (desde que
+getUpdates lo entrega hasta que terminan sus handlers) y las llamadas a
+la Bot API por acción de usuario. Los reenvíos de temas completos los
+hacen los workers de main.py (procesos aparte contra la misma API falsa);
+antes de parar se espera a que la cola de envíos se vacíe.
+
+    python -m loadtest.replay --users 100 --topics 40 --out load.json
+    python -m loadtest.replay --replay updates.jsonl --retry-after-rate 0.02
+    python -m loadtest.replay --webhook 8443   # updates por POST al webhook, no getUpdates
+
+Formato de --replay: una línea JSON por update (formato Bot API, sin
+update_id). Un campo opcional "_delay" (segundos) espera antes de enviarlo.
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from pathlib import Path
+
+from loadtest.fake_api import FakeBotAPI
+
+GROUP_ID = -1001234567890
+LETRAS = "ABCDEFGHIJKLMNOPQRSTUVWXYZ#"
+
+
+def _user(uid: int) -> dict:
+    return {"id": uid, "is_bot": False, "first_name": f"U{uid}"}
+
+
+class Harness:
+    def __init__(self, api: FakeBotAPI, main_mod, webhook_port: int = 0):
+        self.api = api
+        self.main = main_mod
+        self.app = None
+        self.webhook_port = webhook_port  # 0 = long polling contra la API falsa
+        self.http = None
+        self.enviado = {}  # update_id -> perf_counter del POST (modo webhook)
+        self.done = {}  # update_id -> future
+        self.finished = {}  # update_id -> perf_counter fin
+        self.meta = {}  # update_id -> (acción, user_id)
+        self.cq_users = {}  # callback_query_id -> user_id
+        self.next_msg = 1
+
+    # ---------------- Application ----------------
+    async def start(self):
+        from telegram import Update
+        from telegram.ext import TypeHandler
+
+        self.app = self.main.build_app()
+        # Grupo muy alto: se ejecuta cuando ya terminaron los handlers del update
+        self.app.add_handler(TypeHandler(Update, self._fin), group=10_000)
+        await self.app.initialize()
+        # Como run_polling/run_webhook: hooks de arranque y apagado de main.py
+        if self.app.post_init:
+            await self.app.post_init(self.app)
+        await self.app.start()
+        if self.webhook_port:
+            import httpx
+
+            self.http = httpx.AsyncClient()
+            # El mismo servidor que main.py en producción (webhook + health check)
+            await self.main.arrancar_webhook(
+                self.app,
+                listen="127.0.0.1",
+                port=self.webhook_port,
+                url=f"http://127.0.0.1:{self.webhook_port}/{self.main.WEBHOOK_PATH}",
+            )
+        else:
+            await self.app.updater.start_polling(
+                poll_interval=0.0, timeout=1, allowed_updates=self.main.ALLOWED_UPDATES
+            )
+
+    async def stop(self):
+        if self.webhook_port:
+            await self.main.parar_webhook()
+        else:
+            await self.app.updater.stop()
+        await self.app.stop()
+        await self.app.shutdown()
+        if self.app.post_shutdown:
+            await self.app.post_shutdown(self.app)
+        if self.http is not None:
+            await self.http.aclose()
+
+    async def esperar_envios(self, timeout: float = 60.0):
+        """Los temas los reenvían los procesos worker: espera a que la cola se vacíe."""
+        limite = time.perf_counter() + timeout
+        while time.perf_counter() < limite and await self.main.estado_cola():
+            await asyncio.sleep(0.2)
+
+    async def _post_webhook(self, uid: int, update: dict):
+        """Hace de Telegram: manda el update al webhook con la cabecera secreta."""
+        self.enviado[uid] = time.perf_counter()
+        r = await self.http.post(
+            f"http://127.0.0.1:{self.webhook_port}/{self.main.WEBHOOK_PATH}",
+            json=dict(update, update_id=uid),
+            headers={"X-Telegram-Bot-Api-Secret-Token": self.main.WEBHOOK_SECRET},
+        )
+        r.raise_for_status()
+
+    async def _fin(self, update, context):
+        self.finished[update.update_id] = time.perf_counter()
+        fut = self.done.pop(update.update_id, None)
+        if fut is not None and not fut.done():
+            fut.set_result(None)
+
+    # ---------------- envío de updates ----------------
+    async def send(self, update: dict, accion: str, user_id: int, timeout: float = 120.0):
+        cq = update.get("callback_query")
+        if cq:
+            self.cq_users[cq["id"]] = user_id
+        fut = asyncio.get_running_loop().create_future()
+        if self.webhook_port:
+            # El future va antes del POST: el handler puede terminar antes de que vuelva
+            self.api.update_id += 1
+            uid = self.api.update_id
+            self.done[uid] = fut
+            await self._post_webhook(uid, update)
+        else:
+            uid = self.api.push_update(update)
+            self.done[uid] = fut
+        self.meta[uid] = (accion, user_id)
+        try:
+            await asyncio.wait_for(fut, timeout)
+        except asyncio.TimeoutError:
+            self.done.pop(uid, None)
+        return uid
+
+    def _msg(self, chat: dict, user_id: int, **extra) -> dict:
+        self.next_msg += 1
+        return {
+            "message_id": self.next_msg,
+            "date": int(time.time()),
+            "chat": chat,
+            "from": _user(user_id),
+            **extra,
+        }
+
+    def private_text(self, user_id: int, text: str) -> dict:
+        extra = {"text": text}
+        if text.startswith("/"):
+            extra["entities"] = [
+                {"type": "bot_command", "offset": 0, "length": len(text.split()[0])}
+            ]
+        return {"message": self._msg({"id": user_id, "type": "private"}, user_id, **extra)}
+
+    def callback(self, user_id: int, data: str) -> dict:
+        chat = {"id": user_id, "type": "private"}
+        self.next_msg += 1
+        return {
+            "callback_query": {
+                "id": f"cq{self.next_msg}",
+                "from": _user(user_id),
+                "chat_instance": f"ci{user_id}",
+                "data": data,
+                "message": {
+                    "message_id": self.api.last_message.get(user_id, 1),
+                    "date": int(time.time()),
+                    "chat": chat,
+                    "from": {"id": 1, "is_bot": True, "first_name": "FakeBot"},
+                    "text": "menú",
+                },
+            }
+        }
+
+    def group_message(self, user_id: int, thread_id: int, **extra) -> dict:
+        chat = {"id": GROUP_ID, "type": "supergroup", "title": "Grupo", "is_forum": True}
+        return {
+            "message": self._msg(
+                chat,
+                user_id,
+                message_thread_id=thread_id,
+                is_topic_message=True,
+                **extra,
+            )
+        }
+
+    # ---------------- escenario sintético ----------------
+    async def subir_catalogo(self, topics: int, mensajes: int, peliculas: int, rnd):
+        owner = self.main.OWNER_ID
+        hilos = []
+        for n in range(topics):
+            hilo = 100 + n * 10
+            hilos.append(hilo)
+            nombre = f"{rnd.choice(LETRAS[:-1])}{rnd.choice(['ámbar', 'ñoño', 'sol', 'mar'])} {n}"
+            await self.send(
+                self.group_message(owner, hilo, forum_topic_created={"name": nombre, "icon_color": 7322096}),
+                "group_upload",
+                owner,
+            )
+            for m in range(mensajes):
+                await self.send(
+                    self.group_message(
+                        owner,
+                        hilo,
+                        document={"file_id": f"f{n}_{m}", "file_unique_id": f"u{n}_{m}", "file_name": f"{n}_{m}.mkv"},
+                    ),
+                    "group_upload",
+                    owner,
+                )
+
+        hilo_pelis = 99
+        await self.send(
+            self.group_message(owner, hilo_pelis, forum_topic_created={"name": "Películas", "icon_color": 7322096}),
+            "group_upload",
+            owner,
+        )
+        await self.send(
+            self.group_message(
+                owner, hilo_pelis, text="/setpelis",
+                entities=[{"type": "bot_command", "offset": 0, "length": 9}],
+            ),
+            "setpelis",
+            owner,
+        )
+        for p in range(peliculas):
+            await self.send(
+                self.group_message(
+                    owner,
+                    hilo_pelis,
+                    caption=f"{rnd.choice(['Harry', 'Matrix', 'Amélie', 'Niño'])} {p}",
+                    video={"file_id": f"v{p}", "file_unique_id": f"v{p}", "width": 1, "height": 1, "duration": 1},
+                ),
+                "group_upload",
+                owner,
+            )
+
+    async def usuario(self, user_id: int, acciones: int, rnd, pensar: float):
+        await self.send(self.private_text(user_id, "/start"), "/start", user_id)
+        for _ in range(acciones):
+            await asyncio.sleep(rnd.uniform(0, pensar))
+            r = rnd.random()
+            if r < 0.45:
+                letra = rnd.choice(LETRAS)
+                await self.send(self.callback(user_id, f"letter:{letra}"), "letter", user_id)
+                if rnd.random() < 0.3:
+                    await self.send(self.callback(user_id, f"page:{letra}:2"), "page", user_id)
+                tids = list(self.main.load_topics())
+                if tids and rnd.random() < 0.5:
+                    await self.send(self.callback(user_id, f"t:{rnd.choice(tids)}"), "t", user_id)
+            elif r < 0.7:
+                await self.send(self.callback(user_id, "search"), "search", user_id)
+                await self.send(self.private_text(user_id, rnd.choice(["sol", "mar", "ambar", "xyz"])), "text", user_id)
+            elif r < 0.9:
+                await self.send(self.callback(user_id, "pelis"), "pelis", user_id)
+                await self.send(self.private_text(user_id, rnd.choice(["harry", "matrix", "amelie"])), "text", user_id)
+                await self.send(self.callback(user_id, "main_menu"), "main_menu", user_id)
+            else:
+                await self.send(self.callback(user_id, "recent"), "recent", user_id)
+                await self.send(self.callback(user_id, "main_menu"), "main_menu", user_id)
+
+    # ---------------- updates grabados ----------------
+    async def reproducir(self, path: Path):
+        pendientes = []
+        for linea in path.read_text(encoding="utf-8").splitlines():
+            if not linea.strip():
+                continue
+            update = json.loads(linea)
+            espera = update.pop("_delay", 0)
+            update.pop("update_id", None)
+            if espera:
+                await asyncio.sleep(espera)
+            accion, user_id = _describir(update)
+            pendientes.append(asyncio.create_task(self.send(update, accion, user_id)))
+        await asyncio.gather(*pendientes)
+
+    # ---------------- informe ----------------
+    def informe(self, duracion: float) -> dict:
+        llamadas_por_usuario = defaultdict(list)
+        por_metodo = defaultdict(int)
+        for t, metodo, params in self.api.calls:
+            por_metodo[metodo] += 1
+            uid = params.get("chat_id")
+            if uid is None:
+                uid = self.cq_users.get(params.get("callback_query_id"))
+            if uid is not None:
+                llamadas_por_usuario[uid].append(t)
+
+        lat = defaultdict(list)
+        llamadas = defaultdict(list)
+        for uid, (accion, user_id) in self.meta.items():
+            ini = self.enviado.get(uid) or self.api.served.get(uid)
+            fin = self.finished.get(uid)
+            if ini is None or fin is None:
+                lat[accion].append(None)
+                continue
+            lat[accion].append((fin - ini) * 1000)
+            # Acciones de un mismo usuario son secuenciales: su ventana es suya
+            chat = GROUP_ID if accion == "group_upload" else user_id
+            llamadas[accion].append(sum(1 for t in llamadas_por_usuario[chat] if ini <= t <= fin))
+
+        acciones = {}
+        for accion, valores in sorted(lat.items()):
+            ok = sorted(v for v in valores if v is not None)
+            if not ok:
+                acciones[accion] = {"n": len(valores), "timeouts": len(valores)}
+                continue
+            acciones[accion] = {
+                "n": len(valores),
+                "timeouts": len(valores) - len(ok),
+                "p50_ms": round(_pct(ok, 50), 2),
+                "p90_ms": round(_pct(ok, 90), 2),
+                "p99_ms": round(_pct(ok, 99), 2),
+                "max_ms": round(ok[-1], 2),
+                "api_calls_avg": round(statistics.mean(llamadas[accion]), 2) if llamadas[accion] else 0,
+            }
+        return {
+            "duration_s": round(duracion, 2),
+            "updates": len(self.meta),
+            "actions": acciones,
+            "api": {
+                "total_calls": len(self.api.calls),
+                "by_method": dict(sorted(por_metodo.items())),
+                "injected": dict(self.api.injected),
+            },
+        }
+
+
+def _pct(ordenados, p):
+    k = (len(ordenados) - 1) * p / 100
+    i = int(k)
+    j = min(i + 1, len(ordenados) - 1)
+    return ordenados[i] + (ordenados[j] - ordenados[i]) * (k - i)
+
+
+def _describir(update: dict):
+    if "callback_query" in update:
+        cq = update["callback_query"]
+        return cq.get("data", "").split(":", 1)[0] or "callback", cq["from"]["id"]
+    if "inline_query" in update:
+        return "inline", update["inline_query"]["from"]["id"]
+    msg = update.get("message") or update.get("edited_message") or {}
+    user_id = (msg.get("from") or {}).get("id", 0)
+    if msg.get("chat", {}).get("type") != "private":
+        return "group_upload", user_id
+    texto = msg.get("text", "")
+    return (texto.split()[0] if texto.startswith("/") else "text"), user_id
+
+
+async def ejecutar(args) -> dict:
+    api = await FakeBotAPI(
+        retry_after_rate=args.retry_after_rate,
+        retry_after=args.retry_after,
+        not_found_rate=args.not_found_rate,
+        latency_ms=args.latency_ms,
+        seed=args.seed,
+    ).start()
+
+    # main.py se configura al importarse: entorno antes del import
+    os.environ["BOT_TOKEN"] = "123:fake"
+    os.environ["GROUP_ID"] = str(GROUP_ID)
+    os.environ["DATA_DIR"] = args.data_dir or tempfile.mkdtemp(prefix="loadtest_data_")
+    os.environ["BOT_API_BASE_URL"] = api.base_url
+    os.environ.setdefault("METRICS_PORT", "0")
+    sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+    main_mod = importlib.import_module("main")
+
+    harness = Harness(api, main_mod, args.webhook)
+    await harness.start()
+    rnd = random.Random(args.seed)
+    t0 = time.perf_counter()
+    try:
+        if args.replay:
+            await harness.reproducir(args.replay)
+        else:
+            await harness.subir_catalogo(args.topics, args.messages, args.movies, rnd)
+            await asyncio.gather(
+                *(
+                    harness.usuario(10_000 + n, args.actions, random.Random(args.seed + n), args.think)
+                    for n in range(args.users)
+                )
+            )
+        await harness.esperar_envios()
+    finally:
+        duracion = time.perf_counter() - t0
+        await harness.stop()
+        await api.close()
+    return harness.informe(duracion)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prueba de carga contra la Bot API falsa")
+    parser.add_argument("--replay", type=Path, help="fichero .jsonl con updates grabados")
+    parser.add_argument("--webhook", type=int, default=0, metavar="PUERTO",
+                        help="entregar los updates por POST a un webhook local en este puerto")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--actions", type=int, default=5, help="acciones por usuario")
+    parser.add_argument("--think", type=float, default=0.5, help="pausa máxima entre acciones (s)")
+    parser.add_argument("--topics", type=int, default=20)
+    parser.add_argument("--messages", type=int, default=3, help="mensajes por tema")
+    parser.add_argument("--movies", type=int, default=30)
+    parser.add_argument("--retry-after-rate", type=float, default=0.0)
+    parser.add_argument("--retry-after", type=int, default=1)
+    parser.add_argument("--not-found-rate", type=float, default=0.0)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    parser.add_argument("--data-dir", default="")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--out", type=Path)
+    args = parser.parse_args()
+
+    informe = asyncio.run(ejecutar(args))
+    texto = json.dumps(informe, indent=2, ensure_ascii=False)
+    if args.out:
+        args.out.write_text(texto, encoding="utf-8")
+    print(texto)
+
+
+if __name__ == "__main__":
+    main()
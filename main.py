@@ -1,49 +1,206 @@
 import os
+import sys
+import gc
+import shutil
+import marshal
 import json
 import math
+import time
+import gzip
+import heapq
+import hashlib
+import hmac
+import signal
+import asyncio
+import cProfile
+import pstats
+import io
+import tracemalloc
+import subprocess
+import functools
+import threading
+import traceback
+import itertools
+import contextvars
 import unicodedata
+from array import array
+from bisect import bisect_left, bisect_right, insort
 from pathlib import Path
+from collections import OrderedDict
 from html import escape
 from telegram import (
+    Bot,
     Update,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InlineQueryResultsButton,
+    InputTextMessageContent,
 )
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     ApplicationBuilder,
     MessageHandler,
     CallbackQueryHandler,
+    InlineQueryHandler,
     ContextTypes,
     CommandHandler,
     filters,
 )
 
+try:
+    import zstandard  # opcional: exportaciones .zst
+except ImportError:
+    zstandard = None
+
+import aiosqlite
+import tornado.web  # viene con python-telegram-bot[webhooks]
+from tornado.httpserver import HTTPServer
+
+_ARRANQUE = time.perf_counter()  # para medir el tiempo hasta el primer update atendido
+
 # ======================================================
 #   CONFIGURACIÓN DEL BOT
 # ======================================================
 BOT_TOKEN = os.getenv("BOT_TOKEN")
 GROUP_ID = int(os.getenv("GROUP_ID"))
+# Grupos adicionales, cada uno con su propio catálogo (IDs separados por comas)
+EXTRA_GROUP_IDS = [int(g) for g in os.getenv("EXTRA_GROUP_IDS", "").replace(" ", "").split(",") if g]
+GROUP_IDS = [GROUP_ID] + [g for g in dict.fromkeys(EXTRA_GROUP_IDS) if g != GROUP_ID]
+# Nombres para el selector de grupo del menú, en el mismo orden que GROUP_IDS (opcional)
+GROUP_NAMES = [n.strip() for n in os.getenv("GROUP_NAMES", "").split(",")]
+# Servidor de la Bot API (solo se cambia para pruebas contra loadtest.fake_api)
+BOT_API_BASE_URL = os.getenv("BOT_API_BASE_URL", "")
+
+# Modo webhook: si hay WEBHOOK_URL (URL pública, p. ej. https://bot.up.railway.app)
+# el bot atiende PORT (webhook y HEALTH_PATH) en vez de hacer long polling.
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "").rstrip("/")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram").strip("/")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("PORT", "8443"))
+# Telegram lo manda en X-Telegram-Bot-Api-Secret-Token; por defecto se deriva del token
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET") or hashlib.sha256(
+    f"webhook:{os.getenv('BOT_TOKEN')}".encode()
+).hexdigest()[:48]
 
 # ID DEL OWNER — PERMISOS ESPECIALES
 OWNER_ID = 5540195020
 
-# Carpeta persistente de Railway
-DATA_DIR = Path("/data")
+# Carpeta persistente de Railway (DATA_DIR permite otra, p. ej. para benchmarks)
+DATA_DIR = Path(os.getenv("DATA_DIR", "/data"))
 DATA_DIR.mkdir(parents=True, exist_ok=True)
 TOPICS_FILE = DATA_DIR / "topics.json"
+TOPICS_SCHEMA = 2  # versión del formato de topics.json (ver MIGRACIONES)
+SNAPSHOT_FILE = DATA_DIR / "topics.snapshot"  # copia binaria para arrancar rápido
+GROUPS_DIR = DATA_DIR / "grupos"  # catálogos de EXTRA_GROUP_IDS, una carpeta por grupo
+# Segundos sin uso tras los que el catálogo de un grupo adicional sale de memoria (0 = nunca)
+SHARD_IDLE_SECONDS = int(os.getenv("SHARD_IDLE_SECONDS", "3600"))
 USERS_FILE = DATA_DIR / "users.json"  # registro de usuarios
 
+# Copias de seguridad (/exportar y rotación automática)
+BACKUP_DIR = DATA_DIR / "backups"
+EXPORT_STATE_FILE = DATA_DIR / "export_state.json"  # firmas de la última exportación
+BACKUP_KEEP = int(os.getenv("BACKUP_KEEP", "7"))
+BACKUP_INTERVAL_HOURS = float(os.getenv("BACKUP_INTERVAL_HOURS", "24"))
+
 # Tamaño de página (temas por página en listados generales)
 PAGE_SIZE = 30
 # Cuántos temas se muestran en "Recientes"
 RECENT_LIMIT = 20
-# Límite de resultados en búsqueda de películas (sin paginación de momento)
-PELIS_RESULT_LIMIT = 70
+# Entradas máximas en la caché compartida de búsquedas
+SEARCH_CACHE_SIZE = int(os.getenv("SEARCH_CACHE_SIZE", "512"))
+# Búsqueda aproximada: presupuesto de tiempo por consulta, candidatos
+# que se puntúan, puntuación mínima (0-1) y sugerencias máximas
+FUZZY_BUDGET_MS = float(os.getenv("FUZZY_BUDGET_MS", "40"))
+FUZZY_MAX_CANDIDATES = int(os.getenv("FUZZY_MAX_CANDIDATES", "300"))
+FUZZY_MIN_SCORE = float(os.getenv("FUZZY_MIN_SCORE", "0.6"))
+FUZZY_LIMIT = 30
+FUZZY_BUILD_CHUNK = 1000  # entradas por tramo al reconstruir un índice (entre tramo y tramo se cede el bucle)
+# Consultas de películas recordadas para los botones de paginación
+PELIS_QUERY_TOKENS = int(os.getenv("PELIS_QUERY_TOKENS", "4096"))
 # Tamaño de página (películas por página en resultados de búsqueda)
 MOVIES_PAGE_SIZE = 20
+# Sesiones: segundos sin actividad antes de caducar y máximo simultáneas
+SESSION_TTL = int(os.getenv("SESSION_TTL", "1800"))
+SESSION_MAX = int(os.getenv("SESSION_MAX", "20000"))
+# Sesiones y consultas de películas sobreviven a los reinicios: cada
+# SESSION_FLUSH_SECONDS se guardan en SQLite solo las que cambiaron
+SESSIONS_DB = DATA_DIR / "sesiones.db"
+SESSION_FLUSH_SECONDS = float(os.getenv("SESSION_FLUSH_SECONDS", "10"))
+# Popularidad: contadores en memoria que se guardan cada POPULAR_FLUSH_SECONDS
+POPULAR_FILE = DATA_DIR / "populares.json"
+POPULAR_FLUSH_SECONDS = int(os.getenv("POPULAR_FLUSH_SECONDS", "300"))
+POPULAR_TOP_K = 20  # temas del listado "Populares"
+POPULAR_MAX_QUERIES = 2000  # búsquedas distintas que se recuerdan como mucho
+POPULAR_WARM_QUERIES = int(os.getenv("POPULAR_WARM_QUERIES", "50"))  # se repiten al arrancar
+# Modo inline: resultados por página y segundos que Telegram puede cachearlos
+INLINE_PAGE_SIZE = 20
+INLINE_CACHE_TIME = int(os.getenv("INLINE_CACHE_TIME", "300"))
+# Mensajes del bot de los que se recuerda lo último pintado (ver editar())
+EDIT_CACHE_SIZE = int(os.getenv("EDIT_CACHE_SIZE", "20000"))
 # Tamaño de página para listado de usuarios
 USERS_PAGE_SIZE = 30
 
+# Métricas en texto (Prometheus) en http://METRICS_HOST:METRICS_PORT/metrics; 0 = desactivado
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9090"))
+# Health check: en modo webhook, en PORT junto al webhook; siempre, también junto a /metrics
+HEALTH_PATH = os.getenv("HEALTH_PATH", "/health")
+WEBHOOK_MAX_BODY = 1 << 20  # un update de Telegram nunca se acerca a 1 MB
+# Servidores HTTP: tiempo máximo para mandar cabeceras o cuerpo (s) y tamaño de las cabeceras
+HTTP_TIMEOUT = float(os.getenv("HTTP_TIMEOUT", "10"))
+HTTP_MAX_HEADER_SIZE = 16 * 1024
+# Vigía del bucle de eventos: cada LOOP_LAG_INTERVAL s se mide cuánto tarda en
+# despertar; por encima de LOOP_LAG_THRESHOLD_MS se registra la pila (0 = desactivado)
+LOOP_LAG_INTERVAL = 0.05
+LOOP_LAG_THRESHOLD_MS = float(os.getenv("LOOP_LAG_THRESHOLD_MS", "250"))
+
+# Pools HTTP hacia la Bot API: nº de conexiones, timeout de lectura/escritura (s)
+# y espera máxima por una conexión libre (s). Ver crear_request().
+UPDATES_POOL_SIZE = int(os.getenv("UPDATES_POOL_SIZE", "1"))
+UPDATES_TIMEOUT = float(os.getenv("UPDATES_TIMEOUT", "10"))
+INTERACTIVE_POOL_SIZE = int(os.getenv("INTERACTIVE_POOL_SIZE", "64"))
+INTERACTIVE_TIMEOUT = float(os.getenv("INTERACTIVE_TIMEOUT", "5"))
+INTERACTIVE_POOL_TIMEOUT = float(os.getenv("INTERACTIVE_POOL_TIMEOUT", "1"))
+BULK_POOL_SIZE = int(os.getenv("BULK_POOL_SIZE", "8"))
+BULK_TIMEOUT = float(os.getenv("BULK_TIMEOUT", "15"))
+BULK_POOL_TIMEOUT = float(os.getenv("BULK_POOL_TIMEOUT", "30"))
+
+# Cola de envíos de temas completos (send_topic): SQLite en DATA_DIR compartida
+# por el bot, que solo encola, y los procesos worker, que reenvían.
+DELIVERY_DB = DATA_DIR / "envios.db"
+# Workers que lanza el propio bot; 0 = se arrancan aparte con "python main.py worker N"
+DELIVERY_WORKERS = int(os.getenv("DELIVERY_WORKERS", "2"))
+# Tokens para repartir los workers entre varios bots (separados por comas, opcional).
+# Cada bot tiene que estar en los grupos y el usuario tiene que haberlo iniciado.
+DELIVERY_BOT_TOKENS = [t.strip() for t in os.getenv("DELIVERY_BOT_TOKENS", "").split(",") if t.strip()]
+# Un envío sin noticias de su worker durante este tiempo (s) lo retoma otro
+DELIVERY_LEASE_SECONDS = int(os.getenv("DELIVERY_LEASE_SECONDS", "60"))
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+# Reintentos seguidos de un mismo mensaje ante errores de red (espera 1, 2, 4... s, máx. 30)
+DELIVERY_NET_RETRIES = int(os.getenv("DELIVERY_NET_RETRIES", "5"))
+# Un botón inline se responde al arrancar el envío; si la cola va lenta, como mucho tras estos segundos
+DELIVERY_INLINE_ANSWER_SECONDS = 8
+# Cada cuánto revisa el bot el progreso de los envíos (s) y cada cuántos mensajes lo guarda un worker
+DELIVERY_POLL_SECONDS = float(os.getenv("DELIVERY_POLL_SECONDS", "2"))
+DELIVERY_PROGRESS_EVERY = 10
+
+# Barrido de integridad: comprueba en segundo plano que los mensajes del catálogo
+# siguen existiendo copiándolos a SWEEP_CHAT_ID (un chat privado de pruebas en el
+# que está el bot) y borrando la copia. 0 = desactivado.
+SWEEP_CHAT_ID = int(os.getenv("SWEEP_CHAT_ID", "0"))
+# Llamadas a la Bot API por segundo como mucho (cada mensaje son dos: copia y borrado)
+SWEEP_RATE = float(os.getenv("SWEEP_RATE", "1"))
+# Cada cuánto se lanza una tanda (s) y horas de descanso al terminar una vuelta completa
+SWEEP_TICK_SECONDS = 30
+SWEEP_PAUSE_HOURS = float(os.getenv("SWEEP_PAUSE_HOURS", "24"))
+SWEEP_STATE_FILE = DATA_DIR / "barrido.json"  # cursor y salud por tema
+
+# /perfil: duración por defecto y máxima de un perfilado (segundos)
+PROFILE_DEFAULT_SECONDS = 30
+PROFILE_MAX_SECONDS = 300
+
 
 # ======================================================
 #   HELPERS PARA ACENTOS / PRIMERA LETRA
@@ -71,63 +228,1041 @@ def fix_text(s: str) -> str:
     return unicodedata.normalize("NFC", s)
 
 
+# ======================================================
+#   MÉTRICAS (latencia de handlers, llamadas a la Bot API, disco)
+#   Histogramas de cubetas fijas: apuntar una muestra es un bisect
+#   y un par de sumas. Se consultan con /stats (owner) y en formato
+#   Prometheus en http://METRICS_HOST:METRICS_PORT/metrics.
+# ======================================================
+METRICS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Handler que se está ejecutando (para atribuirle las llamadas a la API)
+_HANDLER_ACTUAL = contextvars.ContextVar("handler_actual", default=None)
+
+# Código HTTP de la Bot API -> excepción que lanzaría python-telegram-bot
+_API_ERRORES = {400: "BadRequest", 401: "InvalidToken", 403: "Forbidden", 409: "Conflict"}
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count", "maximo")
+
+    def __init__(self):
+        self.counts = [0] * (len(METRICS_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+        self.maximo = 0.0
+
+    def observe(self, segundos: float):
+        self.counts[bisect_left(METRICS_BUCKETS, segundos)] += 1
+        self.total += segundos
+        self.count += 1
+        if segundos > self.maximo:
+            self.maximo = segundos
+
+    def percentil(self, p: float) -> float:
+        """Límite superior de la cubeta en la que cae el percentil p (0-100)."""
+        objetivo = self.count * p / 100
+        acumulado = 0
+        for i, n in enumerate(self.counts[:-1]):
+            acumulado += n
+            if acumulado >= objetivo:
+                return METRICS_BUCKETS[i]
+        return self.maximo
+
+
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.handlers = {}  # handler -> Histogram
+        self.handler_errors = {}  # (handler, tipo de excepción) -> n
+        self.handler_api_calls = {}  # handler -> llamadas a la API hechas desde él
+        self.api = {}  # método -> Histogram
+        self.api_errors = {}  # (método, tipo) -> n
+        self.retry_after = 0
+        self.retry_after_seconds = 0
+        self.store = {}  # operación de disco -> Histogram
+        self.primer_update = None  # segundos desde el arranque hasta el primer update atendido
+        self.ediciones_evitadas = 0  # editar() sin cambios: no se llamó a Telegram
+        self.loop_lag = Histogram()  # retraso del bucle de eventos (ver VIGÍA)
+        self.bloqueos = {}  # handler (o función) -> bloqueos por encima del umbral
+
+    @staticmethod
+    def _hist(tabla: dict, clave: str) -> Histogram:
+        h = tabla.get(clave)
+        if h is None:
+            h = tabla[clave] = Histogram()
+        return h
+
+    def observe_handler(self, nombre: str, segundos: float, error=None):
+        self._hist(self.handlers, nombre).observe(segundos)
+        if error:
+            clave = (nombre, error)
+            self.handler_errors[clave] = self.handler_errors.get(clave, 0) + 1
+
+    def observe_api(self, metodo: str, segundos: float, handler=None, error=None):
+        self._hist(self.api, metodo).observe(segundos)
+        if handler:
+            self.handler_api_calls[handler] = self.handler_api_calls.get(handler, 0) + 1
+        if error:
+            clave = (metodo, error)
+            self.api_errors[clave] = self.api_errors.get(clave, 0) + 1
+
+    def observe_store(self, operacion: str, segundos: float):
+        self._hist(self.store, operacion).observe(segundos)
+
+    def render(self) -> str:
+        """Todas las métricas en formato de texto de Prometheus."""
+        lineas = []
+
+        def histograma(nombre, ayuda, etiqueta, tabla):
+            """etiqueta=None para un histograma sin etiquetas (tabla con una sola clave)."""
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} histogram")
+            for clave, h in sorted(tabla.items()):
+                sel = f'{etiqueta}="{clave}"' if etiqueta else ""
+                pre = sel + "," if sel else ""
+                sufijo = f"{{{sel}}}" if sel else ""
+                acumulado = 0
+                for limite, n in zip(METRICS_BUCKETS, h.counts):
+                    acumulado += n
+                    lineas.append(f'{nombre}_bucket{{{pre}le="{limite}"}} {acumulado}')
+                lineas.append(f'{nombre}_bucket{{{pre}le="+Inf"}} {h.count}')
+                lineas.append(f"{nombre}_sum{sufijo} {h.total:.6f}")
+                lineas.append(f"{nombre}_count{sufijo} {h.count}")
+
+        def contador(nombre, ayuda, filas):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} counter")
+            for etiquetas, valor in filas:
+                lineas.append(f"{nombre}{{{etiquetas}}} {valor}" if etiquetas else f"{nombre} {valor}")
+
+        def gauge(nombre, ayuda, valor):
+            lineas.append(f"# HELP {nombre} {ayuda}")
+            lineas.append(f"# TYPE {nombre} gauge")
+            lineas.append(f"{nombre} {valor}")
+
+        histograma("bot_handler_seconds", "Duración de cada handler.", "handler", self.handlers)
+        contador(
+            "bot_handler_errors_total",
+            "Excepciones no capturadas por handler y tipo.",
+            [(f'handler="{h}",type="{t}"', n) for (h, t), n in sorted(self.handler_errors.items())],
+        )
+        contador(
+            "bot_handler_api_calls_total",
+            "Llamadas a la Bot API hechas desde cada handler.",
+            [(f'handler="{h}"', n) for h, n in sorted(self.handler_api_calls.items())],
+        )
+        histograma("bot_api_seconds", "Duración de las llamadas a la Bot API.", "method", self.api)
+        contador(
+            "bot_api_errors_total",
+            "Respuestas de error de la Bot API por método y tipo.",
+            [(f'method="{m}",type="{t}"', n) for (m, t), n in sorted(self.api_errors.items())],
+        )
+        contador("bot_retry_after_total", "Respuestas 429 (RetryAfter) recibidas.", [("", self.retry_after)])
+        contador(
+            "bot_retry_after_seconds_total",
+            "Segundos de espera pedidos por Telegram en los RetryAfter.",
+            [("", self.retry_after_seconds)],
+        )
+        contador(
+            "bot_edits_skipped_total",
+            "Ediciones omitidas porque el mensaje ya mostraba ese contenido.",
+            [("", self.ediciones_evitadas)],
+        )
+        histograma("bot_store_seconds", "Duración de lecturas y escrituras en disco.", "op", self.store)
+        histograma(
+            "bot_event_loop_lag_seconds",
+            "Retraso del bucle de eventos al despertar (tiempo que algo lo tuvo bloqueado).",
+            None,
+            {"": self.loop_lag},
+        )
+        contador(
+            "bot_event_loop_stalls_total",
+            "Bloqueos del bucle por encima de LOOP_LAG_THRESHOLD_MS, por handler.",
+            [(f'handler="{h}"', n) for h, n in sorted(self.bloqueos.items())],
+        )
+        contador(
+            "bot_sweep_messages_total",
+            "Mensajes revisados por el barrido de integridad, por resultado.",
+            [(f'result="{r}"', n) for r, n in _BARRIDO["resultados"].items()],
+        )
+
+        cache = SEARCH_CACHE.stats()
+        contador("bot_search_cache_hits_total", "Aciertos de la caché de búsquedas.", [("", cache["hits"])])
+        contador("bot_search_cache_misses_total", "Fallos de la caché de búsquedas.", [("", cache["misses"])])
+        gauge("bot_search_cache_entries", "Entradas en la caché de búsquedas.", cache["entries"])
+        gauge("bot_sessions", "Sesiones de usuario activas.", len(SESSIONS.data))
+        cargados = [sh for sh in _SHARDS.values() if sh.topics is not None]
+        gauge("bot_catalog_shards_loaded", "Grupos con el catálogo en memoria.", len(cargados))
+        lineas.append("# HELP bot_catalog_version Versión del catálogo en memoria de cada grupo.")
+        lineas.append("# TYPE bot_catalog_version gauge")
+        for sh in cargados:
+            lineas.append(f'bot_catalog_version{{group="{sh.group_id}"}} {sh.topics.version}')
+        lineas.append("# HELP bot_catalog_topics Temas en memoria de cada grupo.")
+        lineas.append("# TYPE bot_catalog_topics gauge")
+        for sh in cargados:
+            lineas.append(f'bot_catalog_topics{{group="{sh.group_id}"}} {len(sh.topics)}')
+        gauge("bot_uptime_seconds", "Segundos desde el arranque.", round(time.time() - self.started, 1))
+        if self.primer_update is not None:
+            gauge(
+                "bot_startup_to_first_update_seconds",
+                "Segundos desde el arranque hasta el primer update atendido.",
+                round(self.primer_update, 3),
+            )
+        return "\n".join(lineas) + "\n"
+
+
+METRICS = Metrics()
+
+
+def medir_handler(callback):
+    """Envuelve un callback de handler para medir su duración y sus errores."""
+    nombre = callback.__name__
+
+    @functools.wraps(callback)
+    async def envoltura(update, context):
+        token = _HANDLER_ACTUAL.set(nombre)
+        t0 = time.perf_counter()
+        error = None
+        try:
+            return await callback(update, context)
+        except Exception as e:
+            error = type(e).__name__
+            raise
+        finally:
+            fin = time.perf_counter()
+            METRICS.observe_handler(nombre, fin - t0, error)
+            _HANDLER_ACTUAL.reset(token)
+            if METRICS.primer_update is None:
+                METRICS.primer_update = fin - _ARRANQUE
+                print(f"[arranque] primer update atendido a los {METRICS.primer_update * 1000:.0f} ms")
+
+    return envoltura
+
+
+class MetricsRequest(HTTPXRequest):
+    """HTTPXRequest que mide cada llamada a la Bot API y la atribuye al handler en curso."""
+
+    async def do_request(self, url, method, request_data=None, *args, **kwargs):
+        metodo = url.rsplit("/", 1)[-1]
+        handler = _HANDLER_ACTUAL.get()
+        t0 = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, method, request_data, *args, **kwargs)
+        except Exception as e:
+            METRICS.observe_api(metodo, time.perf_counter() - t0, handler, type(e).__name__)
+            raise
+
+        error = None
+        if code == 429:
+            error = "RetryAfter"
+            METRICS.retry_after += 1
+            try:
+                METRICS.retry_after_seconds += json.loads(payload)["parameters"]["retry_after"]
+            except Exception:
+                pass
+        elif code >= 400:
+            error = _API_ERRORES.get(code, "TelegramError")
+        METRICS.observe_api(metodo, time.perf_counter() - t0, handler, error)
+        return code, payload
+
+
 # ======================================================
 #   CARGA / GUARDA TEMAS
-#   ESTRUCTURA:
+#   ESTRUCTURA (esquema 2):
 #   {
-#       "12345": {
-#           "name": "Nombre exacto del tema",
-#           "messages": [{"id": 111}, {"id": 112}, ...],
-#           "created_at": 1700000000.0,
-#           "is_pelis": True/False,
-#           "movies": [
-#               {"id": 111, "title": "Título en descripción"},
-#           ],
-#           "muted": True/False
-#       },
-#       ...
+#       "schema": 2,
+#       "topics": {
+#           "12345": {
+#               "name": "Nombre exacto del tema",
+#               "messages": "111-150,152,160-170",   (ver MessageRuns)
+#               "created_at": 1700000000.0,
+#               "is_pelis": true,                    (solo si lo es)
+#               "movies": [                          (solo si is_pelis)
+#                   {"id": 111, "title": "Título en descripción"},
+#               ],
+#               "muted": true                        (solo si lo está)
+#           },
+#           ...
+#       }
 #   }
+#   El esquema 1 era el dict de temas suelto, sin "schema".
 # ======================================================
-def load_topics():
-    if not TOPICS_FILE.exists():
-        return {}
-    try:
-        with open(TOPICS_FILE, "r", encoding="utf-8") as f:
-            data = json.load(f)
-
-        changed = False
-        for tid, info in list(data.items()):
-            # Saneamos entradas raras
-            if "name" not in info:
-                del data[tid]
-                changed = True
+class MessageRuns:
+    """
+    IDs de mensajes de un tema como rangos consecutivos ordenados.
+    En memoria son dos array('q') (inicio y fin de cada rango) y en disco
+    un texto compacto "111-150,152,160-170". Los IDs de un tema suelen ser
+    crecientes y seguidos, así que casi todo cae en pocos rangos.
+    """
+
+    __slots__ = ("starts", "ends", "count")
+
+    def __init__(self, ids=()):
+        self.starts = array("q")
+        self.ends = array("q")
+        self.count = 0
+        for mid in sorted(set(ids)):
+            self.add(mid)
+
+    def add(self, mid: int) -> bool:
+        """Añade un ID. Devuelve False si ya estaba."""
+        starts, ends = self.starts, self.ends
+        # Camino rápido: ID nuevo al final (lo normal en detect)
+        if not starts or mid > ends[-1]:
+            if starts and mid == ends[-1] + 1:
+                ends[-1] = mid
+            else:
+                starts.append(mid)
+                ends.append(mid)
+            self.count += 1
+            return True
+
+        i = bisect_right(starts, mid) - 1
+        if i >= 0 and mid <= ends[i]:
+            return False
+        junto_anterior = i >= 0 and ends[i] + 1 == mid
+        junto_siguiente = i + 1 < len(starts) and starts[i + 1] - 1 == mid
+        if junto_anterior and junto_siguiente:
+            ends[i] = ends[i + 1]
+            del starts[i + 1]
+            del ends[i + 1]
+        elif junto_anterior:
+            ends[i] = mid
+        elif junto_siguiente:
+            starts[i + 1] = mid
+        else:
+            starts.insert(i + 1, mid)
+            ends.insert(i + 1, mid)
+        self.count += 1
+        return True
+
+    def discard(self, mid: int) -> bool:
+        """Quita un ID. Devuelve False si no estaba."""
+        starts, ends = self.starts, self.ends
+        i = bisect_right(starts, mid) - 1
+        if i < 0 or mid > ends[i]:
+            return False
+        inicio, fin = starts[i], ends[i]
+        if inicio == fin:
+            del starts[i]
+            del ends[i]
+        elif mid == inicio:
+            starts[i] = mid + 1
+        elif mid == fin:
+            ends[i] = mid - 1
+        else:
+            ends[i] = mid - 1
+            starts.insert(i + 1, mid + 1)
+            ends.insert(i + 1, fin)
+        self.count -= 1
+        return True
+
+    def __contains__(self, mid) -> bool:
+        i = bisect_right(self.starts, mid) - 1
+        return i >= 0 and mid <= self.ends[i]
+
+    def __len__(self) -> int:
+        return self.count
+
+    def __iter__(self):
+        for inicio, fin in zip(self.starts, self.ends):
+            yield from range(inicio, fin + 1)
+
+    def iter_after(self, mid: int):
+        """IDs mayores que mid, en orden (para seguir un recorrido por donde se dejó)."""
+        i = bisect_right(self.ends, mid)
+        while i < len(self.starts):
+            yield from range(max(self.starts[i], mid + 1), self.ends[i] + 1)
+            i += 1
+
+    def encode(self) -> str:
+        return ",".join(
+            str(inicio) if inicio == fin else f"{inicio}-{fin}"
+            for inicio, fin in zip(self.starts, self.ends)
+        )
+
+    @classmethod
+    def decode(cls, value, estricto=True):
+        """
+        Acepta el texto compacto o el formato antiguo [{"id": 111}, ...].
+        Con estricto=True lanza ValueError si algo no es un ID válido;
+        si no, simplemente se salta esas entradas.
+        """
+        runs = cls()
+        if isinstance(value, str):
+            for parte in filter(None, value.split(",")):
+                inicio, _, fin = parte.partition("-")
+                try:
+                    inicio = int(inicio)
+                    fin = int(fin) if fin else inicio
+                    if inicio <= 0 or fin < inicio:
+                        raise ValueError(f"rango no válido: {parte}")
+                except ValueError:
+                    if estricto:
+                        raise
+                    continue
+                if not runs.starts or inicio > runs.ends[-1] + 1:
+                    runs.starts.append(inicio)
+                    runs.ends.append(fin)
+                    runs.count += fin - inicio + 1
+                else:
+                    for mid in range(inicio, fin + 1):
+                        runs.add(mid)
+            return runs
+
+        ids = []
+        for m in value or []:
+            mid = m.get("id") if isinstance(m, dict) else m
+            if not isinstance(mid, int) or isinstance(mid, bool) or mid <= 0:
+                if estricto:
+                    raise ValueError(f"ID de mensaje no válido: {m!r}")
                 continue
-            if "messages" not in info:
-                info["messages"] = []
-                changed = True
-            if "created_at" not in info:
-                info["created_at"] = 0
-                changed = True
-            if info.get("is_pelis") and "movies" not in info:
-                info["movies"] = []
-                changed = True
-            # muted puede no existir, no pasa nada
-
-        if changed:
-            save_topics(data)
+            ids.append(mid)
+        runs.__init__(ids)
+        return runs
+
+
+# ======================================================
+#   MODELO: Topic / Movie / User
+#   Esquema fijo con __slots__. Se construyen una vez al cargar
+#   el JSON y se vuelven a convertir en dict al guardar.
+# ======================================================
+class Movie:
+    __slots__ = ("id", "title", "unique_id")
+
+    def __init__(self, id: int, title: str = "", unique_id: str = ""):
+        self.id = id
+        self.title = title
+        self.unique_id = unique_id
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(d["id"], d["title"], d.get("unique_id", ""))
+
+    def to_dict(self) -> dict:
+        d = {"id": self.id, "title": self.title}
+        if self.unique_id:
+            d["unique_id"] = self.unique_id
+        return d
+
+
+class Topic:
+    __slots__ = ("tid", "name", "messages", "created_at", "is_pelis", "movies", "muted")
+
+    def __init__(
+        self,
+        tid: str,
+        name: str,
+        messages: MessageRuns | None = None,
+        created_at: float = 0,
+        is_pelis: bool = False,
+        movies: list | None = None,
+        muted: bool = False,
+    ):
+        self.tid = tid
+        self.name = name
+        self.messages = messages if messages is not None else MessageRuns()
+        self.created_at = created_at
+        self.is_pelis = is_pelis
+        self.movies = movies if movies is not None else []
+        self.muted = muted
+
+    @classmethod
+    def from_dict(cls, tid: str, d: dict):
+        """Construye el tema desde el JSON guardado (ya en el esquema actual, sin comprobaciones)."""
+        return cls(
+            tid,
+            d["name"],
+            MessageRuns.decode(d["messages"]),
+            d["created_at"],
+            d.get("is_pelis", False),
+            [Movie.from_dict(m) for m in d.get("movies", ())],
+            d.get("muted", False),
+        )
+
+    def to_dict(self) -> dict:
+        d = {
+            "name": self.name,
+            "messages": self.messages.encode(),
+            "created_at": self.created_at,
+        }
+        if self.is_pelis:
+            d["is_pelis"] = True
+            d["movies"] = [m.to_dict() for m in self.movies]
+        if self.muted:
+            d["muted"] = True
+        return d
+
+
+class User:
+    __slots__ = ("id", "name", "username", "first_seen")
+
+    def __init__(self, id: int, name: str = "", username: str = "", first_seen: float = 0):
+        self.id = id
+        self.name = name
+        self.username = username
+        self.first_seen = first_seen
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(d["id"], d.get("name") or "", d.get("username") or "", d.get("first_seen") or 0)
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "name": self.name,
+            "username": self.username,
+            "first_seen": self.first_seen,
+        }
+
+
+def _json_default(obj):
+    """Serialización del modelo para json.dump(..., default=_json_default)."""
+    if isinstance(obj, (Topic, Movie, User)):
+        return obj.to_dict()
+    if isinstance(obj, MessageRuns):
+        return obj.encode()
+    raise TypeError(f"{type(obj).__name__} no es serializable")
+
+
+# ======================================================
+#   MIGRACIONES DE ESQUEMA
+#   Cada función pasa el dict de temas de la versión N a la N+1.
+#   Se aplican una sola vez (al arrancar, en el primer load_topics)
+#   y el archivo se reescribe ya migrado; a partir de ahí la carga
+#   se fía del esquema y no revisa tema por tema.
+# ======================================================
+def _migrar_v1(topics: dict) -> dict:
+    """
+    Esquema 1 -> 2: mensajes [{"id": ...}] a rangos compactos, claves
+    obligatorias rellenadas y entradas rotas (sin nombre) descartadas.
+    """
+    nuevo = {}
+    for tid, info in topics.items():
+        if not isinstance(info, dict) or not isinstance(info.get("name"), str):
+            continue
+        movies = [
+            Movie(m["id"], m.get("title") or "", m.get("unique_id") or "")
+            for m in info.get("movies") or []
+            if isinstance(m, dict) and isinstance(m.get("id"), int)
+        ]
+        tema = Topic(
+            tid,
+            info["name"],
+            MessageRuns.decode(info.get("messages"), estricto=False),
+            info.get("created_at") or 0,
+            bool(info.get("is_pelis")),
+            movies,
+            bool(info.get("muted")),
+        )
+        nuevo[tid] = tema.to_dict()
+    return nuevo
+
+
+MIGRACIONES = {1: _migrar_v1}  # versión de origen -> función
+
+
+def version_esquema(doc) -> int:
+    if isinstance(doc, dict) and isinstance(doc.get("schema"), int) and isinstance(doc.get("topics"), dict):
+        return doc["schema"]
+    return 1
+
+
+def migrar_topics(doc) -> dict:
+    """Dict de temas en el esquema actual a partir de un topics.json de cualquier versión."""
+    version = version_esquema(doc)
+    if version > TOPICS_SCHEMA:
+        raise ValueError(f"topics.json tiene el esquema {version}, más nuevo que este bot ({TOPICS_SCHEMA})")
+    topics = doc if version == 1 else doc["topics"]
+    while version < TOPICS_SCHEMA:
+        topics = MIGRACIONES[version](topics)
+        version += 1
+    return topics
+
+
+def migrar_archivo_topics(doc, path: Path = TOPICS_FILE) -> dict:
+    """Migra un topics.json en disco (guarda una copia del original) y devuelve el documento nuevo."""
+    origen = version_esquema(doc)
+    topics = migrar_topics(doc)
+    shutil.copyfile(path, path.with_name(f"topics.v{origen}.json"))
+    nuevo = {"schema": TOPICS_SCHEMA, "topics": topics}
+    write_json_atomic(path, nuevo)
+    print(f"[migración] {path}: esquema {origen} -> {TOPICS_SCHEMA} ({len(topics)} temas)")
+    return nuevo
+
+
+# ======================================================
+#   CATÁLOGO EN MEMORIA (UN SHARD POR GRUPO)
+#   Cada grupo de GROUP_IDS tiene su propio topics.json, snapshot,
+#   tema de películas y temas silenciados. El JSON de un grupo se lee
+#   la primera vez que hace falta y se mantiene en memoria; los grupos
+#   adicionales se descargan tras SHARD_IDLE_SECONDS sin uso, así que
+#   un grupo sin actividad no ocupa nada.
+#   Las claves de los temas del grupo principal son el thread_id tal
+#   cual; las de los demás llevan delante "<group_id>/" (solo en
+#   memoria y en los botones: en disco se guardan sin prefijo).
+#   "version" sube cuando cambian temas, nombres o películas y sirve
+#   para saber cuándo hay que reconstruir los índices y la caché de
+#   búsquedas. Un mensaje nuevo en un tema existente no la cambia.
+# ======================================================
+_VERSIONES = itertools.count(1)  # compartido por todos los grupos: nunca se repite
+VISTA_TODOS = "todos"  # vista con los catálogos de todos los grupos juntos
+
+
+class Catalogo(dict):
+    """Temas de una vista: un grupo (vista = group_id) o todos juntos (VISTA_TODOS)."""
+
+    __slots__ = ("vista", "version")
+
+    def __init__(self, vista, topics=(), version=None):
+        super().__init__(topics)
+        self.vista = vista
+        self.version = next(_VERSIONES) if version is None else version
+
+    def firma(self):
+        """Identifica el contenido de la vista para índices y cachés."""
+        return (self.vista, self.version)
+
+
+class Shard:
+    __slots__ = ("group_id", "topics_file", "snapshot_file", "topics", "pendiente", "solo_lectura", "usado")
 
+    def __init__(self, group_id: int):
+        carpeta = DATA_DIR if group_id == GROUP_ID else GROUPS_DIR / str(group_id)
+        self.group_id = group_id
+        self.topics_file = carpeta / "topics.json"
+        self.snapshot_file = carpeta / "topics.snapshot"
+        self.topics = None  # Catalogo, o None si no está cargado
+        self.pendiente = False  # la memoria va por delante del disco (falló un guardado)
+        self.solo_lectura = False  # topics.json no se pudo leer: no se sobrescribe (ver load_topics)
+        self.usado = 0.0
+
+
+_SHARDS = {gid: Shard(gid) for gid in GROUP_IDS}
+_COMBINADO = {"firma": None, "topics": None}
+_INDICES = {}  # vista -> {"version", "letters", "movies", "pelis"}
+
+
+def clave_tema(group_id: int, thread_id) -> str:
+    """Clave de un tema en el catálogo y en los botones (t:, pelis_msg:, del:)."""
+    if group_id == GROUP_ID:
+        return str(thread_id)
+    return f"{group_id}/{thread_id}"
+
+
+def grupo_de_clave(clave: str):
+    """Grupo al que pertenece una clave de tema (None si no es de ningún grupo configurado)."""
+    gid, sep, _tid = clave.rpartition("/")
+    if not sep:
+        return GROUP_ID
+    try:
+        gid = int(gid)
+    except ValueError:
+        return None
+    return gid if gid in _SHARDS else None
+
+
+def load_topics(group_id: int = GROUP_ID):
+    shard = _SHARDS[group_id]
+    shard.usado = time.time()
+    if shard.topics is not None:
+        return shard.topics
+    if not shard.topics_file.exists():
+        shard.topics = Catalogo(group_id)
+        return shard.topics
+    try:
+        t0 = time.perf_counter()
+        data = leer_snapshot(shard)
+        if data is not None:
+            METRICS.observe_store("load_snapshot", time.perf_counter() - t0)
+            shard.topics = data
+        else:
+            with open(shard.topics_file, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            if version_esquema(doc) != TOPICS_SCHEMA:
+                doc = migrar_archivo_topics(doc, shard.topics_file)
+
+            prefijo = "" if group_id == GROUP_ID else f"{group_id}/"
+            data = Catalogo(group_id)
+            for tid, info in doc["topics"].items():
+                data[prefijo + tid] = Topic.from_dict(prefijo + tid, info)
+            METRICS.observe_store("load_topics", time.perf_counter() - t0)
+            shard.topics = data
+            escribir_snapshot(shard)
+        shard.solo_lectura = False
         return data
     except Exception as e:
-        print("[load_topics] ERROR cargando JSON:", e)
-        return {}
+        # Un catálogo vacío guardado encima borraría el de disco: hasta que
+        # se lea bien (o se importe uno), save_topics no escribe en este grupo
+        print(f"[load_topics] ERROR cargando JSON del grupo {group_id}, queda en solo lectura:", e)
+        shard.solo_lectura = True
+        return Catalogo(group_id)
+
+
+def catalogo_combinado():
+    """Vista con los temas de todos los grupos (carga los que falten)."""
+    partes = [load_topics(gid) for gid in GROUP_IDS]
+    firma = tuple(p.version for p in partes)
+    if _COMBINADO["firma"] != firma:
+        # Las versiones son únicas y crecientes: el máximo cambia si cambia cualquier grupo
+        combinado = Catalogo(VISTA_TODOS, version=max(firma))
+        for p in partes:
+            combinado.update(p)
+        _COMBINADO["firma"] = firma
+        _COMBINADO["topics"] = combinado
+    return _COMBINADO["topics"]
+
+
+def vista_valida(vista) -> bool:
+    return vista == VISTA_TODOS or vista in _SHARDS
+
+
+def catalogo_vista(vista):
+    """Catálogo de un grupo o, con VISTA_TODOS, el de todos los grupos juntos."""
+    if vista == VISTA_TODOS:
+        return catalogo_combinado()
+    return load_topics(vista)
+
+
+def vista_usuario(uid: int):
+    """Grupo elegido por el usuario en el menú (el principal si no eligió o caducó la sesión)."""
+    vista = SESSIONS.get(uid, "grupo", GROUP_ID)
+    return vista if vista_valida(vista) else GROUP_ID
+
+
+def catalogo_usuario(uid: int):
+    return catalogo_vista(vista_usuario(uid))
+
+
+def catalogo_de_clave(clave: str):
+    """Catálogo del grupo al que pertenece un tema, o None si ese grupo ya no está configurado."""
+    gid = grupo_de_clave(clave)
+    return load_topics(gid) if gid is not None else None
+
+
+def nombre_vista(vista) -> str:
+    if vista == VISTA_TODOS:
+        return "Todos los grupos"
+    i = GROUP_IDS.index(vista)
+    if i < len(GROUP_NAMES) and GROUP_NAMES[i]:
+        return GROUP_NAMES[i]
+    return f"Grupo {i + 1}"
+
+
+def descargar_grupo(shard) -> bool:
+    """Saca de memoria el catálogo de un grupo adicional (antes deja el snapshot al día)."""
+    if shard.group_id == GROUP_ID or shard.topics is None or shard.pendiente:
+        return False
+    if shard.topics_file.exists():
+        escribir_snapshot(shard)
+    shard.topics = None
+    for vista in (shard.group_id, VISTA_TODOS):
+        _INDICES.pop(vista, None)
+        olvidar_fuzzy(vista)
+    _COMBINADO["firma"] = None
+    _COMBINADO["topics"] = None
+    return True
+
+
+async def shard_idle_job(context: ContextTypes.DEFAULT_TYPE):
+    """Descarga los grupos adicionales que llevan SHARD_IDLE_SECONDS sin usarse."""
+    limite = time.time() - SHARD_IDLE_SECONDS
+    for shard in _SHARDS.values():
+        if shard.topics is not None and shard.usado < limite:
+            try:
+                # En el bucle y no en un hilo: así nadie toca el catálogo mientras se escribe
+                if descargar_grupo(shard):
+                    print(f"[shard_idle_job] Catálogo del grupo {shard.group_id} descargado")
+            except Exception as e:
+                print("[shard_idle_job] ERROR:", e)
+
+
+def write_json_atomic(path: Path, data, indent=4):
+    """Escribe JSON en un temporal y lo cambia por el original (nunca queda a medias)."""
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False, default=_json_default)
+    os.replace(tmp, path)
+
+
+def save_topics(data, reindex=True, group_id=None):
+    """
+    Guarda el catálogo de un grupo: el de data si viene de load_topics,
+    si no group_id (por defecto el principal). Nunca la vista combinada.
+    reindex=False cuando solo se han añadido mensajes a un tema
+    existente (no cambia nada de lo que usan índices y búsquedas) o
+    cuando los índices ya se han parcheado (PARCHES DE ÍNDICES).
+    """
+    if group_id is None:
+        group_id = getattr(data, "vista", GROUP_ID)
+    shard = _SHARDS[group_id]
+    if shard.solo_lectura:
+        print(f"[save_topics] El topics.json del grupo {group_id} no se pudo leer: no se sobrescribe")
+        return
+    if not isinstance(data, Catalogo) or data.vista != group_id:
+        data = Catalogo(group_id, data)
+    elif reindex:
+        data.version = next(_VERSIONES)
+    shard.topics = data
+    try:
+        t0 = time.perf_counter()
+        en_disco = data
+        if group_id != GROUP_ID:
+            en_disco = {clave.rpartition("/")[2]: tema for clave, tema in data.items()}
+            shard.topics_file.parent.mkdir(parents=True, exist_ok=True)
+        write_json_atomic(shard.topics_file, {"schema": TOPICS_SCHEMA, "topics": en_disco})
+        METRICS.observe_store("save_topics", time.perf_counter() - t0)
+        shard.pendiente = False
+    except Exception as e:
+        # La memoria queda por delante del disco: no se hace snapshot de ella
+        shard.pendiente = True
+        print(f"[save_topics] ERROR guardando JSON del grupo {group_id}:", e)
 
 
-def save_topics(data):
+# ======================================================
+#   SNAPSHOT BINARIO DEL CATÁLOGO (arranque en frío)
+#   topics.snapshot guarda el catálogo por columnas con marshal:
+#   todos los rangos de mensajes van en dos arrays contiguos y cada
+#   MessageRuns es un corte de ellos. Solo vale si coincide con el
+#   mtime y el tamaño de topics.json (y con la versión de Python y
+#   del esquema); si no, se carga el JSON y se rehace el snapshot.
+#   Cada grupo tiene el suyo junto a su topics.json. Se escribe tras
+#   cargar el JSON, al descargar un grupo inactivo y al apagar el bot.
+# ======================================================
+SNAPSHOT_FORMAT = 1
+
+
+def _firma_snapshot(topics_file: Path):
+    st = topics_file.stat()
+    return (SNAPSHOT_FORMAT, TOPICS_SCHEMA, sys.version_info[:2], st.st_mtime_ns, st.st_size)
+
+
+def escribir_snapshot(shard):
     try:
-        with open(TOPICS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+        t0 = time.perf_counter()
+        data = shard.topics
+        tids, names, created, flags, counts = [], [], [], [], array("q")
+        offsets, starts, ends = array("q", [0]), array("q"), array("q")
+        movies = {}
+        for tid, tema in data.items():
+            tids.append(tid)
+            names.append(tema.name)
+            created.append(tema.created_at)
+            flags.append(tema.is_pelis | (tema.muted << 1))
+            counts.append(tema.messages.count)
+            starts.extend(tema.messages.starts)
+            ends.extend(tema.messages.ends)
+            offsets.append(len(starts))
+            if tema.movies:
+                movies[tid] = [(m.id, m.title, m.unique_id) for m in tema.movies]
+
+        cuerpo = (
+            tids,
+            names,
+            created,
+            flags,
+            counts.tobytes(),
+            offsets.tobytes(),
+            starts.tobytes(),
+            ends.tobytes(),
+            movies,
+        )
+        tmp = shard.snapshot_file.with_name(shard.snapshot_file.name + ".tmp")
+        with open(tmp, "wb") as f:
+            marshal.dump((_firma_snapshot(shard.topics_file), cuerpo), f)
+        os.replace(tmp, shard.snapshot_file)
+        METRICS.observe_store("save_snapshot", time.perf_counter() - t0)
     except Exception as e:
-        print("[save_topics] ERROR guardando JSON:", e)
+        print("[escribir_snapshot] ERROR:", e)
+
+
+def leer_snapshot(shard):
+    """Catálogo desde topics.snapshot, o None si no existe o no corresponde a topics.json."""
+    if not shard.snapshot_file.exists():
+        return None
+    try:
+        with open(shard.snapshot_file, "rb") as f:
+            firma, cuerpo = marshal.load(f)
+        if tuple(firma) != _firma_snapshot(shard.topics_file):
+            return None
+
+        tids, names, created, flags, counts_b, offsets_b, starts_b, ends_b, movies = cuerpo
+        counts, offsets, starts, ends = array("q"), array("q"), array("q"), array("q")
+        counts.frombytes(counts_b)
+        offsets.frombytes(offsets_b)
+        starts.frombytes(starts_b)
+        ends.frombytes(ends_b)
+
+        # Se crean cientos de miles de objetos sin ciclos: el GC solo estorba
+        gc_activo = gc.isenabled()
+        gc.disable()
+        try:
+            data = Catalogo(shard.group_id)
+            nuevo_runs = MessageRuns.__new__
+            for i, tid in enumerate(tids):
+                runs = nuevo_runs(MessageRuns)
+                a, b = offsets[i], offsets[i + 1]
+                runs.starts = starts[a:b]
+                runs.ends = ends[a:b]
+                runs.count = counts[i]
+                data[tid] = Topic(tid, names[i], runs, created[i], bool(flags[i] & 1), None, bool(flags[i] & 2))
+            for tid, lista in movies.items():
+                data[tid].movies = [Movie(*m) for m in lista]
+        finally:
+            if gc_activo:
+                gc.enable()
+        return data
+    except Exception as e:
+        print("[leer_snapshot] Snapshot inválido, se usa el JSON:", e)
+        return None
+
+
+def letra_de_nombre(nombre: str):
+    """Cubo del índice de letras de un nombre: 'A'..'Z', '#' o None si no tiene ninguno."""
+    _first, base = get_first_and_base(nombre)
+    if base is None:
+        return None
+    return base if "A" <= base <= "Z" else "#"
+
+
+def _ensure_index(topics):
+    """Índices en memoria de una vista; se reconstruyen si cambió su versión."""
+    indice = _INDICES.get(topics.vista)
+    if indice is not None and indice["version"] == topics.version:
+        return indice
+    letters = {}
+    movies = {}
+    pelis = []
+    for tid, info in topics.items():
+        key = letra_de_nombre(info.name)
+        if key is not None:
+            letters.setdefault(key, []).append((tid, info))
+        if info.is_pelis:
+            pelis.append(tid)
+        for m in info.movies:
+            movies.setdefault((tid, m.id), m)
+    indice = {
+        "version": topics.version,
+        "letters": {k: ordenar_temas(v) for k, v in letters.items()},
+        "movies": movies,
+        "pelis": pelis,
+    }
+    _INDICES[topics.vista] = indice
+    return indice
+
+
+def get_letter_index(topics):
+    """Índice letra -> [(tid, info), ...] ya ordenado con ordenar_temas."""
+    return _ensure_index(topics)["letters"]
+
+
+def get_movie_index(topics):
+    """Índice (tema, id de mensaje) -> Movie de todas las películas indexadas."""
+    return _ensure_index(topics)["movies"]
+
+
+# ======================================================
+#   CACHÉ COMPARTIDA DE BÚSQUEDAS
+#   (modo, consulta normalizada, vista, versión) -> [ids] ordenados.
+#   Es común a todos los usuarios. Al cambiar la versión de una vista
+#   sus entradas viejas ya no se piden y el LRU acaba echándolas.
+# ======================================================
+def normalizar_consulta(texto: str) -> str:
+    return " ".join(texto.lower().split())
+
+
+class SearchCache:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, mode: str, query: str, firma):
+        key = (mode, query, firma)
+        ids = self.data.get(key)
+        if ids is None:
+            self.misses += 1
+            return None
+        self.data.move_to_end(key)
+        self.hits += 1
+        return ids
+
+    def put(self, mode: str, query: str, firma, ids: list):
+        key = (mode, query, firma)
+        self.data[key] = ids
+        self.data.move_to_end(key)
+        while len(self.data) > self.maxsize:
+            self.data.popitem(last=False)
+
+    def invalidate(self, vistas, mode: str, textos=None) -> int:
+        """
+        Quita las entradas de mode en esas vistas. Con textos, solo las
+        consultas contenidas en alguno de ellos (las demás no cambian).
+        """
+        quitar = [
+            key
+            for key in self.data
+            if key[0] == mode
+            and key[2][0] in vistas
+            and (textos is None or any(key[1] in t for t in textos))
+        ]
+        for key in quitar:
+            del self.data[key]
+        return len(quitar)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "entries": len(self.data),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+        }
+
+
+SEARCH_CACHE = SearchCache(SEARCH_CACHE_SIZE)
+
+
+def buscar_series(topics, query: str) -> list:
+    """IDs de temas cuyo nombre contiene query, en el orden de ordenar_temas."""
+    ids = SEARCH_CACHE.get("series", query, topics.firma())
+    if ids is None:
+        matches = [
+            (tid, info)
+            for tid, info in topics.items()
+            if query in info.name.lower()
+        ]
+        ids = [tid for tid, _info in ordenar_temas(matches)]
+        SEARCH_CACHE.put("series", query, topics.firma(), ids)
+    return ids
+
+
+def buscar_peliculas(topics, query: str) -> list:
+    """
+    [(tema, id de mensaje)] de las películas cuyo título contiene query,
+    ordenadas por título. Busca en todos los temas de películas de la vista.
+    """
+    ids = SEARCH_CACHE.get("pelis", query, topics.firma())
+    if ids is None:
+        matches = []
+        for tid in get_pelis_topic_ids(topics):
+            seen_ids = set()
+            for m in topics[tid].movies:
+                mid = m.id
+                title = m.title
+                if not mid or not title:
+                    continue
+                if mid in seen_ids:
+                    continue
+                if query in title.lower():
+                    matches.append((tid, mid, title))
+                    seen_ids.add(mid)
+        matches.sort(key=lambda x: x[2].lower())
+        ids = [(tid, mid) for tid, mid, _title in matches]
+        SEARCH_CACHE.put("pelis", query, topics.firma(), ids)
+    return ids
 
 
 def get_pelis_topic_id(topics=None):
@@ -135,11 +1270,846 @@ def get_pelis_topic_id(topics=None):
     if topics is None:
         topics = load_topics()
     for tid, info in topics.items():
-        if info.get("is_pelis"):
+        if info.is_pelis:
             return tid
     return None
 
 
+def get_pelis_topic_ids(topics) -> list:
+    """Temas de películas de una vista (uno por grupo como mucho)."""
+    return _ensure_index(topics)["pelis"]
+
+
+# ======================================================
+#   BÚSQUEDA APROXIMADA ("harry poter", "juego de tronos 2")
+#   Índice de trigramas por palabra para sacar candidatos y
+#   distancia de edición por palabra para ordenarlos. Cada consulta
+#   tiene un presupuesto de FUZZY_BUDGET_MS: al agotarse se devuelve
+#   lo mejor encontrado hasta ese momento.
+#   Cuando cambia la versión del catálogo el índice se rehace en una
+#   tarea de fondo, por tramos de FUZZY_BUILD_CHUNK entradas, y mientras
+#   tanto las búsquedas usan el anterior: ninguna espera a la
+#   reconstrucción. La primera vez que se pide el de una vista solo se
+#   espera si cabe en un tramo; si no, no hay resultados aproximados
+#   hasta que esté (el del grupo principal lo construye precalentar_job).
+# ======================================================
+def normalizar_texto(s: str) -> str:
+    """minúsculas, sin acentos y solo letras/números separados por espacios."""
+    decomp = unicodedata.normalize("NFD", s.lower())
+    return "".join(
+        c if c.isalnum() else " "
+        for c in decomp
+        if not unicodedata.combining(c)
+    )
+
+
+def trigramas(palabra: str) -> set:
+    t = f" {palabra} "
+    return {t[i: i + 3] for i in range(len(t) - 2)}
+
+
+def distancia_edicion(a: str, b: str, maximo: int) -> int:
+    """Levenshtein que se rinde (devuelve maximo + 1) en cuanto se pasa de maximo."""
+    if abs(len(a) - len(b)) > maximo:
+        return maximo + 1
+    previa = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        actual = [i]
+        for j, cb in enumerate(b, 1):
+            actual.append(min(previa[j] + 1, actual[j - 1] + 1, previa[j - 1] + (ca != cb)))
+        if min(actual) > maximo:
+            return maximo + 1
+        previa = actual
+    return previa[-1]
+
+
+def similitud(q_tokens, t_tokens) -> float:
+    """Media, por palabra de la consulta, del parecido con la mejor palabra del título."""
+    total = 0.0
+    for qt in q_tokens:
+        mejor = 0.0
+        for tt in t_tokens:
+            largo = max(len(qt), len(tt))
+            d = distancia_edicion(qt, tt, largo // 2)
+            if d <= largo // 2:
+                mejor = max(mejor, 1 - d / largo)
+                if mejor == 1.0:
+                    break
+        total += mejor
+    return total / len(q_tokens)
+
+
+class FuzzyIndex:
+    def __init__(self, entries=()):
+        self.keys = []
+        self.tokens = []
+        self.postings = {}  # trigrama -> array('i') de posiciones
+        self.posiciones = {}  # clave -> posición viva
+        for key, texto in entries:
+            self.add(key, texto)
+
+    def add(self, key, texto: str):
+        if key in self.posiciones:
+            self.remove(key)  # repetir un alta no deja la entrada dos veces
+        tokens = tuple(normalizar_texto(texto).split())
+        if not tokens:
+            return
+        pos = len(self.keys)
+        self.keys.append(key)
+        self.tokens.append(tokens)
+        self.posiciones[key] = pos
+        for g in {g for t in tokens for g in trigramas(t)}:
+            lista = self.postings.get(g)
+            if lista is None:
+                lista = self.postings[g] = array("i")
+            lista.append(pos)
+
+    def remove(self, key):
+        """
+        Deja la entrada de key sin palabras: sigue en las listas de
+        trigramas pero ya nunca llega a la puntuación mínima. Los huecos
+        desaparecen la próxima vez que se reconstruye el índice.
+        """
+        pos = self.posiciones.pop(key, None)
+        if pos is not None:
+            self.tokens[pos] = ()
+
+    def replace(self, key, texto: str):
+        self.remove(key)
+        self.add(key, texto)
+
+    def search(self, query: str, limit: int, budget_ms: float = FUZZY_BUDGET_MS) -> list:
+        """Claves ordenadas por parecido (mejor primero)."""
+        inicio = time.perf_counter()
+        deadline = inicio + budget_ms / 1000
+        # La mitad del presupuesto para contar candidatos y el resto para puntuarlos
+        deadline_conteo = inicio + budget_ms / 2000
+        q_tokens = normalizar_texto(query).split()
+        if not q_tokens:
+            return []
+        grams = {g for t in q_tokens for g in trigramas(t)}
+
+        # Primero los trigramas más raros: si se acaba el tiempo, ya se
+        # han contado los más selectivos. Los muy comunes (" de") se
+        # saltan cuando hay suficientes raros.
+        listas = sorted((self.postings[g] for g in grams if g in self.postings), key=len)
+        comun = max(1000, len(self.keys) // 4)
+        counts = {}
+        for n, lista in enumerate(listas):
+            if n >= 3 and len(lista) > comun:
+                break
+            for i in range(0, len(lista), 4096):
+                if time.perf_counter() > deadline_conteo:
+                    break
+                for pos in lista[i: i + 4096]:
+                    counts[pos] = counts.get(pos, 0) + 1
+            else:
+                continue
+            break
+
+        candidatos = heapq.nlargest(FUZZY_MAX_CANDIDATES, counts.items(), key=lambda x: x[1])
+        puntuados = []
+        for pos, _n in candidatos:
+            if time.perf_counter() > deadline:
+                break
+            score = similitud(q_tokens, self.tokens[pos])
+            if score >= FUZZY_MIN_SCORE:
+                puntuados.append((-score, len(self.tokens[pos]), pos))
+        puntuados.sort()
+        return [self.keys[pos] for _s, _l, pos in puntuados[:limit]]
+
+
+_FUZZY = {}  # (modo, vista) -> (versión del catálogo, FuzzyIndex)
+_FUZZY_OBRAS = {}  # (modo, vista) -> {"tarea", "parches"} mientras se reconstruye
+
+
+def entradas_fuzzy(mode: str, topic_id: str, topic) -> list:
+    if mode == "series":
+        return [(topic_id, topic.name)]
+    return [((topic_id, m.id), m.title) for m in list(topic.movies)]
+
+
+async def _reconstruir_fuzzy(mode: str, topics):
+    """
+    Índice nuevo de una vista, por tramos. Los parches que llegan
+    mientras tanto (PARCHES DE ÍNDICES) se apuntan y se repiten al
+    final sobre el índice nuevo (las altas son idempotentes).
+    """
+    clave = (mode, topics.vista)
+    obra = _FUZZY_OBRAS[clave]
+    try:
+        version = topics.version
+        temas = list(topics.items())
+        index = FuzzyIndex()
+        for i in range(0, len(temas), FUZZY_BUILD_CHUNK):
+            for tid, info in temas[i: i + FUZZY_BUILD_CHUNK]:
+                for key, texto in entradas_fuzzy(mode, tid, info):
+                    index.add(key, texto)
+            await asyncio.sleep(0)
+        for parche in obra["parches"]:
+            parche(index)
+        _FUZZY[clave] = (version, index)
+    except Exception as e:
+        print(f"[fuzzy] ERROR reconstruyendo {clave}:", e)
+    finally:
+        if _FUZZY_OBRAS.get(clave) is obra:
+            del _FUZZY_OBRAS[clave]
+
+
+def rehacer_fuzzy(mode: str, topics):
+    """Lanza la reconstrucción del índice de una vista si no hay ya una en marcha; devuelve la tarea."""
+    clave = (mode, topics.vista)
+    obra = _FUZZY_OBRAS.get(clave)
+    if obra is None:
+        obra = _FUZZY_OBRAS[clave] = {"tarea": None, "parches": []}
+        obra["tarea"] = asyncio.get_running_loop().create_task(_reconstruir_fuzzy(mode, topics))
+    return obra["tarea"]
+
+
+def olvidar_fuzzy(vista):
+    """Descarta los índices aproximados de una vista (y sus reconstrucciones en marcha)."""
+    for mode in ("series", "pelis"):
+        _FUZZY.pop((mode, vista), None)
+        obra = _FUZZY_OBRAS.pop((mode, vista), None)
+        if obra is not None:
+            obra["tarea"].cancel()
+
+
+async def get_fuzzy_index(mode: str, topics):
+    """
+    (índice, al_día) de "series" (nombres de temas) o "pelis" (títulos,
+    con claves (tema, id de mensaje)) de una vista. Si la versión
+    cambió se devuelve el índice anterior y se rehace en segundo plano.
+    Si nunca se construyó solo se espera cuando cabe en un tramo; si
+    no, (None, False) hasta que esté (precalentar_job lo adelanta).
+    """
+    actual = _FUZZY.get((mode, topics.vista))
+    if actual is not None and actual[0] == topics.version:
+        return actual[1], True
+    tarea = rehacer_fuzzy(mode, topics)
+    if actual is not None:
+        return actual[1], False
+    if mode == "series":
+        entradas = len(topics)
+    else:
+        entradas = sum(len(topics[tid].movies) for tid in get_pelis_topic_ids(topics))
+    if entradas > FUZZY_BUILD_CHUNK:
+        return None, False
+    await asyncio.shield(tarea)
+    actual = _FUZZY.get((mode, topics.vista))
+    if actual is None:
+        return None, False
+    return actual[1], actual[0] == topics.version
+
+
+async def buscar_aproximado(mode: str, topics, query: str) -> list:
+    """Como buscar_series/buscar_peliculas pero tolerando errores de escritura."""
+    cache_mode = mode + "~"
+    ids = SEARCH_CACHE.get(cache_mode, query, topics.firma())
+    if ids is None:
+        index, al_dia = await get_fuzzy_index(mode, topics)
+        if index is None:
+            return []
+        ids = index.search(query, FUZZY_LIMIT)
+        if al_dia:
+            SEARCH_CACHE.put(cache_mode, query, topics.firma(), ids)
+        else:
+            # Índice anterior: fuera lo que ya no está y sin guardar en la caché
+            vivas = topics if mode == "series" else get_movie_index(topics)
+            ids = [key for key in ids if key in vivas]
+    return ids
+
+
+# ======================================================
+#   PARCHES DE ÍNDICES
+#   Dar de alta un tema o una película, renombrar un tema o cambiar o
+#   quitar una película no cambia la versión del catálogo (así ninguna
+#   búsqueda espera a reconstruir un índice): solo se toca esa entrada en los índices ya
+#   construidos (letras, películas y aproximados) de su grupo y de la
+#   vista combinada, y de la caché se quitan únicamente las búsquedas
+#   que podían incluirla. Las aproximadas se quitan todas.
+# ======================================================
+def _indices_afectados(group_id: int) -> list:
+    """Índices al día que incluyen los temas de un grupo (el suyo y el combinado)."""
+    afectados = []
+    for vista, topics in ((group_id, _SHARDS[group_id].topics), (VISTA_TODOS, _COMBINADO["topics"])):
+        indice = _INDICES.get(vista)
+        if topics is not None and indice is not None and indice["version"] == topics.version:
+            afectados.append(indice)
+    return afectados
+
+
+def _parchear_fuzzy(mode: str, group_id: int, parche):
+    for vista in (group_id, VISTA_TODOS):
+        actual = _FUZZY.get((mode, vista))
+        if actual is not None:
+            parche(actual[1])
+        obra = _FUZZY_OBRAS.get((mode, vista))
+        if obra is not None:
+            obra["parches"].append(parche)  # el índice que se está rehaciendo también lo necesita
+
+
+def _quitar_de_letra(letters: dict, clave: str, topic):
+    """Saca un tema de su cubo de letra (con el nombre que tenía al indexarlo)."""
+    cubo = letters.get(letra_de_nombre(topic.name))
+    if not cubo:
+        return
+    i = bisect_left(cubo, clave_orden_tema((clave, topic)), key=clave_orden_tema)
+    while i < len(cubo) and cubo[i][0] != clave:
+        i += 1
+    if i < len(cubo):
+        del cubo[i]
+
+
+def anadir_tema(topics, clave: str, topic):
+    """Da de alta un tema nuevo de un grupo y lo coloca en los índices ya construidos."""
+    afectados = _indices_afectados(topics.vista)
+    topics[clave] = topic
+    combinado = _COMBINADO["topics"]
+    if combinado is not None:
+        combinado[clave] = topic
+    letra = letra_de_nombre(topic.name)
+    if letra is not None:
+        for indice in afectados:
+            insort(indice["letters"].setdefault(letra, []), (clave, topic), key=clave_orden_tema)
+    _parchear_fuzzy("series", topics.vista, lambda index: index.add(clave, topic.name))
+
+    vistas = (topics.vista, VISTA_TODOS)
+    SEARCH_CACHE.invalidate(vistas, "series", (topic.name.lower(),))
+    SEARCH_CACHE.invalidate(vistas, "series~")
+
+
+def anadir_pelicula(topics, clave: str, movie):
+    """Añade una película a un tema de películas sin reconstruir los índices."""
+    topics[clave].movies.append(movie)
+    for indice in _indices_afectados(topics.vista):
+        indice["movies"].setdefault((clave, movie.id), movie)
+    _parchear_fuzzy("pelis", topics.vista, lambda index: index.add((clave, movie.id), movie.title))
+
+    vistas = (topics.vista, VISTA_TODOS)
+    SEARCH_CACHE.invalidate(vistas, "pelis", (movie.title.lower(),))
+    SEARCH_CACHE.invalidate(vistas, "pelis~")
+
+
+def renombrar_tema(topics, clave: str, nombre: str) -> bool:
+    """Cambia el nombre de un tema de un grupo y lo recoloca en los índices."""
+    topic = topics[clave]
+    anterior = topic.name
+    if nombre == anterior:
+        return False
+    afectados = _indices_afectados(topics.vista)
+    for indice in afectados:
+        _quitar_de_letra(indice["letters"], clave, topic)
+    topic.name = nombre
+    letra = letra_de_nombre(nombre)
+    if letra is not None:
+        for indice in afectados:
+            insort(indice["letters"].setdefault(letra, []), (clave, topic), key=clave_orden_tema)
+    _parchear_fuzzy("series", topics.vista, lambda index: index.replace(clave, nombre))
+
+    vistas = (topics.vista, VISTA_TODOS)
+    SEARCH_CACHE.invalidate(vistas, "series", (anterior.lower(), nombre.lower()))
+    SEARCH_CACHE.invalidate(vistas, "series~")
+    return True
+
+
+def buscar_pelicula(topics, clave: str, mid: int):
+    """Movie de un mensaje de un tema de películas, o None si no está indexada."""
+    indice = _INDICES.get(topics.vista)
+    if indice is not None and indice["version"] == topics.version:
+        return indice["movies"].get((clave, mid))
+    topic = topics.get(clave)
+    if topic is None:
+        return None
+    return next((m for m in topic.movies if m.id == mid), None)
+
+
+def retitular_pelicula(topics, clave: str, mid: int, titulo: str, unique_id: str = "") -> bool:
+    """Actualiza el título (y el archivo) de una película ya indexada; True si cambió algo."""
+    movie = buscar_pelicula(topics, clave, mid)
+    if movie is None:
+        return False
+    cambio = False
+    if unique_id and unique_id != movie.unique_id:
+        movie.unique_id = unique_id
+        cambio = True
+    anterior = movie.title
+    if titulo == anterior:
+        return cambio
+    movie.title = titulo
+    _parchear_fuzzy("pelis", topics.vista, lambda index: index.replace((clave, mid), titulo))
+
+    vistas = (topics.vista, VISTA_TODOS)
+    SEARCH_CACHE.invalidate(vistas, "pelis", (anterior.lower(), titulo.lower()))
+    SEARCH_CACHE.invalidate(vistas, "pelis~")
+    return True
+
+
+def quitar_pelicula(topics, clave: str, mid: int) -> bool:
+    """Quita del catálogo una película cuyo mensaje ya no existe; True si estaba."""
+    topic = topics.get(clave)
+    if topic is None or not topic.movies:
+        return False
+    quitadas = [m.title.lower() for m in topic.movies if m.id == mid]
+    if not quitadas:
+        return False
+    topic.movies = [m for m in topic.movies if m.id != mid]
+    for indice in _indices_afectados(topics.vista):
+        indice["movies"].pop((clave, mid), None)
+    _parchear_fuzzy("pelis", topics.vista, lambda index: index.remove((clave, mid)))
+
+    vistas = (topics.vista, VISTA_TODOS)
+    SEARCH_CACHE.invalidate(vistas, "pelis", quitadas)
+    SEARCH_CACHE.invalidate(vistas, "pelis~")
+    return True
+
+
+# ======================================================
+#   SESIONES (estado de conversación por usuario)
+#   Sustituye a context.user_data, que nunca se vaciaba: cada sesión
+#   caduca tras SESSION_TTL segundos sin uso y como mucho hay
+#   SESSION_MAX a la vez (se expulsan las menos usadas).
+# ======================================================
+class SessionStore:
+    def __init__(self, ttl: int, maxsize: int):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.data = OrderedDict()  # user_id -> [último_uso, {clave: valor}]
+        self.dirty = set()  # user_id cambiados o borrados desde el último guardado
+        self.touched = set()  # user_id solo leídos (basta con actualizar el último uso)
+        self.expired = 0
+        self.evicted = 0
+
+    def _entry(self, uid: int):
+        entry = self.data.get(uid)
+        if entry is None:
+            return None
+        now = time.time()
+        if now - entry[0] > self.ttl:
+            del self.data[uid]
+            self.dirty.add(uid)
+            self.expired += 1
+            return None
+        entry[0] = now
+        self.touched.add(uid)
+        self.data.move_to_end(uid)
+        return entry
+
+    def get(self, uid: int, key: str, default=None):
+        entry = self._entry(uid)
+        if entry is None:
+            return default
+        return entry[1].get(key, default)
+
+    def set(self, uid: int, key: str, value):
+        entry = self._entry(uid)
+        if entry is None:
+            entry = self.data[uid] = [time.time(), {}]
+        entry[1][key] = value
+        self.dirty.add(uid)
+        while len(self.data) > self.maxsize:
+            expulsado, _entry = self.data.popitem(last=False)
+            self.dirty.add(expulsado)
+            self.evicted += 1
+
+    def pop(self, uid: int, key: str, default=None):
+        entry = self._entry(uid)
+        if entry is None:
+            return default
+        if key not in entry[1]:
+            return default
+        value = entry[1].pop(key)
+        self.dirty.add(uid)
+        if not entry[1]:
+            del self.data[uid]
+        return value
+
+    def take_dirty(self):
+        """
+        Sesiones cambiadas desde la última llamada: ([(user_id, último_uso, JSON)],
+        [(último_uso, user_id)] de las que solo se leyeron, [user_id borrados]).
+        Las caducadas en purge() no hace falta apuntarlas: la tabla se recorta por fecha.
+        """
+        filas, usos, borradas = [], [], []
+        for uid in self.dirty:
+            entry = self.data.get(uid)
+            if entry is None:
+                borradas.append((uid,))
+            else:
+                filas.append((uid, entry[0], json.dumps(entry[1], ensure_ascii=False)))
+        for uid in self.touched - self.dirty:
+            entry = self.data.get(uid)
+            if entry is not None:
+                usos.append((entry[0], uid))
+        self.dirty = set()
+        self.touched = set()
+        return filas, usos, borradas
+
+    def purge(self) -> int:
+        """Quita las sesiones caducadas (las más antiguas están al principio)."""
+        limite = time.time() - self.ttl
+        quitadas = 0
+        while self.data:
+            uid, entry = next(iter(self.data.items()))
+            if entry[0] >= limite:
+                break
+            del self.data[uid]
+            quitadas += 1
+        self.expired += quitadas
+        return quitadas
+
+    def stats(self) -> dict:
+        """Número de sesiones y memoria aproximada que ocupan (bytes)."""
+        size = sys.getsizeof(self.data)
+        for uid, entry in self.data.items():
+            size += sys.getsizeof(uid) + sys.getsizeof(entry) + sys.getsizeof(entry[1])
+            for k, v in entry[1].items():
+                size += sys.getsizeof(k) + sys.getsizeof(v)
+        return {
+            "sessions": len(self.data),
+            "bytes": size,
+            "expired": self.expired,
+            "evicted": self.evicted,
+        }
+
+
+SESSIONS = SessionStore(SESSION_TTL, SESSION_MAX)
+
+
+async def session_purge_job(context: ContextTypes.DEFAULT_TYPE):
+    quitadas = SESSIONS.purge()
+    if quitadas:
+        print(f"[session_purge_job] {quitadas} sesiones caducadas eliminadas")
+
+
+# ======================================================
+#   PERSISTENCIA DE SESIONES (sesiones.db)
+#   Al reiniciar se recuperan el modo de búsqueda y el grupo elegido
+#   de cada usuario y las consultas de los botones "pelis_page:".
+#   Nada se escribe al atender un update: se apunta qué cambió y cada
+#   SESSION_FLUSH_SECONDS se guardan solo esas filas en una transacción
+#   (en el hilo de aiosqlite, fuera del bucle). Las sesiones caducadas
+#   y las consultas que ya no caben en PELIS_QUERY_TOKENS se borran
+#   de la tabla en el mismo guardado.
+# ======================================================
+ESQUEMA_SESIONES = """
+CREATE TABLE IF NOT EXISTS sesiones (
+    user_id INTEGER PRIMARY KEY,
+    uso REAL NOT NULL,
+    datos TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sesiones_uso ON sesiones (uso);
+CREATE TABLE IF NOT EXISTS consultas_pelis (
+    token TEXT PRIMARY KEY,
+    uso REAL NOT NULL,
+    datos TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS consultas_pelis_uso ON consultas_pelis (uso);
+"""
+
+_PERSISTENCIA = {"db": None, "consultas": set()}  # consultas: tokens cambiados sin guardar
+
+
+async def cargar_sesiones():
+    """Abre sesiones.db y recupera las sesiones sin caducar y las últimas consultas de películas."""
+    try:
+        db = await aiosqlite.connect(SESSIONS_DB, timeout=30)
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.executescript(ESQUEMA_SESIONES)
+        _PERSISTENCIA["db"] = db
+
+        t0 = time.perf_counter()
+        cur = await db.execute(
+            "SELECT user_id, uso, datos FROM"
+            " (SELECT * FROM sesiones WHERE uso >= ? ORDER BY uso DESC LIMIT ?) ORDER BY uso",
+            (time.time() - SESSION_TTL, SESSION_MAX),
+        )
+        for uid, uso, datos in await cur.fetchall():
+            SESSIONS.data[uid] = [uso, json.loads(datos)]
+        cur = await db.execute(
+            "SELECT token, datos FROM"
+            " (SELECT * FROM consultas_pelis ORDER BY uso DESC LIMIT ?) ORDER BY uso",
+            (PELIS_QUERY_TOKENS,),
+        )
+        for token, datos in await cur.fetchall():
+            _PELIS_QUERIES[token] = tuple(json.loads(datos))
+        METRICS.observe_store("load_sessions", time.perf_counter() - t0)
+        print(f"Sesiones recuperadas: {len(SESSIONS.data)} · consultas de películas: {len(_PELIS_QUERIES)}")
+    except Exception as e:
+        print("[cargar_sesiones] ERROR:", e)
+
+
+async def guardar_sesiones():
+    """Escribe lo que cambió desde el último guardado y recorta lo caducado."""
+    db = _PERSISTENCIA["db"]
+    if db is None:
+        return
+    filas, usos, borradas = SESSIONS.take_dirty()
+    ahora = time.time()
+    tokens = _PERSISTENCIA["consultas"]
+    _PERSISTENCIA["consultas"] = set()
+    consultas = [
+        (token, ahora, json.dumps(_PELIS_QUERIES[token], ensure_ascii=False))
+        for token in tokens
+        if token in _PELIS_QUERIES
+    ]
+    try:
+        t0 = time.perf_counter()
+        if filas:
+            await db.executemany(
+                "INSERT OR REPLACE INTO sesiones (user_id, uso, datos) VALUES (?, ?, ?)", filas
+            )
+        if usos:
+            # Solo leídas: basta con mover la fecha, sin volver a serializar los datos
+            await db.executemany("UPDATE sesiones SET uso = ? WHERE user_id = ?", usos)
+        if borradas:
+            await db.executemany("DELETE FROM sesiones WHERE user_id = ?", borradas)
+        await db.execute("DELETE FROM sesiones WHERE uso < ?", (ahora - SESSION_TTL,))
+        if consultas:
+            await db.executemany(
+                "INSERT OR REPLACE INTO consultas_pelis (token, uso, datos) VALUES (?, ?, ?)", consultas
+            )
+            await db.execute(
+                "DELETE FROM consultas_pelis WHERE token NOT IN"
+                " (SELECT token FROM consultas_pelis ORDER BY uso DESC LIMIT ?)",
+                (PELIS_QUERY_TOKENS,),
+            )
+        await db.commit()
+        if filas or usos or borradas or consultas:
+            METRICS.observe_store("save_sessions", time.perf_counter() - t0)
+    except Exception as e:
+        # Se reintentan en el siguiente guardado
+        SESSIONS.dirty.update(uid for uid, *_resto in filas)
+        SESSIONS.touched.update(uid for _uso, uid in usos)
+        SESSIONS.dirty.update(uid for (uid,) in borradas)
+        _PERSISTENCIA["consultas"] |= tokens
+        print("[guardar_sesiones] ERROR:", e)
+
+
+async def sesiones_flush_job(context: ContextTypes.DEFAULT_TYPE):
+    await guardar_sesiones()
+
+
+async def cerrar_sesiones():
+    await guardar_sesiones()
+    if _PERSISTENCIA["db"] is not None:
+        await _PERSISTENCIA["db"].close()
+        _PERSISTENCIA["db"] = None
+
+
+# ======================================================
+#   POPULARIDAD (temas, películas, páginas de letras y búsquedas)
+#   Contadores en memoria: sumar uno es un acceso a un dict. Cada
+#   POPULAR_FLUSH_SECONDS, si cambió algo, se recalcula el top de
+#   temas de cada vista (el listado "Populares" se sirve de ahí) y se
+#   guarda populares.json en un hilo. Al arrancar, precalentar_job
+#   construye los índices de las vistas más usadas, pinta sus páginas
+#   de letras más vistas y repite las búsquedas más frecuentes para
+#   que los primeros usuarios ya encuentren la caché llena.
+#   Claves (texto, para el JSON):
+#     temas      clave del tema
+#     pelis      "<clave del tema>:<id de mensaje>"
+#     letras     "<vista>:<letra>:<página>"
+#     busquedas  "<modo>\t<vista>\t<consulta normalizada>"
+# ======================================================
+_POPULARIDAD = {"temas": {}, "pelis": {}, "letras": {}, "busquedas": {}}
+_POPULAR_CAMBIOS = {"pendiente": False}
+_TOP = {}  # vista -> [clave de tema] más pedidas primero
+
+
+def contar_popular(tipo: str, clave: str):
+    tabla = _POPULARIDAD[tipo]
+    tabla[clave] = tabla.get(clave, 0) + 1
+    _POPULAR_CAMBIOS["pendiente"] = True
+
+
+def vista_de_texto(texto: str):
+    """Vista guardada como texto en una clave ("todos" o el id del grupo); None si ya no existe."""
+    if texto == VISTA_TODOS:
+        return VISTA_TODOS
+    try:
+        vista = int(texto)
+    except ValueError:
+        return None
+    return vista if vista_valida(vista) else None
+
+
+def calcular_top():
+    """Top de temas por vista; con margen para los que se borren u oculten después."""
+    limite = POPULAR_TOP_K + 10
+    temas = _POPULARIDAD["temas"]
+    top = {VISTA_TODOS: heapq.nlargest(limite, temas, key=temas.get)}
+    por_grupo = {}
+    for clave in temas:
+        gid = grupo_de_clave(clave)
+        if gid is not None:
+            por_grupo.setdefault(gid, []).append(clave)
+    for gid, claves in por_grupo.items():
+        top[gid] = heapq.nlargest(limite, claves, key=temas.get)
+    _TOP.clear()
+    _TOP.update(top)
+
+
+def cargar_popularidad():
+    try:
+        if POPULAR_FILE.exists():
+            with open(POPULAR_FILE, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            for tipo, tabla in _POPULARIDAD.items():
+                tabla.update(doc.get(tipo, {}))
+    except Exception as e:
+        print("[cargar_popularidad] ERROR leyendo populares.json:", e)
+    calcular_top()
+
+
+async def guardar_popularidad():
+    if not _POPULAR_CAMBIOS["pendiente"]:
+        return
+    _POPULAR_CAMBIOS["pendiente"] = False
+    busquedas = _POPULARIDAD["busquedas"]
+    if len(busquedas) > POPULAR_MAX_QUERIES:
+        quedan = heapq.nlargest(POPULAR_MAX_QUERIES, busquedas.items(), key=lambda kv: kv[1])
+        busquedas.clear()
+        busquedas.update(quedan)
+    calcular_top()
+    # Copia en el bucle (nadie la toca mientras se escribe) y escritura en un hilo
+    doc = {tipo: dict(tabla) for tipo, tabla in _POPULARIDAD.items()}
+    try:
+        t0 = time.perf_counter()
+        await asyncio.to_thread(write_json_atomic, POPULAR_FILE, doc, None)
+        METRICS.observe_store("save_popular", time.perf_counter() - t0)
+    except Exception as e:
+        _POPULAR_CAMBIOS["pendiente"] = True
+        print("[guardar_popularidad] ERROR:", e)
+
+
+async def popularidad_job(context: ContextTypes.DEFAULT_TYPE):
+    await guardar_popularidad()
+
+
+def mas_populares(tabla: dict, n: int) -> list:
+    return heapq.nlargest(n, tabla.items(), key=lambda kv: kv[1])
+
+
+async def precalentar_job(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Una vez, poco después de arrancar: índices aproximados del grupo
+    principal, índices de las vistas más usadas, sus páginas de letras
+    más vistas y las búsquedas más repetidas (con la misma lógica que
+    search_text, así quedan en SEARCH_CACHE con la misma clave). Cede
+    el bucle entre paso y paso.
+    """
+    t0 = time.perf_counter()
+    principal = catalogo_vista(GROUP_ID)
+    for mode in ("series", "pelis"):
+        actual = _FUZZY.get((mode, principal.vista))
+        if actual is None or actual[0] != principal.version:
+            await rehacer_fuzzy(mode, principal)
+
+    paginas = 0
+    for clave, _n in mas_populares(_POPULARIDAD["letras"], POPULAR_WARM_QUERIES):
+        texto_vista, letra, pagina = clave.split(":")
+        vista = vista_de_texto(texto_vista)
+        if vista is None:
+            continue
+        try:
+            build_letter_page(letra, int(pagina), catalogo_vista(vista))
+            paginas += 1
+        except Exception as e:
+            print("[precalentar] ERROR en", clave, e)
+        await asyncio.sleep(0)
+
+    busquedas = 0
+    for clave, _n in mas_populares(_POPULARIDAD["busquedas"], POPULAR_WARM_QUERIES):
+        modo, texto_vista, consulta = clave.split("\t")
+        vista = vista_de_texto(texto_vista)
+        if vista is None or modo not in ("series", "pelis"):
+            continue
+        try:
+            topics = catalogo_vista(vista)
+            ids = buscar_series(topics, consulta) if modo == "series" else buscar_peliculas(topics, consulta)
+            if not ids:
+                await buscar_aproximado(modo, topics, consulta)
+            busquedas += 1
+        except Exception as e:
+            print("[precalentar] ERROR en", repr(clave), e)
+        await asyncio.sleep(0)
+
+    print(
+        f"[precalentar] {paginas} páginas de letras y {busquedas} búsquedas"
+        f" en {(time.perf_counter() - t0) * 1000:.0f} ms"
+    )
+
+
+# ======================================================
+#   EDICIÓN DE MENSAJES SIN REPETICIONES
+#   Se guarda una huella (texto + parse_mode + teclado) de lo último
+#   que se pintó en cada mensaje del bot. Si una edición no cambia
+#   nada no se llama a Telegram, que respondería "message is not
+#   modified". Como mucho EDIT_CACHE_SIZE mensajes (LRU).
+# ======================================================
+_ULTIMO_RENDER = OrderedDict()  # (chat_id, message_id) o inline_message_id -> huella
+
+
+def huella_mensaje(text: str, parse_mode=None, reply_markup=None) -> bytes:
+    teclado = reply_markup.to_json() if reply_markup is not None else ""
+    return hashlib.blake2b(
+        f"{parse_mode}\x00{text}\x00{teclado}".encode("utf-8"), digest_size=16
+    ).digest()
+
+
+def recordar_render(clave, huella: bytes):
+    _ULTIMO_RENDER[clave] = huella
+    _ULTIMO_RENDER.move_to_end(clave)
+    while len(_ULTIMO_RENDER) > EDIT_CACHE_SIZE:
+        _ULTIMO_RENDER.popitem(last=False)
+
+
+def recordar_enviado(msg, text: str, parse_mode=None, reply_markup=None):
+    """Apunta el contenido de un mensaje recién enviado (para que editar() lo conozca)."""
+    if msg is not None:
+        recordar_render((msg.chat_id, msg.message_id), huella_mensaje(text, parse_mode, reply_markup))
+
+
+async def editar(query, text: str, parse_mode=None, reply_markup=None, **kwargs) -> bool:
+    """
+    query.edit_message_text que no hace nada si el mensaje ya muestra
+    exactamente eso. Devuelve True si se editó.
+    """
+    if query.message is not None:
+        clave = (query.message.chat.id, query.message.message_id)
+    else:
+        clave = query.inline_message_id
+    return await _editar_si_cambia(clave, query.edit_message_text, text, parse_mode, reply_markup, **kwargs)
+
+
+async def editar_por_id(bot, chat_id: int, message_id: int, text: str, parse_mode=None, reply_markup=None, **kwargs) -> bool:
+    """Como editar() para un mensaje del que solo se guardó chat e id (avisos de la cola de envíos)."""
+    edit = functools.partial(bot.edit_message_text, chat_id=chat_id, message_id=message_id)
+    return await _editar_si_cambia((chat_id, message_id), edit, text, parse_mode, reply_markup, **kwargs)
+
+
+async def _editar_si_cambia(clave, edit, text: str, parse_mode=None, reply_markup=None, **kwargs) -> bool:
+    huella = huella_mensaje(text, parse_mode, reply_markup)
+
+    if _ULTIMO_RENDER.get(clave) == huella:
+        _ULTIMO_RENDER.move_to_end(clave)
+        METRICS.ediciones_evitadas += 1
+        return False
+
+    try:
+        await edit(text, parse_mode=parse_mode, reply_markup=reply_markup, **kwargs)
+    except BadRequest as e:
+        # Mensaje anterior al arranque (no estaba en la caché) y sin cambios
+        if "not modified" not in str(e).lower():
+            raise
+        METRICS.ediciones_evitadas += 1
+        recordar_render(clave, huella)
+        return False
+    recordar_render(clave, huella)
+    return True
+
+
 # ======================================================
 #   CARGA / GUARDA USUARIOS (/start en privado)
 #   ESTRUCTURA:
@@ -157,8 +2127,12 @@ def load_users():
     if not USERS_FILE.exists():
         return {}
     try:
+        t0 = time.perf_counter()
         with open(USERS_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
+            raw = json.load(f)
+        users = {uid: User.from_dict(info) for uid, info in raw.items()}
+        METRICS.observe_store("load_users", time.perf_counter() - t0)
+        return users
     except Exception as e:
         print("[load_users] ERROR:", e)
         return {}
@@ -166,8 +2140,10 @@ def load_users():
 
 def save_users(data):
     try:
+        t0 = time.perf_counter()
         with open(USERS_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4, ensure_ascii=False)
+            json.dump(data, f, indent=4, ensure_ascii=False, default=_json_default)
+        METRICS.observe_store("save_users", time.perf_counter() - t0)
     except Exception as e:
         print("[save_users] ERROR:", e)
 
@@ -185,12 +2161,7 @@ def register_user_from_update(update: Update):
         name = user.full_name or (user.username or f"ID {user.id}")
         username = f"@{user.username}" if user.username else ""
         first_seen = msg.date.timestamp() if msg.date else 0
-        users[uid] = {
-            "id": user.id,
-            "name": name,
-            "username": username,
-            "first_seen": first_seen,
-        }
+        users[uid] = User(user.id, name, username, first_seen)
         save_users(users)
 
 
@@ -202,113 +2173,162 @@ async def detect(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if msg is None:
         return
 
-    # Solo el grupo configurado
-    if msg.chat.id != GROUP_ID:
+    # Solo los grupos configurados (cada uno con su catálogo)
+    if msg.chat.id not in _SHARDS:
         return
 
     # Solo mensajes dentro de un tema
     if msg.message_thread_id is None:
         return
 
-    topic_id = str(msg.message_thread_id)
-    topics = load_topics()
-
-    # Si el tema está silenciado, no registramos nada
-    if topic_id in topics and topics[topic_id].get("muted"):
-        return
-
-    # Crear registro del tema si no existía
-    if topic_id not in topics:
-        if msg.forum_topic_created:
-            # Nombre EXACTO del tema en Telegram
-            topic_name = msg.forum_topic_created.name or f"Tema {topic_id}"
-        else:
-            topic_name = f"Tema {topic_id}"
-
-        topics[topic_id] = {
-            "name": topic_name,
-            "messages": [],
-            "created_at": msg.date.timestamp() if msg.date else 0,
-        }
+    # Durante un /importar completo se apunta para repetirlo sobre el catálogo importado
+    if _IMPORTACION["cambios"] is not None and msg.chat.id == GROUP_ID:
+        _IMPORTACION["cambios"].append((registrar_mensaje, msg))
 
+    topic = registrar_mensaje(msg)
+    if topic is not None:
         try:
             await msg.reply_text(
-                f"📄 Tema detectado y guardado:\n<b>{escape(fix_text(topic_name))}</b>",
+                f"📄 Tema detectado y guardado:\n<b>{escape(fix_text(topic.name))}</b>",
                 parse_mode="HTML",
             )
         except Exception as e:
             print("[detect] Error al avisar tema nuevo:", e)
-    else:
-        # Si ya existía pero no tiene created_at (casos antiguos), lo ponemos ahora
-        if "created_at" not in topics[topic_id]:
-            topics[topic_id]["created_at"] = msg.date.timestamp() if msg.date else 0
-        # Aseguramos estructura peli si procede
-        if topics[topic_id].get("is_pelis") and "movies" not in topics[topic_id]:
-            topics[topic_id]["movies"] = []
+
+
+def registrar_mensaje(msg, guardar: bool = True):
+    """
+    Apunta un mensaje de un tema en el catálogo de su grupo. Sin await:
+    nada cambia el catálogo a medias. Devuelve el Topic si el tema es nuevo.
+    """
+    topic_id = clave_tema(msg.chat.id, msg.message_thread_id)
+    topics = load_topics(msg.chat.id)
+    topic = topics.get(topic_id)
+    nuevo = None
+
+    # Si el tema está silenciado, no registramos nada
+    if topic is not None and topic.muted:
+        return None
+
+    # Tema renombrado en Telegram: se recoloca en los índices sin reconstruirlos
+    editado = msg.forum_topic_edited
+    if topic is not None and editado is not None and editado.name:
+        renombrar_tema(topics, topic_id, editado.name)
+
+    # Crear registro del tema si no existía (se añade a los índices sin reconstruirlos)
+    if topic is None:
+        if msg.forum_topic_created:
+            # Nombre EXACTO del tema en Telegram
+            topic_name = msg.forum_topic_created.name or f"Tema {msg.message_thread_id}"
+        elif editado is not None and editado.name:
+            topic_name = editado.name
+        else:
+            topic_name = f"Tema {msg.message_thread_id}"
+
+        topic = nuevo = Topic(
+            topic_id,
+            topic_name,
+            created_at=msg.date.timestamp() if msg.date else 0,
+        )
+        anadir_tema(topics, topic_id, topic)
 
     # Guardar cada mensaje dentro del tema
-    topics[topic_id]["messages"].append({"id": msg.message_id})
+    topic.messages.add(msg.message_id)
 
     # Si es el tema de películas, indexamos con unique_id
-    if topics[topic_id].get("is_pelis"):
+    if topic.is_pelis:
         file_obj = msg.document or msg.video or msg.animation
         if file_obj:
             unique_id = file_obj.file_unique_id
             title = (msg.caption or file_obj.file_name or "").strip()
-            topics[topic_id].setdefault("movies", [])
-            duplicado = any(m.get("unique_id") == unique_id for m in topics[topic_id]["movies"])
+            duplicado = any(m.unique_id == unique_id for m in topic.movies)
             if not duplicado:
-                topics[topic_id]["movies"].append(
-                    {"id": msg.message_id, "title": title, "unique_id": unique_id}
-                )
-    save_topics(topics)
+                anadir_pelicula(topics, topic_id, Movie(msg.message_id, title, unique_id))
+    if guardar:
+        save_topics(topics, reindex=False)
+    return nuevo
 
 
-# ======================================================
-#   ORDENAR TEMAS (símbolos/números → letras con acento → letras normales)
-# ======================================================
-def ordenar_temas(items):
+async def on_edited_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """
-    items: iterable de (topic_id, info_dict)
-    Orden:
-      0) nombres vacíos al final
-      1) símbolos / números / otros primero (grupo 0)
-      2) letras A-Z (grupo 1)
-      Dentro de cada grupo de letra:
-          - primero acentuadas (Á...) (accent_rank 0)
-          - luego normales (A...) (accent_rank 1)
-          - 'Ñ' se trata como N pero con accent_rank 2 (después de N)
+    Mensajes editados. Solo interesan los del tema de películas de un
+    grupo: si cambia el pie (o el archivo) se actualiza esa película.
+    Telegram no avisa a los bots de los mensajes borrados: esos se
+    quitan al fallar su reenvío.
     """
+    msg = update.edited_message
+    if msg is None or msg.chat.id not in _SHARDS or msg.message_thread_id is None:
+        return
+    if _IMPORTACION["cambios"] is not None and msg.chat.id == GROUP_ID:
+        _IMPORTACION["cambios"].append((registrar_edicion, msg))
+    registrar_edicion(msg)
+
+
+def registrar_edicion(msg, guardar: bool = True) -> bool:
+    """Aplica al catálogo un mensaje editado del tema de películas; True si cambió algo."""
+    topic_id = clave_tema(msg.chat.id, msg.message_thread_id)
+    topics = load_topics(msg.chat.id)
+    topic = topics.get(topic_id)
+    if topic is None or topic.muted or not topic.is_pelis:
+        return False
+
+    file_obj = msg.document or msg.video or msg.animation
+    if not file_obj:
+        return False
+    title = (msg.caption or file_obj.file_name or "").strip()
+    if not retitular_pelicula(topics, topic_id, msg.message_id, title, file_obj.file_unique_id):
+        return False
+    if guardar:
+        save_topics(topics, reindex=False)
+    return True
 
-    def clave(item):
-        _tid, info = item
-        nombre = info.get("name", "").strip()
-        if not nombre:
-            return (2, "", 0, "")  # vacíos al final
-
-        first, base = get_first_and_base(nombre)
-        if base is None:
-            return (2, "", 0, nombre.lower())
-
-        base_key = base
-        upper_first = first.upper()
 
-        # Símbolos/números: base no es A-Z
-        if not ("A" <= base <= "Z"):
-            return (0, base_key, 0, nombre.lower())
+# ======================================================
+#   ORDENAR TEMAS (símbolos/números → letras con acento → letras normales)
+# ======================================================
+def clave_orden_tema(item):
+    """Clave de ordenar_temas para un (topic_id, Topic)."""
+    _tid, info = item
+    nombre = info.name.strip()
+    if not nombre:
+        return (2, "", 0, "")  # vacíos al final
+
+    first, base = get_first_and_base(nombre)
+    if base is None:
+        return (2, "", 0, nombre.lower())
+
+    base_key = base
+    upper_first = first.upper()
+
+    # Símbolos/números: base no es A-Z
+    if not ("A" <= base <= "Z"):
+        return (0, base_key, 0, nombre.lower())
+
+    # Letras A-Z
+    # Caso especial Ñ: la tratamos como N pero detrás
+    if upper_first == "Ñ":
+        base_key = "N"
+        accent_rank = 2
+    else:
+        # Acentuadas si difiere de la base (ej: Á vs A)
+        accent_rank = 0 if upper_first != base_key else 1
 
-        # Letras A-Z
-        # Caso especial Ñ: la tratamos como N pero detrás
-        if upper_first == "Ñ":
-            base_key = "N"
-            accent_rank = 2
-        else:
-            # Acentuadas si difiere de la base (ej: Á vs A)
-            accent_rank = 0 if upper_first != base_key else 1
+    return (1, base_key, accent_rank, nombre.lower())
 
-        return (1, base_key, accent_rank, nombre.lower())
 
-    return sorted(items, key=clave)
+def ordenar_temas(items):
+    """
+    items: iterable de (topic_id, Topic)
+    Orden:
+      0) nombres vacíos al final
+      1) símbolos / números / otros primero (grupo 0)
+      2) letras A-Z (grupo 1)
+      Dentro de cada grupo de letra:
+          - primero acentuadas (Á...) (accent_rank 0)
+          - luego normales (A...) (accent_rank 1)
+          - 'Ñ' se trata como N pero con accent_rank 2 (después de N)
+    """
+    return sorted(items, key=clave_orden_tema)
 
 
 def filtrar_por_letra(topics, letter):
@@ -318,11 +2338,13 @@ def filtrar_por_letra(topics, letter):
     Usa la letra base normalizada (Á -> A, É -> E, etc).
     """
     letter = letter.upper()
+    if isinstance(topics, Catalogo):
+        return list(get_letter_index(topics).get(letter, []))
+
     filtrados = []
 
     for tid, info in topics.items():
-        nombre = info.get("name", "")
-        nombre_strip = nombre.strip()
+        nombre_strip = info.name.strip()
         if not nombre_strip:
             continue
 
@@ -344,7 +2366,7 @@ def filtrar_por_letra(topics, letter):
 # ======================================================
 #   TECLADO PRINCIPAL (ABECEDARIO + Buscar + Recientes + Películas)
 # ======================================================
-def build_main_keyboard():
+def build_main_keyboard(vista=GROUP_ID):
     rows = []
     letters = list("ABCDEFGHIJKLMNOPQRSTUVWXYZ")
 
@@ -370,23 +2392,35 @@ def build_main_keyboard():
         ]
     )
 
-    # Fila Películas (especial)
+    # Fila Películas (especial) + Populares
     rows.append(
-        [InlineKeyboardButton("🍿 Películas", callback_data="pelis")]
+        [
+            InlineKeyboardButton("🍿 Películas", callback_data="pelis"),
+            InlineKeyboardButton("🔥 Populares", callback_data="populares"),
+        ]
     )
 
+    # Selector de grupo (solo si hay más de uno)
+    if len(GROUP_IDS) > 1:
+        rows.append(
+            [InlineKeyboardButton(f"🗂 {nombre_vista(vista)}", callback_data="grupos")]
+        )
+
     return InlineKeyboardMarkup(rows)
 
 
+MAIN_MENU_TEXT = (
+    "🎬 <b>Catálogo de series</b>\n"
+    "Elige una letra, pulsa Recientes, Populares, Películas o escribe el nombre de una serie para buscar."
+)
+
+
 async def show_main_menu(chat, context: ContextTypes.DEFAULT_TYPE):
     # Reset modo de búsqueda
-    context.user_data.pop("search_mode", None)
-    await chat.send_message(
-        "🎬 <b>Catálogo de series</b>\n"
-        "Elige una letra, pulsa Recientes, Películas o escribe el nombre de una serie para buscar.",
-        parse_mode="HTML",
-        reply_markup=build_main_keyboard(),
-    )
+    SESSIONS.pop(chat.id, "search_mode")
+    markup = build_main_keyboard(vista_usuario(chat.id))
+    msg = await chat.send_message(MAIN_MENU_TEXT, parse_mode="HTML", reply_markup=markup)
+    recordar_enviado(msg, MAIN_MENU_TEXT, "HTML", markup)
 
 
 # ======================================================
@@ -437,8 +2471,7 @@ def build_letter_page(letter, page, topics_dict):
 
     keyboard = []
     for tid, info in slice_items:
-        name = info.get("name", "")
-        safe_name = escape(fix_text(name))
+        safe_name = escape(fix_text(info.name))
         keyboard.append(
             [InlineKeyboardButton(f"🎬 {safe_name}", callback_data=f"t:{tid}")]
         )
@@ -483,12 +2516,14 @@ async def on_letter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     _, letter = query.data.split(":", 1)
-    topics = load_topics()
+    topics = catalogo_usuario(query.from_user.id)
+    contar_popular("letras", f"{topics.vista}:{letter}:1")
 
     text, markup = build_letter_page(letter, 1, topics)
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             text=text,
             parse_mode="HTML",
             reply_markup=markup,
@@ -504,11 +2539,13 @@ async def on_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     _, letter, page_str = query.data.split(":", 2)
     page = int(page_str)
 
-    topics = load_topics()
+    topics = catalogo_usuario(query.from_user.id)
+    contar_popular("letras", f"{topics.vista}:{letter}:{page}")
     text, markup = build_letter_page(letter, page, topics)
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             text=text,
             parse_mode="HTML",
             reply_markup=markup,
@@ -525,15 +2562,54 @@ async def on_main_menu(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     chat = query.message.chat
     try:
-        await query.edit_message_text(
-            "🎬 <b>Catálogo de series</b>\n"
-            "Elige una letra, pulsa Recientes, Películas o escribe el nombre de una serie para buscar.",
+        markup = build_main_keyboard(vista_usuario(query.from_user.id))
+        await editar(query, MAIN_MENU_TEXT, parse_mode="HTML", reply_markup=markup)
+        SESSIONS.pop(query.from_user.id, "search_mode")
+    except Exception as e:
+        print("[on_main_menu] Error editando mensaje:", e)
+
+
+async def on_grupos_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Lista de grupos para elegir qué catálogo se ve en el menú."""
+    query = update.callback_query
+    await query.answer()
+    actual = vista_usuario(query.from_user.id)
+
+    keyboard = []
+    for vista in GROUP_IDS + [VISTA_TODOS]:
+        marca = "✅ " if vista == actual else ""
+        keyboard.append(
+            [InlineKeyboardButton(f"{marca}{nombre_vista(vista)}", callback_data=f"grupo:{vista}")]
+        )
+    keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="main_menu")])
+
+    try:
+        await editar(
+            query,
+            "🗂 <b>Elige el grupo</b>\nEl catálogo, la búsqueda y Películas mostrarán solo ese grupo.",
             parse_mode="HTML",
-            reply_markup=build_main_keyboard(),
+            reply_markup=InlineKeyboardMarkup(keyboard),
         )
-        context.user_data.pop("search_mode", None)
     except Exception as e:
-        print("[on_main_menu] Error editando mensaje:", e)
+        print("[on_grupos_btn] Error editando mensaje:", e)
+
+
+async def on_grupo(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Guarda el grupo elegido en la sesión y vuelve al menú principal."""
+    query = update.callback_query
+    _, valor = query.data.split(":", 1)
+    vista = valor if valor == VISTA_TODOS else int(valor)
+    if not vista_valida(vista):
+        await query.answer("❌ Ese grupo ya no existe.")
+        return
+    await query.answer(f"🗂 {nombre_vista(vista)}")
+
+    SESSIONS.set(query.from_user.id, "grupo", vista)
+    SESSIONS.pop(query.from_user.id, "search_mode")
+    try:
+        await editar(query, MAIN_MENU_TEXT, parse_mode="HTML", reply_markup=build_main_keyboard(vista))
+    except Exception as e:
+        print("[on_grupo] Error editando mensaje:", e)
 
 
 async def on_search_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -542,13 +2618,14 @@ async def on_search_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = query.message.chat
 
     if chat.type != "private":
-        await query.edit_message_text("🔍 Usa la búsqueda en privado conmigo.")
+        await editar(query, "🔍 Usa la búsqueda en privado conmigo.")
         return
 
-    context.user_data["search_mode"] = "series"
+    SESSIONS.set(query.from_user.id, "search_mode", "series")
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             "🔍 <b>Buscar serie</b>\n"
             "Escribe el nombre o parte del nombre de la serie en el chat.",
             parse_mode="HTML",
@@ -565,12 +2642,13 @@ async def on_recent_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     chat = query.message.chat
     if chat.type != "private":
-        await query.edit_message_text("🕒 Usa Recientes en privado conmigo.")
+        await editar(query, "🕒 Usa Recientes en privado conmigo.")
         return
 
-    topics = load_topics()
+    topics = catalogo_usuario(query.from_user.id)
     if not topics:
-        await query.edit_message_text(
+        await editar(
+            query,
             "📭 No hay series aún.",
             reply_markup=InlineKeyboardMarkup(
                 [[InlineKeyboardButton("🔙 Volver", callback_data="main_menu")]]
@@ -580,13 +2658,13 @@ async def on_recent_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Ordenamos por created_at descendente
     items = list(topics.items())
-    items.sort(key=lambda x: x[1].get("created_at", 0), reverse=True)
+    items.sort(key=lambda x: x[1].created_at, reverse=True)
     hidden = get_hidden_topic()
     items = [i for i in items if i[0] != hidden][:RECENT_LIMIT]
 
     keyboard = []
     for tid, info in items:
-        safe_name = escape(fix_text(info.get("name", "")))
+        safe_name = escape(fix_text(info.name))
         keyboard.append(
             [InlineKeyboardButton(f"🎬 {safe_name}", callback_data=f"t:{tid}")]
         )
@@ -594,7 +2672,8 @@ async def on_recent_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     keyboard.append([InlineKeyboardButton("🔙 Volver", callback_data="main_menu")])
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             "🕒 <b>Series recientes</b>",
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup(keyboard),
@@ -603,6 +2682,50 @@ async def on_recent_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print("[on_recent_btn] Error editando mensaje:", e)
 
 
+async def on_popular_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Los temas más pedidos de la vista del usuario (top precalculado, ver POPULARIDAD)."""
+    query = update.callback_query
+    await query.answer()
+    chat = query.message.chat
+    if chat.type != "private":
+        await editar(query, "🔥 Usa Populares en privado conmigo.")
+        return
+
+    topics = catalogo_usuario(query.from_user.id)
+    hidden = get_hidden_topic()
+    items = [
+        (tid, topics[tid])
+        for tid in _TOP.get(topics.vista, [])
+        if tid in topics and tid != hidden
+    ][:POPULAR_TOP_K]
+    volver = [InlineKeyboardButton("🔙 Volver", callback_data="main_menu")]
+    if not items:
+        await editar(
+            query,
+            "📭 Todavía no hay series populares.",
+            reply_markup=InlineKeyboardMarkup([volver]),
+        )
+        return
+
+    keyboard = []
+    for tid, info in items:
+        safe_name = escape(fix_text(info.name))
+        keyboard.append(
+            [InlineKeyboardButton(f"🎬 {safe_name}", callback_data=f"t:{tid}")]
+        )
+    keyboard.append(volver)
+
+    try:
+        await editar(
+            query,
+            "🔥 <b>Series más pedidas</b>",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(keyboard),
+        )
+    except Exception as e:
+        print("[on_popular_btn] Error editando mensaje:", e)
+
+
 async def on_pelis_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Entrada al modo búsqueda de películas."""
     query = update.callback_query
@@ -610,13 +2733,14 @@ async def on_pelis_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
     chat = query.message.chat
 
     if chat.type != "private":
-        await query.edit_message_text("🍿 Usa Películas en privado conmigo.")
+        await editar(query, "🍿 Usa Películas en privado conmigo.")
         return
 
-    context.user_data["search_mode"] = "pelis"
+    SESSIONS.set(query.from_user.id, "search_mode", "pelis")
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             "🍿 <b>Búsqueda de películas</b>\n"
             "Escribe el título o parte del título de la película que buscas.",
             parse_mode="HTML",
@@ -630,9 +2754,33 @@ async def on_pelis_btn(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 # ======================================================
 #   Paginación de resultados de películas
+#   Los botones llevan "pelis_page:<token>:<offset>". El token es un hash
+#   corto de la vista y la consulta (común a todos los usuarios que buscan
+#   lo mismo) y cada página se recalcula desde la caché de búsquedas, así
+#   que no se guarda ninguna lista de resultados por usuario.
 # ======================================================
-def build_pelis_page(page: int, results: list, topic_id: str, original_query: str | None = None):
-    total = len(results)
+_PELIS_QUERIES = OrderedDict()  # token -> (vista, consulta, texto original, aproximada)
+
+
+def registrar_consulta_pelis(vista, query: str, original: str, aproximada=False) -> str:
+    token = hashlib.sha1(f"{vista}:{query}".encode("utf-8")).hexdigest()[:10]
+    _PELIS_QUERIES[token] = (vista, query, original, aproximada)
+    _PELIS_QUERIES.move_to_end(token)
+    _PERSISTENCIA["consultas"].add(token)
+    while len(_PELIS_QUERIES) > PELIS_QUERY_TOKENS:
+        _PELIS_QUERIES.popitem(last=False)
+    return token
+
+
+def build_pelis_page(
+    offset: int,
+    ids: list,
+    movie_index: dict,
+    token: str,
+    original_query: str | None = None,
+    aproximada: bool = False,
+):
+    total = len(ids)
     if total == 0:
         text = "🍿 No hay resultados de películas para mostrar."
         markup = InlineKeyboardMarkup(
@@ -641,15 +2789,18 @@ def build_pelis_page(page: int, results: list, topic_id: str, original_query: st
         return text, markup
 
     total_pages = max(1, math.ceil(total / MOVIES_PAGE_SIZE))
-    page = max(1, min(page, total_pages))
+    offset = max(0, min(offset, (total_pages - 1) * MOVIES_PAGE_SIZE))
+    offset -= offset % MOVIES_PAGE_SIZE
+    page = offset // MOVIES_PAGE_SIZE + 1
 
-    start_idx = (page - 1) * MOVIES_PAGE_SIZE
-    end_idx = start_idx + MOVIES_PAGE_SIZE
-    slice_items = results[start_idx:end_idx]
+    slice_ids = ids[offset: offset + MOVIES_PAGE_SIZE]
 
     keyboard = []
-    for mid, title in slice_items:
-        safe_title = escape(fix_text(title))
+    for topic_id, mid in slice_ids:
+        movie = movie_index.get((topic_id, mid))
+        if movie is None:
+            continue
+        safe_title = escape(fix_text(movie.title))
         keyboard.append(
             [
                 InlineKeyboardButton(
@@ -664,14 +2815,18 @@ def build_pelis_page(page: int, results: list, topic_id: str, original_query: st
     if total_pages > 1:
         if page > 1:
             nav_row.append(
-                InlineKeyboardButton("⬅️", callback_data=f"pelis_page:{page-1}")
+                InlineKeyboardButton(
+                    "⬅️", callback_data=f"pelis_page:{token}:{offset - MOVIES_PAGE_SIZE}"
+                )
             )
         nav_row.append(
             InlineKeyboardButton(f"{page}/{total_pages}", callback_data="noop")
         )
         if page < total_pages:
             nav_row.append(
-                InlineKeyboardButton("➡️", callback_data=f"pelis_page:{page+1}")
+                InlineKeyboardButton(
+                    "➡️", callback_data=f"pelis_page:{token}:{offset + MOVIES_PAGE_SIZE}"
+                )
             )
     if nav_row:
         keyboard.append(nav_row)
@@ -680,12 +2835,17 @@ def build_pelis_page(page: int, results: list, topic_id: str, original_query: st
         [InlineKeyboardButton("🔙 Volver", callback_data="main_menu")]
     )
 
-    if original_query:
+    if original_query and aproximada:
+        header = (
+            f"🤔 No hay nada con <b>{escape(fix_text(original_query))}</b>. "
+            "¿Quisiste decir…?\n"
+        )
+    elif original_query:
         header = f"🍿 Resultados para: <b>{escape(fix_text(original_query))}</b>\n"
     else:
         header = "🍿 Resultados de películas\n"
 
-    text = header + f"Página {page}/{total_pages} (mostrando {len(slice_items)} de {total})."
+    text = header + f"Página {page}/{total_pages} (mostrando {len(slice_ids)} de {total})."
 
     return text, InlineKeyboardMarkup(keyboard)
 
@@ -707,26 +2867,25 @@ async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await chat.send_message("Escribe parte del nombre para buscar.")
         return
 
-    mode = context.user_data.get("search_mode", "series")
+    # Si la sesión caducó se vuelve a la búsqueda de series
+    mode = SESSIONS.get(msg.from_user.id, "search_mode", "series")
 
-    topics = load_topics()
+    topics = catalogo_usuario(msg.from_user.id)
     if not topics:
         await chat.send_message("📭 No hay series aún.")
         return
 
     if mode == "pelis":
-        # --- BÚSQUEDA EN TEMA PELÍCULAS ---
-        pelis_tid = get_pelis_topic_id(topics)
-        if not pelis_tid or pelis_tid not in topics:
+        # --- BÚSQUEDA EN LOS TEMAS PELÍCULAS (uno por grupo) ---
+        pelis_tids = get_pelis_topic_ids(topics)
+        if not pelis_tids:
             await chat.send_message(
                 "🍿 No hay un tema de <b>Películas</b> configurado todavía.",
                 parse_mode="HTML",
             )
             return
 
-        info = topics[pelis_tid]
-        movies = info.get("movies", [])
-        if not movies:
+        if not any(topics[tid].movies for tid in pelis_tids):
             await chat.send_message(
                 "🍿 Aún no hay películas indexadas.\n"
                 "Sube películas con descripción al tema configurado.",
@@ -734,22 +2893,15 @@ async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        q = query_text.lower()
-        matches = []
-        seen_ids = set()
-
-        for m in movies:
-            mid = m.get("id")
-            title = m.get("title", "")
-            if not mid or not title:
-                continue
-            if mid in seen_ids:
-                continue
-            if q in title.lower():
-                matches.append((mid, title))
-                seen_ids.add(mid)
+        consulta = normalizar_consulta(query_text)
+        contar_popular("busquedas", f"pelis\t{topics.vista}\t{consulta}")
+        ids = buscar_peliculas(topics, consulta)
+        aproximada = False
+        if not ids:
+            ids = await buscar_aproximado("pelis", topics, consulta)
+            aproximada = True
 
-        if not matches:
+        if not ids:
             await chat.send_message(
                 f"🍿 No encontré ninguna película que contenga: "
                 f"<b>{escape(query_text)}</b>",
@@ -757,16 +2909,11 @@ async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        # Limitamos y ordenamos alfabéticamente por título
-        matches.sort(key=lambda x: x[1].lower())
-        matches = matches[:PELIS_RESULT_LIMIT]
-
-        # Guardamos resultados en la sesión del usuario para paginación
-        context.user_data["pelis_results"] = matches
-        context.user_data["pelis_topic_id"] = pelis_tid
-        context.user_data["pelis_query"] = query_text
-
-        text, markup = build_pelis_page(1, matches, pelis_tid, query_text)
+        # Ya vienen ordenadas alfabéticamente por título; se pagina todo
+        token = registrar_consulta_pelis(topics.vista, consulta, query_text, aproximada)
+        text, markup = build_pelis_page(
+            0, ids, get_movie_index(topics), token, query_text, aproximada
+        )
 
         await chat.send_message(
             text,
@@ -776,27 +2923,31 @@ async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     else:
         # --- BÚSQUEDA NORMAL DE SERIES (por nombre de tema) ---
-        query_lower = query_text.lower()
-        matches = [
-            (tid, info)
-            for tid, info in topics.items()
-            if query_lower in info.get("name", "").lower()
-        ]
-
-        if not matches:
+        consulta = normalizar_consulta(query_text)
+        contar_popular("busquedas", f"series\t{topics.vista}\t{consulta}")
+        ids = buscar_series(topics, consulta)
+        aproximada = False
+        if not ids:
+            ids = await buscar_aproximado("series", topics, consulta)
+            aproximada = True
+
+        if not ids:
             await chat.send_message(
-                f"🔍 No encontré ninguna serie que contenga: <b>{escape(query_text)}</b>",
+                f"🔍 No encontré ninguna serie que contenga: <b>{escape(query_text)}</b>\n"
+                "Si buscabas una película, pulsa 🍿 Películas y vuelve a escribirla.",
                 parse_mode="HTML",
+                reply_markup=InlineKeyboardMarkup(
+                    [[InlineKeyboardButton("🍿 Películas", callback_data="pelis")]]
+                ),
             )
             return
 
         # Orden y límite a 30 resultados
-        matches = ordenar_temas(matches)
-        matches = matches[:30]
+        matches = [(tid, topics[tid]) for tid in ids[:30] if tid in topics]
 
         keyboard = []
         for tid, info in matches:
-            safe_name = escape(fix_text(info.get("name", "")))
+            safe_name = escape(fix_text(info.name))
             keyboard.append(
                 [InlineKeyboardButton(f"🎬 {safe_name}", callback_data=f"t:{tid}")]
             )
@@ -805,54 +2956,197 @@ async def search_text(update: Update, context: ContextTypes.DEFAULT_TYPE):
             [InlineKeyboardButton("🔙 Volver", callback_data="main_menu")]
         )
 
+        if aproximada:
+            header = (
+                f"🤔 No hay ninguna serie con <b>{escape(query_text)}</b>. "
+                "¿Quisiste decir…?"
+            )
+        else:
+            header = f"🔍 Resultados para: <b>{escape(query_text)}</b>"
         await chat.send_message(
-            f"🔍 Resultados para: <b>{escape(query_text)}</b>",
+            header,
             parse_mode="HTML",
             reply_markup=InlineKeyboardMarkup(keyboard),
         )
 
 
 # ======================================================
-#   REENVÍO ORDENADO (SOLO FORWARD, SIN COPY)
-#   + Botón volver al catálogo
+#   COLA DE ENVÍOS (SQLite) Y PROCESOS WORKER
+#   send_topic solo encola el envío de un tema completo. Los workers
+#   (procesos aparte, "python main.py worker N") reclaman envíos con
+#   un lease de DELIVERY_LEASE_SECONDS que renuevan mientras avanzan;
+#   si un worker muere, al caducar el lease otro retoma el envío desde
+#   la última posición guardada (se pueden repetir como mucho
+#   DELIVERY_PROGRESS_EVERY mensajes). Los errores de red se reintentan
+#   con espera creciente sin soltar el lease; los mensajes que ya no
+#   existen se omiten y se cuentan. El bot lee el progreso de la
+#   tabla, actualiza el mensaje "Enviando..." y avisa al terminar.
 # ======================================================
+ESQUEMA_ENVIOS = """
+CREATE TABLE IF NOT EXISTS envios (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id INTEGER NOT NULL,
+    from_chat_id INTEGER NOT NULL,
+    topic_id TEXT NOT NULL,
+    mensajes TEXT NOT NULL,
+    total INTEGER NOT NULL,
+    posicion INTEGER NOT NULL DEFAULT 0,
+    enviados INTEGER NOT NULL DEFAULT 0,
+    omitidos INTEGER NOT NULL DEFAULT 0,
+    estado TEXT NOT NULL DEFAULT 'pendiente',
+    intentos INTEGER NOT NULL DEFAULT 0,
+    worker TEXT,
+    lease_hasta REAL NOT NULL DEFAULT 0,
+    aviso_chat_id INTEGER,
+    aviso_msg_id INTEGER,
+    boton_inline TEXT,
+    avisado INTEGER NOT NULL DEFAULT 0,
+    error TEXT,
+    creado REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS envios_estado ON envios (estado, id);
+"""
+# estado: pendiente -> en_curso -> hecho | error. El bot borra la fila tras avisar al usuario.
+# omitidos: mensajes que ya no existen (BadRequest). boton_inline: id de la pulsación de un
+# botón inline que aún no se ha respondido (ver envios_job).
+
+_COLA = {"db": None, "workers": {}}  # workers: índice -> proceso lanzado por el bot
+
+
+async def abrir_cola():
+    # isolation_level=None: cada sentencia se confirma sola salvo los BEGIN explícitos
+    db = await aiosqlite.connect(DELIVERY_DB, timeout=30, isolation_level=None)
+    db.row_factory = aiosqlite.Row
+    await db.execute("PRAGMA journal_mode=WAL")
+    await db.executescript(ESQUEMA_ENVIOS)
+    # Colas creadas por versiones anteriores
+    cur = await db.execute("PRAGMA table_info(envios)")
+    columnas = {fila["name"] for fila in await cur.fetchall()}
+    for columna, tipo in (("omitidos", "INTEGER NOT NULL DEFAULT 0"), ("boton_inline", "TEXT")):
+        if columna not in columnas:
+            try:
+                await db.execute(f"ALTER TABLE envios ADD COLUMN {columna} {tipo}")
+            except aiosqlite.OperationalError as e:
+                # Otro proceso (bot o worker) la ha añadido a la vez
+                print("[abrir_cola]", e)
+    return db
 
-async def send_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    query = update.callback_query
-    await query.answer()
 
-    _, topic_id = query.data.split(":", 1)
-    topic_id = str(topic_id)
+async def cola_db():
+    """Conexión del bot a la cola (se abre al arrancar o en el primer uso)."""
+    if _COLA["db"] is None:
+        _COLA["db"] = await abrir_cola()
+    return _COLA["db"]
 
-    topics = load_topics()
-    if topic_id not in topics:
-        await query.edit_message_text("❌ Tema no encontrado.")
-        return
 
-    await query.edit_message_text("📨 Enviando contenido del tema...")
+async def encolar_envio(
+    user_id: int, from_chat_id: int, topic_id: str, mensajes, aviso=None, boton_inline=None
+) -> int:
+    """
+    Encola el reenvío de mensajes (MessageRuns) y devuelve el id del envío.
+    aviso es el mensaje "Enviando..." a actualizar; boton_inline, el id de
+    una pulsación inline que responderá envios_job.
+    """
+    db = await cola_db()
+    cur = await db.execute(
+        "INSERT INTO envios (user_id, from_chat_id, topic_id, mensajes, total, aviso_chat_id, aviso_msg_id,"
+        " boton_inline, creado) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (
+            user_id,
+            from_chat_id,
+            topic_id,
+            mensajes.encode(),
+            mensajes.count,
+            aviso.chat_id if aviso else None,
+            aviso.message_id if aviso else None,
+            boton_inline,
+            time.time(),
+        ),
+    )
+    return cur.lastrowid
+
+
+async def reclamar_envio(db, worker: str):
+    """Toma el envío pendiente más antiguo (o uno con el lease caducado) para este worker."""
+    while True:
+        ahora = time.time()
+        await db.execute("BEGIN IMMEDIATE")
+        try:
+            cur = await db.execute(
+                "SELECT * FROM envios WHERE estado = 'pendiente'"
+                " OR (estado = 'en_curso' AND lease_hasta < ?) ORDER BY id LIMIT 1",
+                (ahora,),
+            )
+            fila = await cur.fetchone()
+            if fila is None:
+                await db.execute("COMMIT")
+                return None
+            if fila["intentos"] >= DELIVERY_MAX_ATTEMPTS:
+                await db.execute(
+                    "UPDATE envios SET estado = 'error', error = 'intentos' WHERE id = ?", (fila["id"],)
+                )
+                await db.execute("COMMIT")
+                continue
+            await db.execute(
+                "UPDATE envios SET estado = 'en_curso', worker = ?, lease_hasta = ?,"
+                " intentos = intentos + 1 WHERE id = ?",
+                (worker, ahora + DELIVERY_LEASE_SECONDS, fila["id"]),
+            )
+            await db.execute("COMMIT")
+            return dict(fila)
+        except Exception:
+            await db.execute("ROLLBACK")
+            raise
+
+
+async def avanzar_envio(
+    db, envio_id: int, worker: str, posicion: int, enviados: int, omitidos: int, espera: float = 0
+) -> bool:
+    """Guarda el progreso y renueva el lease; False si el envío ya no es de este worker."""
+    cur = await db.execute(
+        "UPDATE envios SET posicion = ?, enviados = ?, omitidos = ?, lease_hasta = ?"
+        " WHERE id = ? AND worker = ? AND estado = 'en_curso'",
+        (posicion, enviados, omitidos, time.time() + espera + DELIVERY_LEASE_SECONDS, envio_id, worker),
+    )
+    return cur.rowcount == 1
+
 
-    import asyncio
-    from telegram.error import RetryAfter, BadRequest
+async def terminar_envio(
+    db, envio_id: int, worker: str, estado: str, posicion: int, enviados: int, omitidos: int, error=None
+):
+    await db.execute(
+        "UPDATE envios SET estado = ?, posicion = ?, enviados = ?, omitidos = ?, error = ?"
+        " WHERE id = ? AND worker = ? AND estado = 'en_curso'",
+        (estado, posicion, enviados, omitidos, error, envio_id, worker),
+    )
 
-    bot = context.bot
-    user_id = query.from_user.id
 
-    mensajes = [m["id"] for m in topics[topic_id]["messages"]]
-    enviados = 0
+async def procesar_envio(db, bot, envio: dict, worker: str):
+    """Reenvía los mensajes de un envío desde envio["posicion"] (lo que hacía send_topic)."""
+    envio_id = envio["id"]
+    user_id = envio["user_id"]
+    posicion = envio["posicion"]
+    enviados = envio["enviados"]
+    omitidos = envio["omitidos"]
+    mensajes = MessageRuns.decode(envio["mensajes"])
 
     delay = 0.12
     ruptura = 150
     pausa_larga = 1.5
 
-    for mid in mensajes:
+    for mid in itertools.islice(mensajes, posicion, None):
+        fallos = 0
         while True:
             try:
                 await bot.forward_message(
                     chat_id=user_id,
-                    from_chat_id=GROUP_ID,
+                    from_chat_id=envio["from_chat_id"],
                     message_id=mid,
                 )
                 enviados += 1
+                if enviados == 1 and envio["boton_inline"]:
+                    # Que envios_job pueda responder ya al botón inline
+                    await avanzar_envio(db, envio_id, worker, posicion + 1, enviados, omitidos)
                 await asyncio.sleep(delay)
 
                 if enviados % ruptura == 0:
@@ -861,40 +3155,272 @@ async def send_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         await asyncio.sleep(pausa_larga)
                         try:
                             await fantasma.delete()
-                        except:
+                        except TelegramError:
                             pass
-                    except:
+                    except TelegramError:
                         pass
 
                 break
 
             except RetryAfter as e:
-                await asyncio.sleep(int(e.retry_after)+1)
-            except BadRequest:
+                espera = int(e.retry_after) + 1
+                if not await avanzar_envio(db, envio_id, worker, posicion, enviados, omitidos, espera):
+                    return
+                await asyncio.sleep(espera)
+            except BadRequest as e:
+                # El mensaje ya no existe en el grupo: se salta y se cuenta
+                print(f"[worker] Envío {envio_id}: mensaje {mid} omitido:", e)
+                omitidos += 1
                 break
-            except Exception:
+            except Forbidden:
+                # El usuario no ha abierto el bot en privado (llega desde inline)
+                print(f"[worker] Usuario {user_id} no ha iniciado el bot")
+                await terminar_envio(db, envio_id, worker, "error", posicion, enviados, omitidos, "forbidden")
+                return
+            except NetworkError as e:
+                # Timeout o corte de red: el mismo mensaje otra vez, sin soltar el lease
+                fallos += 1
+                if fallos > DELIVERY_NET_RETRIES:
+                    # Se guarda la posición y el envío se retoma al caducar el lease
+                    print(f"[worker] Envío {envio_id}: red caída en el mensaje {mid}, se deja para más tarde:", e)
+                    await avanzar_envio(db, envio_id, worker, posicion, enviados, omitidos)
+                    return
+                espera = min(2 ** (fallos - 1), 30)
+                if not await avanzar_envio(db, envio_id, worker, posicion, enviados, omitidos, espera):
+                    return
+                await asyncio.sleep(espera)
+            except TelegramError as e:
+                print(f"[worker] Envío {envio_id}: mensaje {mid} omitido:", e)
+                omitidos += 1
                 break
 
+        posicion += 1
+        if posicion % DELIVERY_PROGRESS_EVERY == 0:
+            if not await avanzar_envio(db, envio_id, worker, posicion, enviados, omitidos):
+                print(f"[worker] Envío {envio_id} retomado por otro worker, se abandona")
+                return
+
+    await terminar_envio(db, envio_id, worker, "hecho", posicion, enviados, omitidos)
+
+
+async def worker_envios(indice: int):
+    """Bucle de un proceso worker: reclama envíos de la cola y los reenvía."""
+    tokens = DELIVERY_BOT_TOKENS or [BOT_TOKEN]
+    bot = Bot(
+        tokens[indice % len(tokens)],
+        base_url=BOT_API_BASE_URL or "https://api.telegram.org/bot",
+        request=crear_request(BULK_POOL_SIZE, BULK_TIMEOUT, BULK_POOL_TIMEOUT, clase=HTTPXRequest),
+    )
+    await bot.initialize()
+    db = await abrir_cola()
+    nombre = f"{indice}:{os.getpid()}"
+    print(f"[worker {indice}] Listo (pid {os.getpid()})")
+    try:
+        while True:
+            envio = await reclamar_envio(db, nombre)
+            if envio is None:
+                await asyncio.sleep(0.5)
+                continue
+            try:
+                await procesar_envio(db, bot, envio, nombre)
+            except Exception as e:
+                # El lease caduca y el envío se reintenta (aquí o en otro worker)
+                print(f"[worker {indice}] ERROR en el envío {envio['id']}:", e)
+    finally:
+        await db.close()
+        await bot.shutdown()
+
+
+def lanzar_worker(indice: int):
+    return subprocess.Popen([sys.executable, str(Path(__file__).resolve()), "worker", str(indice)])
+
+
+def parar_workers():
+    for proceso in _COLA["workers"].values():
+        proceso.terminate()
+    for indice, proceso in _COLA["workers"].items():
+        try:
+            proceso.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            proceso.kill()
+    _COLA["workers"].clear()
+
+
+async def avisar_envio(bot, fila):
+    """Mensaje final al usuario; lo manda el bot principal para que el botón le llegue a él."""
+    if fila["error"] == "forbidden":
+        # Solo se puede avisar por el botón inline, si aún no se respondió (ver envios_job)
+        return
+    if fila["estado"] == "hecho":
+        texto = f"✔ Envío completado. {fila['enviados']} mensajes reenviados 🎉"
+        if fila["omitidos"]:
+            texto += f"\n⚠️ Omitidos {fila['omitidos']} mensajes que ya no existen en el tema."
+    else:
+        texto = (
+            f"❌ No se pudo completar el envío ({fila['enviados']} de {fila['total']} mensajes).\n"
+            "Vuelve a intentarlo más tarde."
+        )
     await bot.send_message(
-        chat_id=user_id,
-        text=f"✔ Envío completado. {enviados} mensajes reenviados 🎉",
+        chat_id=fila["user_id"],
+        text=texto,
         reply_markup=InlineKeyboardMarkup(
             [[InlineKeyboardButton("🔙 Volver al catálogo", callback_data="main_menu")]]
         ),
     )
 
 
+async def responder_boton_envio(bot, db, fila) -> bool:
+    """
+    Responde a la pulsación inline de un envío cuando ya se sabe cómo ha
+    ido: el primer mensaje llegó, el usuario no ha iniciado el bot
+    (Forbidden) o la cola tarda. False si aún hay que esperar.
+    """
+    if fila["error"] == "forbidden":
+        texto, alerta = "⚠️ Abre primero el bot en privado para recibir el tema.", True
+    elif fila["enviados"] or fila["estado"] in ("hecho", "error"):
+        texto, alerta = "📨 Te lo envío por privado.", False
+    elif time.time() - fila["creado"] > DELIVERY_INLINE_ANSWER_SECONDS:
+        texto, alerta = "📨 Te lo envío por privado en cuanto haya hueco.", False
+    else:
+        return False
+    try:
+        await bot.answer_callback_query(fila["boton_inline"], text=texto, show_alert=alerta)
+    except BadRequest as e:
+        # Pulsación demasiado antigua: Telegram ya no deja responderla
+        print(f"[envios_job] No se pudo responder al botón del envío {fila['id']}:", e)
+    except TelegramError as e:
+        print(f"[envios_job] ERROR respondiendo al botón del envío {fila['id']}:", e)
+        return False
+    await db.execute("UPDATE envios SET boton_inline = NULL WHERE id = ?", (fila["id"],))
+    return True
+
+
+async def envios_job(context: ContextTypes.DEFAULT_TYPE):
+    """Relanza workers caídos, enseña el progreso de cada envío y avisa de los terminados."""
+    for indice, proceso in list(_COLA["workers"].items()):
+        if proceso.poll() is not None:
+            print(f"[envios_job] Worker {indice} terminó (código {proceso.returncode}), se relanza")
+            _COLA["workers"][indice] = lanzar_worker(indice)
+
+    try:
+        db = await cola_db()
+        cur = await db.execute(
+            "SELECT * FROM envios WHERE estado IN ('hecho', 'error')"
+            " OR (estado = 'en_curso' AND posicion != avisado) OR boton_inline IS NOT NULL"
+        )
+        filas = await cur.fetchall()
+    except Exception as e:
+        print("[envios_job] ERROR leyendo la cola:", e)
+        return
+
+    for fila in filas:
+        if fila["boton_inline"]:
+            if not await responder_boton_envio(context.bot, db, fila):
+                continue
+        try:
+            if fila["estado"] == "pendiente":
+                continue
+            if fila["estado"] == "en_curso":
+                if fila["aviso_msg_id"]:
+                    try:
+                        await editar_por_id(
+                            context.bot,
+                            fila["aviso_chat_id"],
+                            fila["aviso_msg_id"],
+                            f"📨 Enviando contenido del tema... {fila['posicion']}/{fila['total']}",
+                        )
+                    except (BadRequest, Forbidden) as e:
+                        # Mensaje borrado o chat bloqueado: no se reintenta en cada pasada
+                        print(f"[envios_job] No se pudo avisar del envío {fila['id']}:", e)
+                await db.execute("UPDATE envios SET avisado = ? WHERE id = ?", (fila["posicion"], fila["id"]))
+                continue
+            await avisar_envio(context.bot, fila)
+        except (BadRequest, Forbidden) as e:
+            print(f"[envios_job] No se pudo avisar del envío {fila['id']}:", e)
+        except Exception as e:
+            # Error de red: se vuelve a intentar en la próxima pasada
+            print(f"[envios_job] ERROR avisando del envío {fila['id']}:", e)
+            continue
+        if fila["estado"] != "en_curso":
+            await db.execute("DELETE FROM envios WHERE id = ?", (fila["id"],))
+
+
+async def estado_cola() -> dict:
+    """Envíos por estado, para /stats."""
+    db = await cola_db()
+    cur = await db.execute("SELECT estado, COUNT(*) AS n FROM envios GROUP BY estado")
+    return {fila["estado"]: fila["n"] for fila in await cur.fetchall()}
+
+
+# ======================================================
+#   REENVÍO ORDENADO (SOLO FORWARD, SIN COPY)
+#   + Botón volver al catálogo
+#   El reenvío en sí lo hacen los workers (ver COLA DE ENVÍOS).
+# ======================================================
+
+async def avisar_boton(query, inline: bool, texto: str, **kwargs):
+    """
+    Error al pulsar un botón. Un mensaje enviado en modo inline es de
+    todo el chat: no se edita, solo se avisa a quien pulsó (alerta).
+    """
+    if inline:
+        await query.answer(texto, show_alert=True)
+    else:
+        await editar(query, texto, **kwargs)
+
+
+async def send_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    # Botón de un mensaje enviado en modo inline: no hay mensaje propio que editar
+    inline = query.message is None
+
+    _, topic_id = query.data.split(":", 1)
+    topic_id = str(topic_id)
+
+    topics = catalogo_de_clave(topic_id)
+    if topics is None or topic_id not in topics:
+        if not inline:
+            await query.answer()
+        await avisar_boton(query, inline, "❌ Tema no encontrado.")
+        return
+    # Inline: la pulsación la responde envios_job cuando se sabe si el usuario puede recibirlo
+    if not inline:
+        await query.answer()
+    contar_popular("temas", topic_id)
+
+    if not inline:
+        await editar(query, "📨 Enviando contenido del tema...")
+
+    try:
+        await encolar_envio(
+            query.from_user.id,
+            topics.vista,
+            topic_id,
+            topics[topic_id].messages,
+            None if inline else query.message,
+            query.id if inline else None,
+        )
+    except Exception as e:
+        print("[send_topic] ERROR encolando envío:", e)
+        await avisar_boton(query, inline, "❌ No se pudo preparar el envío. Inténtalo de nuevo.")
+
 
 async def send_peli_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
-    await query.answer()
+    inline = query.message is None
+    # En modo inline se responde al final: si falla, con una alerta (ver avisar_boton)
+    if not inline:
+        await query.answer()
     _, topic_id, mid_str = query.data.split(":", 2)
     topic_id = str(topic_id)
 
+    group_id = grupo_de_clave(topic_id)
     try:
         mid = int(mid_str)
     except ValueError:
-        await query.edit_message_text("❌ Película no encontrada.")
+        group_id = None
+    if group_id is None:
+        await avisar_boton(query, inline, "❌ Película no encontrada.")
         return
 
     bot = context.bot
@@ -904,9 +3430,10 @@ async def send_peli_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # Intentamos reenviar la película
         await bot.forward_message(
             chat_id=user_id,
-            from_chat_id=GROUP_ID,
+            from_chat_id=group_id,
             message_id=mid,
         )
+        contar_popular("pelis", f"{topic_id}:{mid}")
 
         # Si funciona → mensaje normal
         await bot.send_message(
@@ -916,23 +3443,27 @@ async def send_peli_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
                 [[InlineKeyboardButton("🔙 Volver al catálogo", callback_data="main_menu")]]
             ),
         )
+        if inline:
+            await query.answer("🍿 Te la he enviado por privado.")
+
+    except Forbidden:
+        # El usuario no ha abierto el bot en privado: la película sí existe
+        print(f"[send_peli_message] Usuario {user_id} no ha iniciado el bot")
+        if inline:
+            await query.answer("⚠️ Abre primero el bot en privado para recibir la película.", show_alert=True)
 
     except Exception as e:
         print(f"[send_peli_message] ERROR reenviando peli {mid}: {e}")
 
         # --- 🔥 LIMPIEZA AUTOMÁTICA DEL JSON ---
-        topics = load_topics()
-        if topic_id in topics and "movies" in topics[topic_id]:
-            antes = len(topics[topic_id]["movies"])
-            topics[topic_id]["movies"] = [
-                m for m in topics[topic_id]["movies"] if m.get("id") != mid
-            ]
-            despues = len(topics[topic_id]["movies"])
-            if antes != despues:
-                save_topics(topics)
-                print(f"[send_peli_message] Película {mid} purgada del JSON (ya no existe).")
-
-        await query.edit_message_text(
+        topics = load_topics(group_id)
+        if quitar_pelicula(topics, topic_id, mid):
+            save_topics(topics, reindex=False)
+            print(f"[send_peli_message] Película {mid} purgada del JSON (ya no existe).")
+
+        await avisar_boton(
+            query,
+            inline,
             "❌ Esa película ya no existe en el tema.\n"
 
             "Ha sido eliminada del catálogo.",
@@ -941,42 +3472,420 @@ async def send_peli_message(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 
 
-async def on_pelis_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Paginación de resultados de búsqueda de películas."""
-    query = update.callback_query
-    await query.answer()
+async def on_pelis_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Paginación de resultados de búsqueda de películas."""
+    query = update.callback_query
+    await query.answer()
+
+    partes = query.data.split(":")
+    try:
+        token = partes[1]
+        offset = int(partes[2])
+    except (IndexError, ValueError):
+        token, offset = None, 0
+
+    guardada = _PELIS_QUERIES.get(token) if token else None
+    if guardada is None or not vista_valida(guardada[0]):
+        await editar(
+            query,
+            "⌛ Esta búsqueda ha caducado. Vuelve a escribir el título para buscar.",
+            parse_mode="HTML",
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("🔙 Volver", callback_data="main_menu")]]
+            ),
+        )
+        return
+
+    vista, consulta, original_query, aproximada = guardada
+    _PELIS_QUERIES.move_to_end(token)
+    _PERSISTENCIA["consultas"].add(token)
+    topics = catalogo_vista(vista)
+    if aproximada:
+        ids = await buscar_aproximado("pelis", topics, consulta)
+    else:
+        ids = buscar_peliculas(topics, consulta)
+    text, markup = build_pelis_page(
+        offset, ids, get_movie_index(topics), token, original_query, aproximada
+    )
+
+    try:
+        await editar(
+            query,
+            text=text,
+            parse_mode="HTML",
+            reply_markup=markup,
+        )
+    except Exception as e:
+        print("[on_pelis_page] Error editando mensaje:", e)
+
+
+# ======================================================
+#   BARRIDO DE INTEGRIDAD (mensajes borrados de los grupos)
+#   Telegram no avisa a los bots de los mensajes borrados: sin esto
+#   solo se descubren cuando falla el reenvío a un usuario. Cada
+#   SWEEP_TICK_SECONDS una tanda sigue recorriendo el catálogo (grupo
+#   → tema → mensaje, en orden) copiando cada mensaje a SWEEP_CHAT_ID
+#   y borrando la copia, a SWEEP_RATE llamadas por segundo como mucho.
+#   Es de baja prioridad: no corre mientras haya envíos en la cola ni
+#   justo después de un RetryAfter. Los IDs que ya no existen se quitan
+#   del catálogo al final de cada tanda (una escritura por grupo). El
+#   cursor y el resumen por tema van en barrido.json (ver /salud).
+#   Usa su propio Bot con los ajustes del pool BULK: sus llamadas no
+#   ocupan las conexiones de context.bot, reservadas a los menús.
+#   La Bot API de python-telegram-bot 20.5 no tiene copyMessages: se
+#   comprueba mensaje a mensaje.
+# ======================================================
+class TokenBucket:
+    """Como mucho rate operaciones por segundo, con ráfagas de hasta capacity."""
+
+    def __init__(self, rate: float, capacity: float = 1.0):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.t = time.monotonic()
+
+    async def take(self):
+        while True:
+            ahora = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (ahora - self.t) * self.rate)
+            self.t = ahora
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return
+            await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+_BARRIDO = {
+    "cubeta": TokenBucket(SWEEP_RATE),
+    "estado": None,  # barrido.json en memoria (ver estado_barrido)
+    "pausa_hasta": 0.0,  # tras un RetryAfter
+    "retry_after": 0,  # METRICS.retry_after visto en la tanda anterior
+    "error": None,  # sin acceso a SWEEP_CHAT_ID o a un grupo: se para hasta reiniciar
+    "resultados": {"ok": 0, "muerto": 0, "no_copiable": 0},  # desde el arranque (métricas)
+    "bot": None,  # Bot propio (pool BULK), se crea en la primera tanda
+}
+
+
+async def bot_barrido() -> Bot:
+    bot = _BARRIDO["bot"]
+    if bot is None:
+        bot = Bot(
+            BOT_TOKEN,
+            base_url=BOT_API_BASE_URL or "https://api.telegram.org/bot",
+            request=crear_request(BULK_POOL_SIZE, BULK_TIMEOUT, BULK_POOL_TIMEOUT),
+        )
+        await bot.initialize()
+        _BARRIDO["bot"] = bot
+    return bot
+
+
+async def cerrar_bot_barrido():
+    bot = _BARRIDO["bot"]
+    if bot is not None:
+        _BARRIDO["bot"] = None
+        await bot.shutdown()
+
+
+def _salud_vacia() -> dict:
+    return {"revisados": 0, "muertos": 0, "no_copiables": 0, "fin": None}
+
+
+def estado_barrido() -> dict:
+    """Cursor (grupo, tema, último mensaje revisado), totales de la vuelta y salud por tema."""
+    estado = _BARRIDO["estado"]
+    if estado is None:
+        estado = {
+            "vuelta": 1,
+            "grupo": GROUP_ID,
+            "tema": "",
+            "mid": 0,
+            "inicio": time.time(),
+            "fin": None,
+            "totales": {"revisados": 0, "muertos": 0, "no_copiables": 0},
+            "temas": {},
+        }
+        try:
+            if SWEEP_STATE_FILE.exists():
+                with open(SWEEP_STATE_FILE, "r", encoding="utf-8") as f:
+                    estado.update(json.load(f))
+        except Exception as e:
+            print("[barrido] ERROR leyendo barrido.json, se empieza de cero:", e)
+        _BARRIDO["estado"] = estado
+    return estado
+
+
+def recorrido_barrido(estado: dict):
+    """
+    (grupo, clave, mid) desde el cursor hasta el final de la vuelta.
+    El cursor solo lo avanza quien procesa cada mensaje, así que una
+    tanda cortada a medias sigue por el mismo mensaje en la siguiente.
+    """
+    if estado["grupo"] not in _SHARDS:
+        estado.update(grupo=GROUP_ID, tema="", mid=0)
+    for gid in GROUP_IDS[GROUP_IDS.index(estado["grupo"]):]:
+        if gid != estado["grupo"]:
+            estado.update(grupo=gid, tema="", mid=0)
+        shard = _SHARDS[gid]
+        usado = shard.usado
+        topics = load_topics(gid)
+        # Recorrer un grupo no cuenta como uso: si nadie más lo pide, se descarga igual
+        shard.usado = usado
+
+        claves = sorted(topics)
+        for clave in claves[bisect_left(claves, estado["tema"]):]:
+            if clave != estado["tema"]:
+                estado.update(tema=clave, mid=0)
+                estado["temas"][clave] = _salud_vacia()
+            topic = topics.get(clave)
+            if topic is None:
+                continue
+            for mid in topic.messages.iter_after(estado["mid"]):
+                yield gid, clave, mid
+            estado["temas"].setdefault(clave, _salud_vacia())["fin"] = time.time()
+
+
+async def comprobar_mensaje(bot, group_id: int, mid: int):
+    """
+    "ok", "muerto" (ya no existe) o "no_copiable" (existe pero Telegram no
+    deja copiarlo: mensajes de servicio, contenido protegido...).
+    None si no se pudo saber: se repite en la siguiente tanda.
+    """
+    try:
+        copia = await bot.copy_message(
+            chat_id=SWEEP_CHAT_ID,
+            from_chat_id=group_id,
+            message_id=mid,
+            disable_notification=True,
+        )
+    except RetryAfter as e:
+        _BARRIDO["pausa_hasta"] = time.time() + int(e.retry_after) + 1
+        return None
+    except BadRequest as e:
+        texto = str(e).lower()
+        if "message to copy not found" in texto or "message_id_invalid" in texto:
+            return "muerto"
+        if "chat not found" in texto:
+            _BARRIDO["error"] = str(e)
+            print(f"[barrido] Sin acceso a SWEEP_CHAT_ID o al grupo {group_id}, se para:", e)
+            return None
+        return "no_copiable"
+    except Forbidden as e:
+        _BARRIDO["error"] = str(e)
+        print(f"[barrido] Sin acceso a SWEEP_CHAT_ID o al grupo {group_id}, se para:", e)
+        return None
+    except Exception as e:
+        print(f"[barrido] ERROR copiando el mensaje {mid} del grupo {group_id}:", e)
+        return None
+
+    await _BARRIDO["cubeta"].take()
+    try:
+        await bot.delete_message(chat_id=SWEEP_CHAT_ID, message_id=copia.message_id)
+    except Exception as e:
+        print("[barrido] No se pudo borrar la copia:", e)
+    return "ok"
+
+
+async def barrer_tanda(bot, estado: dict, limite: float) -> list:
+    """Revisa mensajes hasta la hora limite; devuelve [(grupo, clave, mid)] de los que ya no existen."""
+    muertos = []
+    recorrido = recorrido_barrido(estado)
+    while time.time() < limite:
+        siguiente = next(recorrido, None)
+        if siguiente is None:
+            # Vuelta completa: se olvidan los temas que ya no están en el catálogo
+            estado["fin"] = time.time()
+            estado["temas"] = {
+                clave: salud
+                for clave, salud in estado["temas"].items()
+                if salud["fin"] is not None and salud["fin"] >= estado["inicio"]
+            }
+            t = estado["totales"]
+            print(
+                f"[barrido] Vuelta {estado['vuelta']} terminada: {t['revisados']} mensajes,"
+                f" {t['muertos']} quitados, {t['no_copiables']} no copiables"
+            )
+            break
+
+        gid, clave, mid = siguiente
+        await _BARRIDO["cubeta"].take()
+        resultado = await comprobar_mensaje(bot, gid, mid)
+        if resultado is None:
+            break
+
+        _BARRIDO["resultados"][resultado] += 1
+        salud = estado["temas"].setdefault(clave, _salud_vacia())
+        salud["revisados"] += 1
+        estado["totales"]["revisados"] += 1
+        if resultado == "muerto":
+            salud["muertos"] += 1
+            estado["totales"]["muertos"] += 1
+            muertos.append((gid, clave, mid))
+        elif resultado == "no_copiable":
+            salud["no_copiables"] += 1
+            estado["totales"]["no_copiables"] += 1
+        estado["mid"] = mid
+    return muertos
+
+
+def podar_catalogo(muertos: list) -> int:
+    """Quita del catálogo los mensajes (y películas) que ya no existen; una escritura por grupo."""
+    por_grupo = {}
+    for gid, clave, mid in muertos:
+        por_grupo.setdefault(gid, []).append((clave, mid))
+    quitados = 0
+    for gid, lista in por_grupo.items():
+        topics = load_topics(gid)
+        cambiado = False
+        for clave, mid in lista:
+            topic = topics.get(clave)
+            if topic is None:
+                continue
+            if topic.messages.discard(mid):
+                quitados += 1
+                cambiado = True
+            if topic.movies and quitar_pelicula(topics, clave, mid):
+                cambiado = True
+        if cambiado:
+            save_topics(topics, reindex=False)
+    return quitados
+
+
+async def barrido_job(context: ContextTypes.DEFAULT_TYPE):
+    """Una tanda del barrido de integridad (si no hay nada más importante que hacer)."""
+    ahora = time.time()
+    if _BARRIDO["error"] or ahora < _BARRIDO["pausa_hasta"]:
+        return
+    if METRICS.retry_after != _BARRIDO["retry_after"]:
+        # Alguien acaba de toparse con el límite de Telegram: esta tanda se la salta
+        _BARRIDO["retry_after"] = METRICS.retry_after
+        return
+    try:
+        cola = await estado_cola()
+    except Exception as e:
+        print("[barrido] ERROR leyendo la cola:", e)
+        return
+    if cola.get("pendiente") or cola.get("en_curso"):
+        return
+
+    estado = estado_barrido()
+    if estado["fin"] is not None:
+        if ahora < estado["fin"] + SWEEP_PAUSE_HOURS * 3600:
+            return
+        estado.update(
+            vuelta=estado["vuelta"] + 1,
+            grupo=GROUP_ID,
+            tema="",
+            mid=0,
+            inicio=ahora,
+            fin=None,
+            totales={"revisados": 0, "muertos": 0, "no_copiables": 0},
+        )
+
+    fin = estado["fin"]
+    revisados = estado["totales"]["revisados"]
+    try:
+        muertos = await barrer_tanda(await bot_barrido(), estado, ahora + SWEEP_TICK_SECONDS * 0.8)
+        if muertos:
+            quitados = podar_catalogo(muertos)
+            print(f"[barrido] {quitados} mensajes que ya no existen quitados del catálogo")
+        # Tanda vacía (límite de la cubeta, error de red): no hay nada nuevo que guardar.
+        # Fuera del loop; el estado solo lo toca este job, que no se solapa consigo mismo.
+        if estado["totales"]["revisados"] != revisados or estado["fin"] != fin:
+            await asyncio.to_thread(write_json_atomic, SWEEP_STATE_FILE, estado, indent=None)
+    except Exception as e:
+        print("[barrido] ERROR:", e)
+
+
+# ======================================================
+#   MODO INLINE (@bot término en cualquier chat)
+#   Responde desde los índices en memoria y deja que Telegram cachee
+#   las respuestas (INLINE_CACHE_TIME). El botón de cada resultado usa
+#   los mismos callbacks que el menú privado (send_topic / send_peli_message).
+# ======================================================
+def build_inline_result(entrada, topics, movie_index):
+    if entrada[0] == "t":
+        tid = entrada[1]
+        info = topics[tid]
+        return InlineQueryResultArticle(
+            id=f"t:{tid}",
+            title=f"🎬 {fix_text(info.name)}",
+            description=f"Serie · {len(info.messages)} mensajes",
+            input_message_content=InputTextMessageContent(
+                f"🎬 <b>{escape(fix_text(info.name))}</b>", parse_mode="HTML"
+            ),
+            reply_markup=InlineKeyboardMarkup(
+                [[InlineKeyboardButton("📥 Recibir por privado", callback_data=f"t:{tid}")]]
+            ),
+        )
+
+    _, tid, mid = entrada
+    movie = movie_index.get((tid, mid))
+    if movie is None:
+        return None
+    return InlineQueryResultArticle(
+        id=f"m:{tid}:{mid}",
+        title=f"🍿 {fix_text(movie.title)}",
+        description="Película",
+        input_message_content=InputTextMessageContent(
+            f"🍿 <b>{escape(fix_text(movie.title))}</b>", parse_mode="HTML"
+        ),
+        reply_markup=InlineKeyboardMarkup(
+            [[InlineKeyboardButton("📥 Recibir por privado", callback_data=f"pelis_msg:{tid}:{mid}")]]
+        ),
+    )
+
 
-    _, page_str = query.data.split(":", 1)
+async def on_inline_query(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    iq = update.inline_query
+    consulta = normalizar_consulta(iq.query)
     try:
-        page = int(page_str)
+        offset = max(0, int(iq.offset or 0))
     except ValueError:
-        await query.edit_message_text(
-            "❌ Página no válida.",
-            parse_mode="HTML",
-        )
-        return
+        offset = 0
 
-    results = context.user_data.get("pelis_results") or []
-    topic_id = context.user_data.get("pelis_topic_id")
-    original_query = context.user_data.get("pelis_query")
+    topics = catalogo_usuario(iq.from_user.id)
+    hidden = get_hidden_topic()
 
-    if not results or not topic_id:
-        await query.edit_message_text(
-            "❌ No hay resultados de películas para paginar.",
-            parse_mode="HTML",
+    if consulta:
+        ids = buscar_series(topics, consulta)
+        if not ids:
+            ids = await buscar_aproximado("series", topics, consulta)
+        entradas = [("t", tid) for tid in ids if tid in topics and tid != hidden]
+
+        if get_pelis_topic_ids(topics):
+            pares = buscar_peliculas(topics, consulta)
+            if not pares:
+                pares = await buscar_aproximado("pelis", topics, consulta)
+            entradas += [("m", tid, mid) for tid, mid in pares]
+    else:
+        # Sin texto: las series más recientes
+        recientes = heapq.nlargest(
+            RECENT_LIMIT + 1, topics.items(), key=lambda x: x[1].created_at
         )
-        return
+        entradas = [("t", tid) for tid, _info in recientes if tid != hidden][:RECENT_LIMIT]
 
-    text, markup = build_pelis_page(page, results, topic_id, original_query)
+    pagina = entradas[offset: offset + INLINE_PAGE_SIZE]
+    movie_index = get_movie_index(topics)
+    results = [
+        r for r in (build_inline_result(e, topics, movie_index) for e in pagina) if r
+    ]
+    siguiente = offset + INLINE_PAGE_SIZE
+    next_offset = str(siguiente) if siguiente < len(entradas) else ""
 
     try:
-        await query.edit_message_text(
-            text=text,
-            parse_mode="HTML",
-            reply_markup=markup,
+        await iq.answer(
+            results,
+            cache_time=INLINE_CACHE_TIME,
+            # Con varios grupos el resultado depende del grupo elegido por cada usuario
+            is_personal=len(GROUP_IDS) > 1,
+            next_offset=next_offset,
+            # Para recibir el contenido hay que haber abierto el bot en privado
+            button=InlineQueryResultsButton(
+                text="📬 Abrir el catálogo en privado", start_parameter="inline"
+            ),
         )
     except Exception as e:
-        print("[on_pelis_page] Error editando mensaje:", e)
+        print("[on_inline_query] Error respondiendo:", e)
 
 
 # ======================================================
@@ -989,38 +3898,37 @@ async def setpelis(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("⛔ No tienes permiso para usar este comando.")
         return
 
-    # Si ya hay un tema de pelis, no dejamos cambiarlo (comando de un solo uso)
-    topics = load_topics()
-    existing_pelis_tid = get_pelis_topic_id(topics)
-    if existing_pelis_tid:
+    # Debe ejecutarse dentro de un grupo configurado y dentro de un tema
+    if msg.chat.id not in _SHARDS or msg.message_thread_id is None:
         await msg.reply_text(
-            "🍿 Ya hay un tema configurado como <b>Películas</b>.\n"
-            "No se puede volver a cambiar.",
+            "🍿 Usa /setpelis dentro del tema de <b>Películas</b> en el grupo.",
             parse_mode="HTML",
         )
         return
 
-    # Debe ejecutarse dentro del grupo y dentro de un tema
-    if msg.chat.id != GROUP_ID or msg.message_thread_id is None:
+    # Si el grupo ya tiene tema de pelis, no dejamos cambiarlo (comando de un solo uso)
+    topics = load_topics(msg.chat.id)
+    existing_pelis_tid = get_pelis_topic_id(topics)
+    if existing_pelis_tid:
         await msg.reply_text(
-            "🍿 Usa /setpelis dentro del tema de <b>Películas</b> en el grupo.",
+            "🍿 Ya hay un tema configurado como <b>Películas</b>.\n"
+            "No se puede volver a cambiar.",
             parse_mode="HTML",
         )
         return
 
-    topic_id = str(msg.message_thread_id)
+    topic_id = clave_tema(msg.chat.id, msg.message_thread_id)
 
     # Aseguramos que el tema existe en la base de datos
     if topic_id not in topics:
-        topic_name = msg.chat.title or f"Tema {topic_id}"
-        topics[topic_id] = {
-            "name": topic_name,
-            "messages": [],
-            "created_at": msg.date.timestamp() if msg.date else 0,
-        }
+        topic_name = msg.chat.title or f"Tema {msg.message_thread_id}"
+        topics[topic_id] = Topic(
+            topic_id,
+            topic_name,
+            created_at=msg.date.timestamp() if msg.date else 0,
+        )
 
-    topics[topic_id]["is_pelis"] = True
-    topics[topic_id].setdefault("movies", [])
+    topics[topic_id].is_pelis = True
 
     save_topics(topics)
 
@@ -1040,26 +3948,26 @@ async def silencio(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("⛔ No tienes permiso para usar este comando.")
         return
 
-    if msg.chat.id != GROUP_ID or msg.message_thread_id is None:
+    if msg.chat.id not in _SHARDS or msg.message_thread_id is None:
         await msg.reply_text(
             "🔇 Usa /silencio dentro del tema que quieras silenciar en el grupo.",
             parse_mode="HTML",
         )
         return
 
-    topic_id = str(msg.message_thread_id)
-    topics = load_topics()
+    topic_id = clave_tema(msg.chat.id, msg.message_thread_id)
+    topics = load_topics(msg.chat.id)
 
     if topic_id not in topics:
         # Creamos entrada mínima para poder marcarlo como silenciado
-        topic_name = msg.chat.title or f"Tema {topic_id}"
-        topics[topic_id] = {
-            "name": topic_name,
-            "messages": [],
-            "created_at": msg.date.timestamp() if msg.date else 0,
-        }
+        topic_name = msg.chat.title or f"Tema {msg.message_thread_id}"
+        topics[topic_id] = Topic(
+            topic_id,
+            topic_name,
+            created_at=msg.date.timestamp() if msg.date else 0,
+        )
 
-    topics[topic_id]["muted"] = True
+    topics[topic_id].muted = True
     save_topics(topics)
 
     await msg.reply_text(
@@ -1075,18 +3983,18 @@ async def activar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("⛔ No tienes permiso para usar este comando.")
         return
 
-    if msg.chat.id != GROUP_ID or msg.message_thread_id is None:
+    if msg.chat.id not in _SHARDS or msg.message_thread_id is None:
         await msg.reply_text(
             "🔊 Usa /activar dentro del tema que quieras reactivar en el grupo.",
             parse_mode="HTML",
         )
         return
 
-    topic_id = str(msg.message_thread_id)
-    topics = load_topics()
+    topic_id = clave_tema(msg.chat.id, msg.message_thread_id)
+    topics = load_topics(msg.chat.id)
 
-    if topic_id in topics and topics[topic_id].get("muted"):
-        topics[topic_id]["muted"] = False
+    if topic_id in topics and topics[topic_id].muted:
+        topics[topic_id].muted = False
         save_topics(topics)
         await msg.reply_text(
             "🔊 Este tema ha sido <b>reactivado</b>.\n"
@@ -1158,32 +4066,35 @@ async def ocultar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await msg.reply_text("❌ Uso: /ocultar NOMBRE_EXACTO_DEL_TEMA")
         return
     nombre = " ".join(context.args).lower()
-    topics = load_topics()
+    topics = catalogo_usuario(msg.from_user.id)
     for tid, info in topics.items():
-        if info["name"].lower() == nombre:
+        if info.name.lower() == nombre:
             set_hidden_topic(tid)
-            await msg.reply_text(f"✔ Tema ocultado:\n<b>{info['name']}</b>", parse_mode="HTML")
+            await msg.reply_text(f"✔ Tema ocultado:\n<b>{info.name}</b>", parse_mode="HTML")
             return
     await msg.reply_text("❌ No encontré un tema con ese nombre exacto.")
 
+BORRARTEMA_TEXT = (
+    "🗑 <b>Borrar temas</b>\n"
+    "Elige una letra para ver los temas que comienzan por esa letra."
+)
+
+
 async def borrartema(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
         await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
         return
 
     chat = update.effective_chat
-    topics = load_topics()
+    topics = catalogo_usuario(update.effective_user.id)
 
     if not topics:
         await chat.send_message("📭 No hay temas para borrar.")
         return
 
-    await chat.send_message(
-        "🗑 <b>Borrar temas</b>\n"
-        "Elige una letra para ver los temas que comienzan por esa letra.",
-        parse_mode="HTML",
-        reply_markup=build_borrartema_main_keyboard(),
-    )
+    markup = build_borrartema_main_keyboard()
+    msg = await chat.send_message(BORRARTEMA_TEXT, parse_mode="HTML", reply_markup=markup)
+    recordar_enviado(msg, BORRARTEMA_TEXT, "HTML", markup)
 
 
 def build_borrartema_letter_page(letter, page, topics_dict):
@@ -1204,7 +4115,7 @@ def build_borrartema_letter_page(letter, page, topics_dict):
 
     keyboard = []
     for tid, info in slice_items:
-        safe_name = escape(fix_text(info.get("name", "")))
+        safe_name = escape(fix_text(info.name))
         keyboard.append(
             [InlineKeyboardButton(f"❌ {safe_name}", callback_data=f"del:{tid}")]
         )
@@ -1254,11 +4165,8 @@ async def on_del_main(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     try:
-        await query.edit_message_text(
-            "🗑 <b>Borrar temas</b>\n"
-            "Elige una letra para ver los temas que comienzan por esa letra.",
-            parse_mode="HTML",
-            reply_markup=build_borrartema_main_keyboard(),
+        await editar(
+            query, BORRARTEMA_TEXT, parse_mode="HTML", reply_markup=build_borrartema_main_keyboard()
         )
     except Exception as e:
         print("[on_del_main] Error editando mensaje:", e)
@@ -1268,11 +4176,12 @@ async def on_del_letter(update: Update, context: ContextTypes.DEFAULT_TYPE):
     query = update.callback_query
     await query.answer()
     _, letter = query.data.split(":", 1)
-    topics = load_topics()
+    topics = catalogo_usuario(query.from_user.id)
 
     text, markup = build_borrartema_letter_page(letter, 1, topics)
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             text=text,
             parse_mode="HTML",
             reply_markup=markup,
@@ -1286,11 +4195,12 @@ async def on_del_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
     _, letter, page_str = query.data.split(":", 2)
     page = int(page_str)
-    topics = load_topics()
+    topics = catalogo_usuario(query.from_user.id)
 
     text, markup = build_borrartema_letter_page(letter, page, topics)
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             text=text,
             parse_mode="HTML",
             reply_markup=markup,
@@ -1308,23 +4218,24 @@ async def delete_topic(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # Seguridad extra: solo OWNER
     if query.from_user.id != OWNER_ID:
-        await query.edit_message_text("⛔ No tienes permiso para esta acción.")
+        await editar(query, "⛔ No tienes permiso para esta acción.")
         return
 
     _, topic_id = query.data.split(":", 1)
     topic_id = str(topic_id)
 
-    topics = load_topics()
-    if topic_id not in topics:
-        await query.edit_message_text("❌ Ese tema ya no existe.")
+    topics = catalogo_de_clave(topic_id)
+    if topics is None or topic_id not in topics:
+        await editar(query, "❌ Ese tema ya no existe.")
         return
 
-    deleted_name = topics[topic_id]["name"]
+    deleted_name = topics[topic_id].name
 
     del topics[topic_id]
     save_topics(topics)
 
-    await query.edit_message_text(
+    await editar(
+        query,
         f"🗑 Tema eliminado:\n<b>{escape(deleted_name)}</b>",
         parse_mode="HTML",
     )
@@ -1338,7 +4249,9 @@ async def reiniciar_db(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
         return
 
-    save_topics({})
+    # En un grupo se reinicia su catálogo; en privado, el del grupo principal
+    chat_id = update.effective_chat.id
+    save_topics({}, group_id=chat_id if chat_id in _SHARDS else GROUP_ID)
     await update.message.reply_text("🗑 Base de datos reiniciada.")
 
 
@@ -1357,7 +4270,7 @@ def build_users_page(page: int, users_dict: dict):
     # Ordenamos por first_seen ascendente
     def clave(u_item):
         uid, info = u_item
-        return info.get("first_seen", 0)
+        return info.first_seen
 
     items.sort(key=clave)
 
@@ -1371,8 +4284,8 @@ def build_users_page(page: int, users_dict: dict):
 
     lines = [f"👥 <b>Usuarios registrados</b> (total: {total})\n"]
     for idx, (uid, info) in enumerate(slice_items, start=start_idx + 1):
-        name = fix_text(info.get("name", ""))
-        username = fix_text(info.get("username", ""))
+        name = fix_text(info.name)
+        username = fix_text(info.username)
         if username:
             line = f"{idx}. {escape(name)} [{uid}] ({escape(username)})"
         else:
@@ -1428,7 +4341,7 @@ async def on_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await query.answer()
 
     if query.from_user.id != OWNER_ID:
-        await query.edit_message_text("⛔ No tienes permiso para esta acción.")
+        await editar(query, "⛔ No tienes permiso para esta acción.")
         return
 
     _, page_str = query.data.split(":", 1)
@@ -1438,7 +4351,8 @@ async def on_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
     text, markup = build_users_page(page, users)
 
     try:
-        await query.edit_message_text(
+        await editar(
+            query,
             text=text,
             parse_mode="HTML",
             reply_markup=markup,
@@ -1447,20 +4361,834 @@ async def on_users_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
         print("[on_users_page] Error editando mensaje:", e)
 
 
+# ======================================================
+#   /SESIONES — SOLO OWNER (estado de la caché de sesiones)
+# ======================================================
+async def sesiones(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
+        return
+
+    SESSIONS.purge()
+    st = SESSIONS.stats()
+    await update.message.reply_text(
+        "🧠 <b>Sesiones</b>\n"
+        f"Activas: {st['sessions']} (máx. {SESSION_MAX}, caducan a los {SESSION_TTL // 60} min)\n"
+        f"Memoria aprox.: {st['bytes'] / 1024:.1f} KiB\n"
+        f"Caducadas: {st['expired']} · Expulsadas por límite: {st['evicted']}\n"
+        f"Cambios sin guardar en disco: {len(SESSIONS.dirty)}",
+        parse_mode="HTML",
+    )
+
+
+# ======================================================
+#   /STATS — SOLO OWNER (resumen de métricas)
+# ======================================================
+def _fmt_ms(segundos: float) -> str:
+    return f"{segundos * 1000:.0f} ms"
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
+        return
+
+    m = METRICS
+    horas = (time.time() - m.started) / 3600
+    lineas = [f"📊 <b>Estadísticas</b> (últimas {horas:.1f} h)"]
+    if m.primer_update is not None:
+        lineas.append(f"Arranque → primer update: {_fmt_ms(m.primer_update)}")
+    lineas += ["", "<b>Handlers</b> (n · p50 · p95 · máx · API/upd)"]
+    for nombre, h in sorted(m.handlers.items(), key=lambda kv: -kv[1].count)[:12]:
+        llamadas = m.handler_api_calls.get(nombre, 0) / h.count
+        lineas.append(
+            f"• {nombre}: {h.count} · ≤{_fmt_ms(h.percentil(50))} · ≤{_fmt_ms(h.percentil(95))}"
+            f" · {_fmt_ms(h.maximo)} · {llamadas:.1f}"
+        )
+
+    total_api = sum(h.count for h in m.api.values())
+    lineas += ["", f"<b>Bot API</b>: {total_api} llamadas"]
+    for metodo, h in sorted(m.api.items(), key=lambda kv: -kv[1].count)[:6]:
+        lineas.append(f"• {metodo}: {h.count} · p95 ≤{_fmt_ms(h.percentil(95))}")
+    lineas.append(f"RetryAfter: {m.retry_after} ({m.retry_after_seconds} s de espera)")
+    lineas.append(f"Ediciones sin cambios evitadas: {m.ediciones_evitadas}")
+    if m.loop_lag.count:
+        bloqueos = sum(m.bloqueos.values())
+        lineas.append(
+            f"Retraso del bucle: p50 ≤{_fmt_ms(m.loop_lag.percentil(50))} · p99 ≤{_fmt_ms(m.loop_lag.percentil(99))}"
+            f" · máx {_fmt_ms(m.loop_lag.maximo)} · {bloqueos} bloqueos"
+        )
+        for nombre, n in sorted(m.bloqueos.items(), key=lambda kv: -kv[1])[:3]:
+            lineas.append(f"• bloqueado en {escape(nombre)}: {n}")
+
+    errores = sorted(
+        [(f"{h} {t}", n) for (h, t), n in m.handler_errors.items()]
+        + [(f"{mt} {t}", n) for (mt, t), n in m.api_errors.items()],
+        key=lambda kv: -kv[1],
+    )
+    if errores:
+        lineas += ["", "<b>Errores</b>"]
+        lineas += [f"• {escape(nombre)}: {n}" for nombre, n in errores[:8]]
+
+    if m.store:
+        lineas += ["", "<b>Disco</b>"]
+        for op, h in sorted(m.store.items()):
+            lineas.append(f"• {op}: {h.count} · media {_fmt_ms(h.total / h.count)} · máx {_fmt_ms(h.maximo)}")
+
+    cache = SEARCH_CACHE.stats()
+    lineas += [
+        "",
+        f"Caché de búsquedas: {cache['entries']} entradas · acierto {cache['hit_rate'] * 100:.0f}%",
+        f"Sesiones activas: {len(SESSIONS.data)}",
+    ]
+    if len(GROUP_IDS) > 1:
+        cargados = sum(1 for sh in _SHARDS.values() if sh.topics is not None)
+        lineas.append(f"Grupos en memoria: {cargados}/{len(GROUP_IDS)}")
+    try:
+        cola = await estado_cola()
+        vivos = sum(1 for p in _COLA["workers"].values() if p.poll() is None)
+        lineas.append(
+            f"Cola de envíos: {cola.get('pendiente', 0)} pendientes · {cola.get('en_curso', 0)} en curso"
+            f" · workers {vivos}/{DELIVERY_WORKERS}"
+        )
+    except Exception as e:
+        print("[stats] ERROR leyendo la cola:", e)
+    if SWEEP_CHAT_ID:
+        barrido = estado_barrido()
+        lineas.append(
+            f"Barrido: vuelta {barrido['vuelta']} · {barrido['totales']['revisados']} revisados"
+            f" · {barrido['totales']['muertos']} quitados (detalle en /salud)"
+        )
+    await update.message.reply_text("\n".join(lineas), parse_mode="HTML")
+
+
+# ======================================================
+#   /SALUD — SOLO OWNER (progreso del barrido y salud por tema)
+# ======================================================
+async def salud(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
+        return
+    if not SWEEP_CHAT_ID:
+        await update.message.reply_text("🩺 El barrido de integridad está desactivado (falta SWEEP_CHAT_ID).")
+        return
+
+    estado = estado_barrido()
+    t = estado["totales"]
+    # Los quitados ya no están en el catálogo pero sí se revisaron en esta vuelta
+    total = sum(len(info.messages) for gid in GROUP_IDS for info in load_topics(gid).values()) + t["muertos"]
+    porcentaje = min(100, t["revisados"] * 100 // total) if total else 100
+    lineas = [
+        "🩺 <b>Barrido de integridad</b>",
+        f"Vuelta {estado['vuelta']} desde {time.strftime('%d/%m %H:%M', time.localtime(estado['inicio']))}:"
+        f" {t['revisados']}/{total} mensajes ({porcentaje}%)",
+        f"Quitados: {t['muertos']} · no copiables: {t['no_copiables']}",
+    ]
+
+    if _BARRIDO["error"]:
+        lineas.append(f"⛔ Parado: {escape(_BARRIDO['error'])}")
+    elif estado["fin"] is not None:
+        siguiente = time.localtime(estado["fin"] + SWEEP_PAUSE_HOURS * 3600)
+        lineas.append(f"✅ Vuelta terminada; la siguiente empieza el {time.strftime('%d/%m %H:%M', siguiente)}")
+    else:
+        topics = catalogo_de_clave(estado["tema"]) if estado["tema"] else None
+        tema = topics.get(estado["tema"]) if topics is not None else None
+        if tema is not None:
+            lineas.append(f"Ahora: {escape(nombre_vista(estado['grupo']))} · {escape(fix_text(tema.name))}")
+        if time.time() < _BARRIDO["pausa_hasta"]:
+            lineas.append("⏸ En pausa por un RetryAfter de Telegram")
+
+    problemas = sorted(
+        ((clave, s) for clave, s in estado["temas"].items() if s["muertos"] or s["no_copiables"]),
+        key=lambda kv: (-kv[1]["muertos"], -kv[1]["no_copiables"]),
+    )
+    if problemas:
+        lineas += ["", "<b>Temas con mensajes perdidos</b> (quitados · no copiables · revisados)"]
+        for clave, s in problemas[:20]:
+            topics = catalogo_de_clave(clave)
+            tema = topics.get(clave) if topics is not None else None
+            nombre = fix_text(tema.name) if tema is not None else f"Tema {clave}"
+            lineas.append(f"• {escape(nombre)}: {s['muertos']} · {s['no_copiables']} · {s['revisados']}")
+    else:
+        lineas += ["", "Ningún tema con mensajes perdidos en esta vuelta."]
+    await update.message.reply_text("\n".join(lineas), parse_mode="HTML")
+
+
+# ======================================================
+#   /TOP [N] — SOLO OWNER (lo más pedido, ver POPULARIDAD)
+# ======================================================
+def _nombre_tema(clave: str) -> str:
+    topics = catalogo_de_clave(clave)
+    tema = topics.get(clave) if topics is not None else None
+    return fix_text(tema.name) if tema is not None else f"Tema {clave} (borrado)"
+
+
+async def top(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
+        return
+
+    n = 10
+    if context.args:
+        try:
+            n = max(1, min(50, int(context.args[0])))
+        except ValueError:
+            pass
+
+    lineas = [f"🔥 <b>Top {n}</b>", "", "<b>Temas enviados</b>"]
+    for clave, veces in mas_populares(_POPULARIDAD["temas"], n):
+        lineas.append(f"• {escape(_nombre_tema(clave))}: {veces}")
+
+    lineas += ["", "<b>Películas enviadas</b>"]
+    for clave, veces in mas_populares(_POPULARIDAD["pelis"], n):
+        tema, _, mid = clave.rpartition(":")
+        topics = catalogo_de_clave(tema)
+        movie = buscar_pelicula(topics, tema, int(mid)) if topics is not None else None
+        titulo = fix_text(movie.title) if movie is not None else f"Mensaje {mid} (borrada)"
+        lineas.append(f"• {escape(titulo)}: {veces}")
+
+    lineas += ["", "<b>Páginas de letras</b>"]
+    for clave, veces in mas_populares(_POPULARIDAD["letras"], n):
+        texto_vista, letra, pagina = clave.split(":")
+        vista = vista_de_texto(texto_vista)
+        grupo = f"{nombre_vista(vista)} · " if len(GROUP_IDS) > 1 and vista is not None else ""
+        lineas.append(f"• {escape(grupo)}{escape(letra)} pág. {pagina}: {veces}")
+
+    lineas += ["", "<b>Búsquedas</b>"]
+    for clave, veces in mas_populares(_POPULARIDAD["busquedas"], n):
+        modo, _vista, consulta = clave.split("\t")
+        lineas.append(f"• {'🍿' if modo == 'pelis' else '🔍'} {escape(consulta)}: {veces}")
+
+    await update.message.reply_text("\n".join(lineas), parse_mode="HTML")
+
+
+# ======================================================
+#   /PERFIL [segundos] — SOLO OWNER
+#   Activa cProfile y tracemalloc durante N segundos en el proceso
+#   en marcha y manda un informe .txt. Fuera de ese intervalo no hay
+#   ni profiler ni trazado de memoria activos (coste cero).
+#   cProfile solo ve el hilo del bucle de eventos: el trabajo hecho
+#   con asyncio.to_thread aparece como espera en to_thread.
+# ======================================================
+_PERFIL = {"activo": False}
+
+
+def generar_informe_perfil(prof, mem_antes, mem_despues, segundos: int, pico: int) -> bytes:
+    filtros = [
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ]
+    mem_antes = mem_antes.filter_traces(filtros)
+    mem_despues = mem_despues.filter_traces(filtros)
+
+    out = io.StringIO()
+    out.write(f"Perfil de {segundos} s — {time.strftime('%Y-%m-%d %H:%M:%S')}\n")
+    out.write(f"Pico de memoria trazada: {pico / 1024 / 1024:.1f} MiB\n\n")
+
+    out.write("=== CPU: top 40 por tiempo acumulado ===\n")
+    st = pstats.Stats(prof, stream=out)
+    st.strip_dirs().sort_stats("cumulative").print_stats(40)
+    out.write("=== CPU: top 20 por tiempo propio ===\n")
+    st.sort_stats("tottime").print_stats(20)
+
+    out.write("=== Memoria: top 25 líneas por crecimiento durante el perfil ===\n")
+    for diff in mem_despues.compare_to(mem_antes, "lineno")[:25]:
+        out.write(f"{diff}\n")
+    out.write("\n=== Memoria: top 15 líneas por memoria viva al terminar ===\n")
+    for stat in mem_despues.statistics("lineno")[:15]:
+        out.write(f"{stat}\n")
+    return out.getvalue().encode("utf-8")
+
+
+async def _perfilar(chat_id: int, segundos: int, bot):
+    ya_trazando = tracemalloc.is_tracing()
+    if not ya_trazando:
+        tracemalloc.start(10)
+    prof = cProfile.Profile()
+    try:
+        mem_antes = tracemalloc.take_snapshot()
+        prof.enable()
+        try:
+            await asyncio.sleep(segundos)
+        finally:
+            prof.disable()
+        mem_despues = tracemalloc.take_snapshot()
+        pico = tracemalloc.get_traced_memory()[1]
+    finally:
+        if not ya_trazando:
+            tracemalloc.stop()
+        _PERFIL["activo"] = False
+
+    try:
+        informe = await asyncio.to_thread(
+            generar_informe_perfil, prof, mem_antes, mem_despues, segundos, pico
+        )
+        await bot.send_document(
+            chat_id=chat_id,
+            document=informe,
+            filename=f"perfil_{time.strftime('%Y%m%d_%H%M%S')}.txt",
+            caption=f"🔬 Perfil de {segundos} s",
+        )
+    except Exception as e:
+        print("[perfil] ERROR:", e)
+        await bot.send_message(chat_id, "❌ Error al generar el perfil.")
+
+
+async def perfil(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if update.effective_user.id != OWNER_ID:
+        await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
+        return
+
+    if _PERFIL["activo"]:
+        await update.message.reply_text("⏳ Ya hay un perfil en marcha.")
+        return
+
+    segundos = PROFILE_DEFAULT_SECONDS
+    if context.args:
+        try:
+            segundos = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text(f"Uso: /perfil [segundos] (1-{PROFILE_MAX_SECONDS})")
+            return
+    segundos = max(1, min(segundos, PROFILE_MAX_SECONDS))
+
+    # Se marca antes del await para que un segundo /perfil no arranque otro,
+    # y se desmarca si no llega a lanzarse (si no, quedaría bloqueado hasta reiniciar)
+    _PERFIL["activo"] = True
+    try:
+        await update.message.reply_text(f"🔬 Perfilando durante {segundos} s…")
+        # En segundo plano: el handler termina y el bot sigue atendiendo updates
+        context.application.create_task(_perfilar(update.effective_chat.id, segundos, context.bot))
+    except Exception:
+        _PERFIL["activo"] = False
+        raise
+
+
+# ======================================================
+#   SERVIDORES HTTP (WEBHOOK, HEALTH CHECK Y MÉTRICAS)
+#   Los dos son de tornado, como el de run_webhook, con límites de
+#   tiempo y tamaño (ver crear_servidor_http). En modo webhook el bot
+#   atiende él mismo PORT (run_webhook solo sabe de la ruta del
+#   webhook): POST a WEBHOOK_PATH con la cabecera secreta ->
+#   app.update_queue, y GET HEALTH_PATH para la plataforma de
+#   despliegue. Aparte, en
+#   METRICS_HOST:METRICS_PORT (por defecto 127.0.0.1) van /metrics y
+#   también HEALTH_PATH. El health check da 503 hasta que el catálogo
+#   está en memoria y llegan updates (webhook registrado y escuchando
+#   o long polling en marcha).
+# ======================================================
+_METRICS_SERVER = {"server": None, "app": None}
+_WEBHOOK = {"server": None, "app": None, "activo": False}
+
+
+def recibiendo_updates(app) -> bool:
+    """True si al bot le llegan updates: webhook registrado y escuchando, o long polling en marcha."""
+    if app is None or not app.running:
+        return False
+    if WEBHOOK_URL or _WEBHOOK["server"] is not None:
+        return _WEBHOOK["activo"]
+    return app.updater is not None and app.updater.running
+
+
+def respuesta_salud(app):
+    """(código HTTP, cuerpo JSON) de HEALTH_PATH."""
+    catalogo = _SHARDS[GROUP_ID].topics is not None
+    updates = recibiendo_updates(app)
+    listo = catalogo and updates
+    cuerpo = json.dumps(
+        {
+            "status": "ok" if listo else "starting",
+            "mode": "webhook" if WEBHOOK_URL or _WEBHOOK["server"] is not None else "polling",
+            "catalog": catalogo,
+            "receiving_updates": updates,
+            "uptime_s": round(time.time() - METRICS.started, 1),
+        }
+    )
+    return (200 if listo else 503), cuerpo
+
+
+class _SaludHandler(tornado.web.RequestHandler):
+    def initialize(self, estado: dict):
+        self.estado = estado  # _WEBHOOK o _METRICS_SERVER (de ahí sale la app)
+
+    def get(self):
+        codigo, cuerpo = respuesta_salud(self.estado["app"])
+        self.set_status(codigo)
+        self.set_header("Content-Type", "application/json")
+        self.finish(cuerpo)
+
+    def head(self):
+        self.set_status(respuesta_salud(self.estado["app"])[0])
+
+
+class _MetricasHandler(tornado.web.RequestHandler):
+    def get(self):
+        self.set_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.finish(METRICS.render())
+
+
+class _WebhookHandler(tornado.web.RequestHandler):
+    async def post(self):
+        secreto = self.request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+        if not hmac.compare_digest(secreto, WEBHOOK_SECRET):
+            raise tornado.web.HTTPError(403)
+        app = _WEBHOOK["app"]
+        try:
+            update = Update.de_json(json.loads(self.request.body), app.bot)
+        except Exception as e:
+            # 200 igualmente: ante un error Telegram lo reenviaría una y otra vez
+            print("[webhook] Update no válido, se descarta:", e)
+            update = None
+        if update is not None:
+            await app.update_queue.put(update)
+        self.finish()
+
+
+def crear_servidor_http(rutas: list) -> HTTPServer:
+    """
+    Servidor de tornado (el mismo que usa run_webhook) con límites: quien
+    tarde más de HTTP_TIMEOUT en mandar las cabeceras o el cuerpo, o
+    mande demasiadas cabeceras o un cuerpo enorme, se queda fuera.
+    """
+    return HTTPServer(
+        tornado.web.Application(rutas),
+        idle_connection_timeout=HTTP_TIMEOUT,  # también es el límite para las cabeceras
+        body_timeout=HTTP_TIMEOUT,
+        max_header_size=HTTP_MAX_HEADER_SIZE,
+        max_body_size=WEBHOOK_MAX_BODY,
+    )
+
+
+async def cerrar_servidor_http(server: HTTPServer):
+    server.stop()
+    await server.close_all_connections()
+
+
+async def arrancar_webhook(app, listen: str = WEBHOOK_LISTEN, port: int = WEBHOOK_PORT, url: str = ""):
+    """Abre PORT y registra el webhook en Telegram (el servidor va antes: no se pierde ningún POST)."""
+    _WEBHOOK["app"] = app
+    server = crear_servidor_http(
+        [
+            ("/" + WEBHOOK_PATH, _WebhookHandler),
+            (HEALTH_PATH, _SaludHandler, {"estado": _WEBHOOK}),
+        ]
+    )
+    server.listen(port, address=listen)
+    _WEBHOOK["server"] = server
+    await app.bot.set_webhook(
+        url or f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+        allowed_updates=ALLOWED_UPDATES,
+        secret_token=WEBHOOK_SECRET,
+    )
+    _WEBHOOK["activo"] = True
+
+
+async def parar_webhook():
+    _WEBHOOK["activo"] = False
+    server = _WEBHOOK["server"]
+    if server is not None:
+        _WEBHOOK["server"] = None
+        await cerrar_servidor_http(server)
+
+
+async def servir_webhook(app):
+    """Como app.run_webhook, con arrancar_webhook en lugar del servidor de python-telegram-bot."""
+    parada = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, parada.set)
+    await app.initialize()
+    if app.post_init:
+        await app.post_init(app)
+    try:
+        await app.start()
+        await arrancar_webhook(app)
+        await parada.wait()
+    finally:
+        await parar_webhook()
+        if app.running:
+            await app.stop()
+        await app.shutdown()
+        if app.post_shutdown:
+            await app.post_shutdown(app)
+
+
+async def start_metrics_server(app):
+    _METRICS_SERVER["app"] = app
+    if not METRICS_PORT:
+        return
+    server = crear_servidor_http(
+        [
+            ("/metrics", _MetricasHandler),
+            (HEALTH_PATH, _SaludHandler, {"estado": _METRICS_SERVER}),
+        ]
+    )
+    try:
+        server.listen(METRICS_PORT, address=METRICS_HOST)
+        _METRICS_SERVER["server"] = server
+        print(f"Métricas en http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    except OSError as e:
+        print("[start_metrics_server] No se pudo abrir el puerto:", e)
+
+
+async def stop_metrics_server(app):
+    server = _METRICS_SERVER["server"]
+    if server is not None:
+        _METRICS_SERVER["server"] = None
+        await cerrar_servidor_http(server)
+
+
+# ======================================================
+#   VIGÍA DEL BUCLE DE EVENTOS
+#   Todo el código síncrono (leer y escribir JSON, recorrer el
+#   catálogo, normalizar texto...) corre en el bucle y mientras dura
+#   nadie más recibe respuesta. Una tarea duerme LOOP_LAG_INTERVAL s
+#   y apunta en METRICS.loop_lag cuánto de más tardó en despertar. Un
+#   hilo aparte vigila esa tarea: si lleva más de LOOP_LAG_THRESHOLD_MS
+#   sin despertar, saca la pila del hilo del bucle (el código que lo
+#   está bloqueando en ese momento) y la imprime con el nombre del
+#   handler. Solo un aviso por bloqueo.
+# ======================================================
+_VIGIA = {"esperado": 0.0, "tarea": None, "parar": None, "bloqueo": None}
+
+
+def handler_en_pila(frame) -> str:
+    """
+    Handler que se está ejecutando según la pila del bucle: el callback
+    que llamó la envoltura de medir_handler. Sin handler (trabajos
+    periódicos, arranque...) la función de main.py más externa.
+    """
+    llamado = None
+    externa = "(desconocido)"
+    while frame is not None:
+        codigo = frame.f_code
+        if codigo.co_filename == __file__:
+            if codigo.co_name == "envoltura" and llamado is not None:
+                return llamado.f_code.co_name
+            externa = codigo.co_name
+        llamado = frame
+        frame = frame.f_back
+    return externa
+
+
+def vigia_hilo(hilo_bucle: int, parar: threading.Event):
+    avisado = None
+    while not parar.wait(LOOP_LAG_INTERVAL):
+        esperado = _VIGIA["esperado"]
+        retraso = time.monotonic() - esperado
+        if retraso * 1000 < LOOP_LAG_THRESHOLD_MS or avisado == esperado:
+            continue
+        avisado = esperado
+        frame = sys._current_frames().get(hilo_bucle)
+        if frame is None:
+            continue
+        handler = handler_en_pila(frame)
+        pila = "".join(traceback.format_stack(frame, limit=25))
+        del frame
+        METRICS.bloqueos[handler] = METRICS.bloqueos.get(handler, 0) + 1
+        _VIGIA["bloqueo"] = handler
+        print(f"[vigia] Bucle bloqueado {retraso * 1000:.0f} ms en {handler}:\n{pila}", end="")
+
+
+async def vigia_bucle():
+    while True:
+        _VIGIA["esperado"] = time.monotonic() + LOOP_LAG_INTERVAL
+        await asyncio.sleep(LOOP_LAG_INTERVAL)
+        retraso = max(0.0, time.monotonic() - _VIGIA["esperado"])
+        METRICS.loop_lag.observe(retraso)
+        if _VIGIA["bloqueo"] is not None:
+            print(f"[vigia] Bloqueo en {_VIGIA['bloqueo']} terminado tras {retraso * 1000:.0f} ms")
+            _VIGIA["bloqueo"] = None
+
+
+def arrancar_vigia():
+    if LOOP_LAG_THRESHOLD_MS <= 0:
+        return
+    _VIGIA["esperado"] = time.monotonic() + LOOP_LAG_INTERVAL
+    _VIGIA["tarea"] = asyncio.get_running_loop().create_task(vigia_bucle())
+    parar = threading.Event()
+    threading.Thread(
+        target=vigia_hilo, args=(threading.get_ident(), parar), name="vigia", daemon=True
+    ).start()
+    _VIGIA["parar"] = parar
+
+
+def parar_vigia():
+    if _VIGIA["parar"] is not None:
+        _VIGIA["parar"].set()
+        _VIGIA["parar"] = None
+    if _VIGIA["tarea"] is not None:
+        _VIGIA["tarea"].cancel()
+        _VIGIA["tarea"] = None
+
+
 # ======================================================
 #   MAIN
 # ======================================================
 # ============================
 #   /EXPORTAR y /IMPORTAR
 # ============================
+def comprimir(data: bytes, formato: str) -> bytes:
+    if formato == "zst":
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    if formato == "gz":
+        return gzip.compress(data, compresslevel=6)
+    return data
+
+
+def descomprimir(data: bytes, nombre: str) -> bytes:
+    if nombre.endswith(".gz"):
+        return gzip.decompress(data)
+    if nombre.endswith(".zst"):
+        if zstandard is None:
+            raise ValueError("zstandard no está instalado")
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    return data
+
+
+def firma_tema(info) -> str:
+    """Huella corta de un tema para detectar cambios entre exportaciones."""
+    canon = json.dumps(info, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha1(canon.encode("utf-8")).hexdigest()[:16]
+
+
+def generar_exportacion(formato: str, incremental: bool):
+    """
+    Construye el archivo de /exportar (se ejecuta en un hilo aparte).
+    topics.json se escribe siempre de forma atómica, así que leerlo
+    aquí da una foto consistente del catálogo.
+    Devuelve (bytes, nombre_archivo, resumen, estado_nuevo).
+    """
+    raw = TOPICS_FILE.read_bytes()
+    topics = migrar_topics(json.loads(raw))
+    firmas = {tid: firma_tema(info) for tid, info in topics.items()}
+    ahora = time.time()
+    sello = time.strftime("%Y%m%d-%H%M%S", time.localtime(ahora))
+
+    if incremental:
+        estado = {}
+        if EXPORT_STATE_FILE.exists():
+            with open(EXPORT_STATE_FILE, "r", encoding="utf-8") as f:
+                estado = json.load(f)
+        previas = estado.get("firmas", {})
+        cambiados = {
+            tid: topics[tid] for tid, firma in firmas.items() if previas.get(tid) != firma
+        }
+        borrados = [tid for tid in previas if tid not in firmas]
+        doc = {
+            "incremental": True,
+            "desde": estado.get("at", 0),
+            "hasta": ahora,
+            "cambiados": cambiados,
+            "borrados": borrados,
+        }
+        raw = json.dumps(doc, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        nombre = f"topics-inc-{sello}.json"
+        resumen = f"{len(cambiados)} temas cambiados, {len(borrados)} borrados"
+    else:
+        nombre = f"topics-{sello}.json"
+        resumen = f"{len(topics)} temas"
+
+    if formato != "json":
+        nombre += "." + formato
+    return comprimir(raw, formato), nombre, resumen, {"at": ahora, "firmas": firmas}
+
+
+def rotar_backups():
+    """
+    Guarda una copia comprimida del topics.json de cada grupo y borra las
+    más antiguas: BACKUP_DIR para el principal y backups/ dentro de la
+    carpeta de cada grupo adicional. Lee del disco, no carga ningún grupo.
+    """
+    destinos = []
+    sello = time.strftime("%Y%m%d-%H%M%S")
+    for shard in _SHARDS.values():
+        if not shard.topics_file.exists():
+            continue
+        carpeta = BACKUP_DIR if shard.group_id == GROUP_ID else shard.topics_file.parent / "backups"
+        carpeta.mkdir(parents=True, exist_ok=True)
+        destino = carpeta / f"topics-{sello}.json.gz"
+        tmp = destino.with_name(destino.name + ".tmp")
+        tmp.write_bytes(comprimir(shard.topics_file.read_bytes(), "gz"))
+        os.replace(tmp, destino)
+
+        copias = sorted(carpeta.glob("topics-*.json.gz"))
+        for vieja in copias[:-BACKUP_KEEP] if BACKUP_KEEP > 0 else []:
+            vieja.unlink()
+        destinos.append(destino)
+    return destinos
+
+
+async def backup_job(context: ContextTypes.DEFAULT_TYPE):
+    try:
+        for destino in await asyncio.to_thread(rotar_backups):
+            print("[backup_job] Copia guardada:", destino)
+    except Exception as e:
+        print("[backup_job] ERROR:", e)
+
+
 async def exportar(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """
+    /exportar [gz|zst|json] [inc]
+    Por defecto envía el catálogo completo comprimido con gzip.
+    Con "inc" solo van los temas cambiados o borrados desde la última exportación;
+    /importar lo aplica sobre el catálogo que haya en ese momento.
+    Solo exporta el grupo principal (GROUP_ID), igual que /importar.
+    """
     if update.effective_user.id != OWNER_ID:
         await update.message.reply_text("⛔ No tienes permiso para usar este comando.")
         return
     if not TOPICS_FILE.exists():
         await update.message.reply_text("No existe topics.json.")
         return
-    await update.message.reply_document(document=open(TOPICS_FILE, "rb"), filename="topics.json")
+
+    args = [a.lower() for a in (context.args or [])]
+    formato = "gz"
+    for a in args:
+        if a in ("gz", "zst", "json"):
+            formato = a
+    if formato == "zst" and zstandard is None:
+        await update.message.reply_text("❌ zstd no está disponible en el servidor, usa gz.")
+        return
+    incremental = "inc" in args
+
+    try:
+        data, nombre, resumen, estado = await asyncio.to_thread(
+            generar_exportacion, formato, incremental
+        )
+        await update.message.reply_document(
+            document=data, filename=nombre, caption=f"📦 {resumen}"
+        )
+        await asyncio.to_thread(write_json_atomic, EXPORT_STATE_FILE, estado, None)
+    except Exception as e:
+        print("[exportar] ERROR:", e)
+        await update.message.reply_text("❌ Error al exportar.")
+
+
+def validar_topics(raw):
+    """
+    Comprueba un catálogo importado contra la estructura que espera load_topics.
+    Devuelve (topics_limpios, resumen). Los temas o entradas que no encajan
+    se descartan y se cuentan en resumen["rechazados"].
+    """
+    if version_esquema(raw) > 1:
+        raw = raw["topics"]
+    if not isinstance(raw, dict):
+        raise ValueError("el JSON debe ser un objeto {topic_id: tema}")
+
+    limpio = {}
+    resumen = {"temas": 0, "mensajes": 0, "peliculas": 0, "rechazados": 0}
+
+    for tid, info in raw.items():
+        tid = str(tid)
+        if (
+            not tid.isdigit()
+            or not isinstance(info, dict)
+            or not isinstance(info.get("name"), str)
+            or not info["name"].strip()
+        ):
+            resumen["rechazados"] += 1
+            continue
+
+        crudos = info.get("messages") or []
+        if isinstance(crudos, str):
+            try:
+                mensajes = MessageRuns.decode(crudos)
+            except ValueError:
+                resumen["rechazados"] += 1
+                continue
+        else:
+            mensajes = MessageRuns()
+            for m in crudos:
+                mid = m.get("id") if isinstance(m, dict) else m
+                if isinstance(mid, int) and not isinstance(mid, bool) and mid > 0:
+                    mensajes.add(mid)
+                else:
+                    resumen["rechazados"] += 1
+
+        created_at = info.get("created_at", 0)
+        if not isinstance(created_at, (int, float)) or isinstance(created_at, bool):
+            created_at = 0
+
+        tema = Topic(tid, info["name"], mensajes, created_at, muted=bool(info.get("muted")))
+
+        if info.get("is_pelis"):
+            tema.is_pelis = True
+            peliculas = []
+            for mv in info.get("movies") or []:
+                if (
+                    isinstance(mv, dict)
+                    and isinstance(mv.get("id"), int)
+                    and not isinstance(mv.get("id"), bool)
+                    and isinstance(mv.get("title", ""), str)
+                ):
+                    unique_id = mv.get("unique_id")
+                    peliculas.append(
+                        Movie(
+                            mv["id"],
+                            mv.get("title", ""),
+                            unique_id if isinstance(unique_id, str) else "",
+                        )
+                    )
+                else:
+                    resumen["rechazados"] += 1
+            tema.movies = peliculas
+            resumen["peliculas"] += len(peliculas)
+
+        limpio[tid] = tema
+        resumen["temas"] += 1
+        resumen["mensajes"] += len(mensajes)
+
+    return limpio, resumen
+
+
+_IMPORTACION = {"cambios": None}  # durante un /importar completo: [(registrar_*, msg)] a repetir
+
+
+def aplicar_incremental(topics, nuevos: dict, borrados: list) -> dict:
+    """
+    Aplica una exportación "inc" ya validada sobre el catálogo en memoria
+    (que puede ir por delante del disco): se borran los temas de
+    "borrados" y se sustituyen o añaden los de "cambiados". Sin await.
+    """
+    quitados = 0
+    for tid in borrados:
+        if topics.pop(tid, None) is not None:
+            quitados += 1
+    topics.update(nuevos)
+    return {"cambiados": len(nuevos), "borrados": quitados}
+
+
+def preparar_importacion(src: Path, dst: Path):
+    """
+    Trabajo pesado de /importar (se ejecuta en un hilo aparte): parsea
+    el archivo descargado y lo valida. Devuelve (topics_limpios, resumen,
+    borrados). Una exportación completa queda además limpia en dst; de
+    una incremental (/exportar inc) solo se validan los temas cambiados
+    y borrados es la lista de temas a quitar (None si es completa).
+    """
+    raw = json.loads(descomprimir(src.read_bytes(), src.name).decode("utf-8"))
+    if isinstance(raw, dict) and raw.get("incremental") is True:
+        cambiados = raw.get("cambiados")
+        borrados = raw.get("borrados")
+        if not isinstance(cambiados, dict) or not isinstance(borrados, list):
+            raise ValueError("exportación incremental sin 'cambiados' o 'borrados'")
+        limpio, resumen = validar_topics(cambiados)
+        return limpio, resumen, [str(tid) for tid in borrados]
+
+    limpio, resumen = validar_topics(raw)
+    # Sale ya en el esquema actual: no hace falta migrar después
+    with open(dst, "w", encoding="utf-8") as f:
+        json.dump(
+            {"schema": TOPICS_SCHEMA, "topics": limpio},
+            f,
+            indent=4,
+            ensure_ascii=False,
+            default=_json_default,
+        )
+    return limpio, resumen, None
+
 
 async def importar(update: Update, context: ContextTypes.DEFAULT_TYPE):
     if update.effective_user.id != OWNER_ID:
@@ -1472,24 +5200,153 @@ async def importar(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     doc = update.message.reply_to_message.document
-    if not doc.file_name.endswith(".json"):
-        await update.message.reply_text("❌ El archivo debe ser .json")
+    nombre = doc.file_name or ""
+    extension = next((e for e in (".json", ".json.gz", ".json.zst") if nombre.endswith(e)), None)
+    if extension is None:
+        await update.message.reply_text("❌ El archivo debe ser .json, .json.gz o .json.zst")
+        return
+    if _IMPORTACION["cambios"] is not None:
+        await update.message.reply_text("⏳ Ya hay una importación en marcha.")
         return
 
-    file = await doc.get_file()
-    data = await file.download_as_bytearray()
+    # Temporales en la misma carpeta que topics.json para que el cambio sea atómico
+    descarga = DATA_DIR / f".importar_{update.message.message_id}{extension}"
+    validado = DATA_DIR / f".importar_{update.message.message_id}.ok.json"
+    # Lo que detect apunte mientras se valida en el hilo se repite sobre el catálogo importado
+    _IMPORTACION["cambios"] = []
     try:
-        # Validate JSON
-        json.loads(data.decode("utf-8"))
-        with open(TOPICS_FILE, "wb") as f:
-            f.write(data)
-        await update.message.reply_text("✔ Base de datos importada correctamente.")
+        file = await doc.get_file()
+        await file.download_to_drive(custom_path=descarga)
+        limpio, resumen, borrados = await asyncio.to_thread(preparar_importacion, descarga, validado)
+        shard = _SHARDS[GROUP_ID]
+
+        if borrados is not None:
+            # Incremental: sobre el catálogo en memoria, sin await hasta guardarlo
+            topics = load_topics()
+            if shard.solo_lectura:
+                await update.message.reply_text(
+                    "❌ El catálogo actual no se pudo leer: importa primero una copia completa."
+                )
+                return
+            resumen.update(aplicar_incremental(topics, limpio, borrados))
+            save_topics(topics)
+        elif not limpio:
+            await update.message.reply_text(
+                "❌ El archivo no contiene ningún tema válido. No se ha importado nada."
+            )
+            return
+        else:
+            # Cambio atómico + catálogo en memoria nuevo (sin reiniciar)
+            os.replace(validado, TOPICS_FILE)
+            shard.topics = Catalogo(GROUP_ID, limpio)
+            shard.pendiente = False
+            shard.solo_lectura = False
+            cambios = _IMPORTACION["cambios"]
+            _IMPORTACION["cambios"] = None
+            for registrar, msg in cambios:
+                registrar(msg, guardar=False)
+            if cambios:
+                save_topics(shard.topics, reindex=False)
+                print(f"[importar] {len(cambios)} mensajes llegados durante la importación repetidos")
+
+        # Totales del catálogo que queda, no solo de lo que traía el archivo
+        topics = shard.topics
+        resumen["temas"] = len(topics)
+        resumen["mensajes"] = sum(len(t.messages) for t in topics.values())
+        resumen["peliculas"] = sum(len(t.movies) for t in topics.values())
+
+        incremental = ""
+        if "cambiados" in resumen:
+            incremental = (
+                f"♻️ Incremental: {resumen['cambiados']} temas cambiados, "
+                f"{resumen['borrados']} borrados\n"
+            )
+        await update.message.reply_text(
+            "✔ Base de datos importada correctamente.\n"
+            f"{incremental}"
+            f"📂 Temas: {resumen['temas']}\n"
+            f"✉️ Mensajes: {resumen['mensajes']}\n"
+            f"🍿 Películas: {resumen['peliculas']}\n"
+            f"🚫 Entradas rechazadas: {resumen['rechazados']}"
+        )
     except Exception as e:
+        print("[importar] ERROR:", e)
         await update.message.reply_text("❌ Error al importar el JSON.")
+    finally:
+        _IMPORTACION["cambios"] = None
+        for tmp in (descarga, validado):
+            try:
+                tmp.unlink()
+            except FileNotFoundError:
+                pass
 
 
-def main():
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+# ======================================================
+#   CONEXIONES A LA BOT API
+#   Pools separados para que los reenvíos largos de send_topic
+#   no dejen sin conexiones a las respuestas de los menús:
+#     UPDATES     → getUpdates (long polling)
+#     INTERACTIVE → context.bot: respuestas, ediciones, callbacks
+#     BULK        → cada proceso worker: reenvío de temas completos
+# ======================================================
+def crear_request(pool_size: int, timeout: float, pool_timeout: float, clase=MetricsRequest):
+    return clase(
+        connection_pool_size=pool_size,
+        read_timeout=timeout,
+        write_timeout=timeout,
+        connect_timeout=5.0,
+        pool_timeout=pool_timeout,
+    )
+
+
+async def al_arrancar(app):
+    """post_init: cola de envíos, sesiones y popularidad guardadas, workers, métricas y vigía del bucle."""
+    await cola_db()
+    await cargar_sesiones()
+    cargar_popularidad()
+    for indice in range(DELIVERY_WORKERS):
+        _COLA["workers"][indice] = lanzar_worker(indice)
+    await start_metrics_server(app)
+    arrancar_vigia()
+
+
+async def al_apagar(app):
+    """post_shutdown: deja el snapshot al día para el próximo arranque y cierra conexiones."""
+    parar_vigia()
+    for shard in _SHARDS.values():
+        if shard.topics is not None and not shard.pendiente and shard.topics_file.exists():
+            await asyncio.to_thread(escribir_snapshot, shard)
+    await stop_metrics_server(app)
+    # Un envío a medias queda en la cola y lo retoma un worker en el próximo arranque
+    await asyncio.to_thread(parar_workers)
+    if _COLA["db"] is not None:
+        await _COLA["db"].close()
+        _COLA["db"] = None
+    await cerrar_sesiones()
+    await guardar_popularidad()
+    await cerrar_bot_barrido()
+
+
+# Tipos de update que usan los handlers: Telegram no manda el resto
+ALLOWED_UPDATES = [Update.MESSAGE, Update.EDITED_MESSAGE, Update.CALLBACK_QUERY, Update.INLINE_QUERY]
+
+
+def build_app():
+    """Crea la Application con todos los handlers y trabajos periódicos."""
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(crear_request(INTERACTIVE_POOL_SIZE, INTERACTIVE_TIMEOUT, INTERACTIVE_POOL_TIMEOUT))
+        .get_updates_request(crear_request(UPDATES_POOL_SIZE, UPDATES_TIMEOUT, 1.0, clase=HTTPXRequest))
+        .post_init(al_arrancar)
+        .post_shutdown(al_apagar)
+    )
+    if BOT_API_BASE_URL:
+        builder = builder.base_url(BOT_API_BASE_URL)
+    app = builder.build()
+
+    # Ediciones: antes que nada, porque comandos y MessageHandler también las reciben
+    app.add_handler(MessageHandler(filters.UpdateType.EDITED_MESSAGE, on_edited_message))
 
     # Comandos usuario
     app.add_handler(CommandHandler("start", start))
@@ -1503,6 +5360,11 @@ def main():
     app.add_handler(CommandHandler("silencio", silencio))
     app.add_handler(CommandHandler("activar", activar))
     app.add_handler(CommandHandler("usuarios", usuarios))
+    app.add_handler(CommandHandler("sesiones", sesiones))
+    app.add_handler(CommandHandler("stats", stats))
+    app.add_handler(CommandHandler("salud", salud))
+    app.add_handler(CommandHandler("top", top))
+    app.add_handler(CommandHandler("perfil", perfil))
     app.add_handler(CommandHandler("exportar", exportar))
     app.add_handler(CommandHandler("importar", importar))
 
@@ -1510,8 +5372,11 @@ def main():
     app.add_handler(CallbackQueryHandler(on_letter, pattern=r"^letter:"))
     app.add_handler(CallbackQueryHandler(on_page, pattern=r"^page:"))
     app.add_handler(CallbackQueryHandler(on_main_menu, pattern=r"^main_menu$"))
+    app.add_handler(CallbackQueryHandler(on_grupos_btn, pattern=r"^grupos$"))
+    app.add_handler(CallbackQueryHandler(on_grupo, pattern=r"^grupo:(-?\d+|todos)$"))
     app.add_handler(CallbackQueryHandler(on_search_btn, pattern=r"^search$"))
     app.add_handler(CallbackQueryHandler(on_recent_btn, pattern=r"^recent$"))
+    app.add_handler(CallbackQueryHandler(on_popular_btn, pattern=r"^populares$"))
     app.add_handler(CallbackQueryHandler(on_pelis_btn, pattern=r"^pelis$"))
     app.add_handler(CallbackQueryHandler(on_pelis_page, pattern=r"^pelis_page:"))
 
@@ -1526,15 +5391,71 @@ def main():
     app.add_handler(CallbackQueryHandler(send_peli_message, pattern=r"^pelis_msg:"))
     app.add_handler(CallbackQueryHandler(on_users_page, pattern=r"^users_page:"))
 
+    # Búsqueda inline (@bot término)
+    app.add_handler(InlineQueryHandler(on_inline_query))
+
     # Búsqueda por texto en privado (series o pelis según modo)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, search_text))
 
     # Guardar mensajes de temas (en grupo)
     app.add_handler(MessageHandler(filters.ALL & ~filters.COMMAND, detect))
 
+    # Métricas de duración y errores en todos los handlers
+    for grupo in app.handlers.values():
+        for handler in grupo:
+            handler.callback = medir_handler(handler.callback)
+
+    # Copias de seguridad periódicas en /data/backups
+    if app.job_queue is not None and BACKUP_INTERVAL_HOURS > 0:
+        app.job_queue.run_repeating(
+            backup_job, interval=BACKUP_INTERVAL_HOURS * 3600, first=60
+        )
+
+    # Limpieza de sesiones caducadas y guardado de las que cambiaron
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(session_purge_job, interval=300, first=300)
+        app.job_queue.run_repeating(sesiones_flush_job, interval=SESSION_FLUSH_SECONDS, first=SESSION_FLUSH_SECONDS)
+    # Contadores de popularidad a disco y cachés precalentadas tras arrancar
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(popularidad_job, interval=POPULAR_FLUSH_SECONDS, first=POPULAR_FLUSH_SECONDS)
+        app.job_queue.run_once(precalentar_job, when=5)
+    # Progreso y avisos de la cola de envíos (y relanzar workers caídos)
+    if app.job_queue is not None:
+        app.job_queue.run_repeating(envios_job, interval=DELIVERY_POLL_SECONDS, first=DELIVERY_POLL_SECONDS)
+    # Saca de memoria los catálogos de grupos adicionales sin uso
+    if app.job_queue is not None and len(GROUP_IDS) > 1 and SHARD_IDLE_SECONDS > 0:
+        app.job_queue.run_repeating(shard_idle_job, interval=300, first=300)
+
+    # Barrido de integridad del catálogo (solo con un chat de pruebas configurado)
+    if app.job_queue is not None and SWEEP_CHAT_ID and SWEEP_RATE > 0:
+        app.job_queue.run_repeating(barrido_job, interval=SWEEP_TICK_SECONDS, first=SWEEP_TICK_SECONDS)
+
+    return app
+
+
+def main():
+    load_topics()  # migra topics.json si hace falta y deja el catálogo en memoria
+    if _SHARDS[GROUP_ID].solo_lectura:
+        # Arrancar con el catálogo vacío acabaría sobrescribiendo topics.json
+        sys.exit(
+            f"No se pudo leer {TOPICS_FILE}: el bot no arranca. "
+            "Revisa el archivo o restaura una copia de backups/."
+        )
+    print(f"Catálogo en memoria a los {(time.perf_counter() - _ARRANQUE) * 1000:.0f} ms")
+    app = build_app()
     print("BOT LISTO ✔")
-    app.run_polling()
+    if WEBHOOK_URL:
+        print(
+            f"Webhook en {WEBHOOK_URL}/{WEBHOOK_PATH} y health check en {HEALTH_PATH}"
+            f" (escuchando en {WEBHOOK_LISTEN}:{WEBHOOK_PORT})"
+        )
+        asyncio.run(servir_webhook(app))
+    else:
+        app.run_polling(allowed_updates=ALLOWED_UPDATES)
 
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["worker"]:
+        asyncio.run(worker_envios(int(sys.argv[2]) if len(sys.argv) > 2 else 0))
+    else:
+        main()